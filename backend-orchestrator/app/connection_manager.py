@@ -1,51 +1,263 @@
 from fastapi import WebSocket
-from typing import Dict, List, Set, DefaultDict
+from typing import Callable, Dict, List, Optional, Set, DefaultDict, Tuple, Union
 from collections import defaultdict
+from .transcript_store import TranscriptSegment
+from .room_backend import create_room_backend
+from .transcript_updates import TranscriptCoalescer, BATCH_PREFIX, apply_batch, full_messages, pack
+from .metrics import ACTIVE_ROOMS, ACTIVE_CONNECTIONS, SEND_QUEUE_DEPTH, BROADCAST_SECONDS, DROPPED_MESSAGES
 import asyncio
+import json
+import os
+import time
 
-RoomTranscriptStore = DefaultDict[str, Dict[str, str]]
+# Messages a client may fall behind by before it is dropped as a slow consumer
+SEND_QUEUE_MAXSIZE = int(os.getenv("SEND_QUEUE_MAXSIZE", "64"))
+ROOM_SWEEP_INTERVAL_SECONDS = 60
+
+class ClientConnection:
+    """A client socket fed by its own bounded queue and writer task.
+
+    Broadcasts only enqueue already-encoded messages, so one stalled client never holds
+    up the rest of the room. `updates` and `encoding` are the wire format the client
+    chose when it connected. If a send fails, the writer stops and `on_failed` is called.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, maxsize: int = SEND_QUEUE_MAXSIZE,
+                 updates: str = "full", encoding: str = "json",
+                 on_failed: Optional[Callable[["ClientConnection"], None]] = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.updates = updates
+        self.encoding = encoding
+        self.on_failed = on_failed
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.writer = asyncio.create_task(self._write())
+
+    def offer(self, payload: Union[str, bytes]) -> bool:
+        """Queues a message; False means the client is too far behind (or gone)."""
+        if self.writer.done():
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+            except Exception as e:
+                print(f"Could not send to {self.user_id}, closing their connection: {e!r}")
+                if self.on_failed:
+                    self.on_failed(self)
+                return
+
+    async def close(self, code: int = None):
+        self.writer.cancel()
+        if code is not None:
+            try:
+                await self.websocket.close(code=code)
+            except Exception:
+                pass
 
 class ConnectionManager:
+    """This worker's client sockets, on top of a room backend that holds shared state.
+
+    Broadcasts are published through the backend and come back through `_deliver` on
+    every worker that has sockets in the room, this one included.
+    """
+
     def __init__(self):
         self.active_rooms: DefaultDict[str, Set[WebSocket]] = defaultdict(set)
-        self.transcripts: RoomTranscriptStore = defaultdict(lambda: defaultdict(str))
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self.backend = create_room_backend()
+        # Transcript events from this worker's speakers, per room
+        self.coalescers: Dict[str, TranscriptCoalescer] = {}
+        # Each room's current partial per speaker, as delivered here
+        self.partials: Dict[str, Dict[str, str]] = {}
         self.lock = asyncio.Lock()
+        # Called with the room code once a room's data is cleared, for state kept elsewhere
+        self.on_clear: List[Callable[[str], None]] = []
+        self._sweeper = None
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+        await self.backend.stop()
 
-    async def connect(self, room_code: str, websocket: WebSocket):
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(ROOM_SWEEP_INTERVAL_SECONDS)
+            evicted = await self.backend.sweep()
+            if evicted:
+                print(f"Evicted {len(evicted)} idle room(s): {', '.join(evicted)}")
+
+    async def connect(self, room_code: str, websocket: WebSocket, user_id: str,
+                      updates: str = "full", encoding: str = "json"):
         await websocket.accept()
         async with self.lock:
             self.active_rooms[room_code].add(websocket)
+            self.connections[websocket] = ClientConnection(
+                websocket, user_id, updates=updates, encoding=encoding,
+                on_failed=lambda connection: self._discard(room_code, websocket, connection, "dead_consumer"),
+            )
+        await self.backend.join(room_code, user_id)
+
+    def _remove(self, room_code: str, websocket: WebSocket):
+        room = self.active_rooms.get(room_code)
+        if room is not None:
+            room.discard(websocket)
+            if not room:
+                del self.active_rooms[room_code]
+                self.partials.pop(room_code, None)
+        return self.connections.pop(websocket, None)
 
-    async def disconnect(self, room_code: str, websocket: WebSocket):
+    async def disconnect(self, room_code: str, websocket: WebSocket, code: int = None):
         async with self.lock:
-            if websocket in self.active_rooms[room_code]:
-                self.active_rooms[room_code].remove(websocket)
+            connection = self._remove(room_code, websocket)
+        if connection:
+            await connection.close(code)
+            await self.backend.leave(room_code, connection.user_id)
+
+    async def _drop(self, room_code: str, connection: ClientConnection):
+        # 1008: policy violation - the client stopped reading
+        await connection.close(code=1008)
+        try:
+            await self.backend.leave(room_code, connection.user_id)
+        except Exception as e:
+            print(f"Could not remove {connection.user_id} from room {room_code}: {e}")
 
     def get_users_in_room(self, room_code: str) -> Set[WebSocket]:
+        """Sockets in the room connected to this worker."""
         return self.active_rooms.get(room_code, set())
-        
-    def add_transcript(self, room_code: str, user_id: str, text: str):
-        self.transcripts[room_code][user_id] += text + " "
 
-    def get_final_transcripts(self, room_code: str) -> Dict[str, str]:
-        return self.transcripts.get(room_code, {})
+    async def get_room_members(self, room_code: str) -> Set[str]:
+        """User ids in the room across every worker."""
+        return await self.backend.room_members(room_code)
+
+    async def add_transcript(self, room_code: str, user_id: str, text: str, seq: Optional[int] = None,
+                             start: Optional[float] = None, end: Optional[float] = None,
+                             connection: Optional[str] = None):
+        await self.backend.add_segment(room_code, TranscriptSegment(seq, user_id, start, end, text, connection))
+
+    async def get_final_transcripts(self, room_code: str) -> Dict[str, str]:
+        return await self.backend.get_transcripts(room_code)
+
+    async def get_segments(self, room_code: str) -> List[TranscriptSegment]:
+        return await self.backend.get_segments(room_code)
+
+    async def add_stt_session(self, room_code: str, user_id: str, session_id: str):
+        await self.backend.add_stt_session(room_code, user_id, session_id)
+
+    async def get_stt_sessions(self, room_code: str) -> List[Tuple[str, str]]:
+        """(user_id, STT session id) of every stream opened in the room, oldest first."""
+        return await self.backend.get_stt_sessions(room_code)
+
+    async def set_delivery(self, room_code: str, user_id: str, stats: dict):
+        await self.backend.set_delivery(room_code, user_id, stats)
+
+    async def get_delivery(self, room_code: str) -> Dict[str, dict]:
+        """Each speaker's latest delivery figures (see delivery.py), across every worker."""
+        return await self.backend.get_delivery(room_code)
+
+    async def clear_room_data(self, room_code: str):
+        await self.flush_transcripts(room_code)
+        await self.backend.clear(room_code)
+        for callback in self.on_clear:
+            callback(room_code)
+
+    def _enqueue(self, room_code: str, websocket: WebSocket, payloads: List[Union[str, bytes]]) -> bool:
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return False
+        if all(connection.offer(payload) for payload in payloads):
+            return True
+        self._discard(room_code, websocket, connection, "slow_consumer")
+        return False
+
+    def _discard(self, room_code: str, websocket: WebSocket, connection: ClientConnection, reason: str):
+        if self.connections.get(websocket) is not connection:
+            return  # already gone
+        # Removed right away so later broadcasts skip it; the close itself can take a while
+        self._remove(room_code, websocket)
+        DROPPED_MESSAGES.labels(reason).inc()
+        print(f"Dropping {reason.replace('_', ' ')} in room {room_code}.")
+        asyncio.create_task(self._drop(room_code, connection))
+
+    def _deliver(self, room_code: str, text: str):
+        started = time.perf_counter()
+        message = applied = None
+        if text.startswith(BATCH_PREFIX):
+            # Followed even with no "full" clients here, so one that joins later starts right
+            message = json.loads(text)
+            applied = apply_batch(self.partials.setdefault(room_code, {}), message)
+        # Each wire format is encoded at most once per message, however many clients use it
+        encoded = {}
+        for websocket in list(self.get_users_in_room(room_code)):
+            connection = self.connections.get(websocket)
+            if connection is None:
+                continue
+            key = (connection.updates if applied is not None else None, connection.encoding)
+            if key not in encoded:
+                if key[0] == "full":
+                    messages = full_messages(applied)
+                    encoded[key] = [pack(m) if key[1] == "msgpack" else json.dumps(m) for m in messages]
+                elif key[1] == "msgpack":
+                    encoded[key] = [pack(message if message is not None else json.loads(text))]
+                else:
+                    encoded[key] = [text]
+            self._enqueue(room_code, websocket, encoded[key])
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
 
-    def clear_room_data(self, room_code: str):
-        if room_code in self.transcripts:
-            del self.transcripts[room_code]
-        
     async def broadcast_json(self, room_code: str, message: dict):
-        connections = self.get_users_in_room(room_code)
-        for connection in connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Error sending to a websocket: {e}")
+        # Transcript updates already queued for the room go out first, to keep the order
+        coalescer = self.coalescers.get(room_code)
+        if coalescer:
+            await coalescer.flush()
+        # Encoded once, however many clients are in the room
+        await self.backend.publish(room_code, json.dumps(message))
+
+    def queue_transcript(self, room_code: str, message: dict) -> asyncio.Future:
+        """Adds a transcript message to the room's next batch; the future is done once it is sent."""
+        coalescer = self.coalescers.get(room_code)
+        if coalescer is None:
+            coalescer = self.coalescers[room_code] = TranscriptCoalescer(room_code, self.backend.publish)
+        return coalescer.add(message)
+
+    async def flush_transcripts(self, room_code: str):
+        """Sends the room's pending transcript updates and drops its coalescer.
+
+        Speakers still talking simply get a new one; their next partial goes out whole.
+        """
+        coalescer = self.coalescers.pop(room_code, None)
+        if coalescer:
+            await coalescer.flush()
 
     async def send_personal_json(self, websocket: WebSocket, message: dict):
-        try:
-            await websocket.send_json(message)
-        except Exception as e:
-            print(f"Error sending personal message: {e}")
+        # Goes through the same queue so it stays ordered with broadcasts
+        for room_code, connections in self.active_rooms.items():
+            if websocket in connections:
+                connection = self.connections[websocket]
+                payload = pack(message) if connection.encoding == "msgpack" else json.dumps(message)
+                self._enqueue(room_code, websocket, [payload])
+                return
 
 manager = ConnectionManager()
+
+# Read at scrape time, so the hot paths pay nothing for them
+ACTIVE_ROOMS.set_function(lambda: len(manager.active_rooms))
+ACTIVE_CONNECTIONS.set_function(lambda: len(manager.connections))
+SEND_QUEUE_DEPTH.set_function(lambda: sum(c.queue.qsize() for c in list(manager.connections.values())))
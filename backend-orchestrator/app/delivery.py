@@ -0,0 +1,191 @@
+import os
+import numpy as np
+from typing import Dict, Optional
+from .connection_manager import manager
+from .metrics import AUDIO_BYTES_PER_SECOND
+
+# Frame RMS (full scale = 1) above which a frame counts as voiced; the STT service's VAD default
+DELIVERY_ENERGY_THRESHOLD = float(os.getenv("DELIVERY_ENERGY_THRESHOLD", "0.01"))
+# Silence shorter than this is part of a spurt; longer is a pause, and gives up the floor
+DELIVERY_MIN_PAUSE_MS = int(os.getenv("DELIVERY_MIN_PAUSE_MS", "250"))
+# A speaker's running figures are shared with the room at least this often (seconds of audio)
+DELIVERY_PUBLISH_SECONDS = 5
+FRAME_MS = 20
+FRAME_BYTES = AUDIO_BYTES_PER_SECOND * FRAME_MS // 1000
+# Lower edges (s) of the pause histogram's buckets; the last one is open-ended
+PAUSE_BINS = (0.25, 0.5, 1, 2, 4)
+
+class DeliveryTracker:
+    """How one speaker talks, from their PCM as it streams in.
+
+    Every 20 ms frame is classified voiced or not by its RMS, a whole message at a time.
+    Runs of voiced frames bridged by short gaps are spurts; the silences between them are
+    pauses. Only running totals are kept: talk time, spurt and pause counts, a pause
+    histogram, the mean and variance of voiced loudness (in dBFS), and interruptions,
+    so the figures are ready at debate end without touching the audio again.
+    """
+
+    def __init__(self, stats: Optional[dict] = None):
+        self.frames = 0
+        self.talk_frames = 0
+        self.spurts = 0
+        self.pause_frames = 0
+        self.pause_histogram = [0] * len(PAUSE_BINS)
+        # Loudness of voiced frames: count, mean and sum of squared deviations (Welford)
+        self.voiced = 0
+        self.loudness = 0.0
+        self.loudness_m2 = 0.0
+        self.interruptions = 0
+        self.speaking = False
+        self.started = False  # a spurt began since the room last heard from us
+        self._silent_frames = 0
+        self._partial = b""
+        self._min_pause = max(1, DELIVERY_MIN_PAUSE_MS // FRAME_MS)
+        if stats:
+            self._resume(stats)
+
+    def _resume(self, stats: dict):
+        """Carries on from a previous connection's figures, so a reconnect does not reset them."""
+        frames_per_second = 1000 // FRAME_MS
+        self.frames = round(stats["audio_seconds"] * frames_per_second)
+        self.talk_frames = round(stats["talk_seconds"] * frames_per_second)
+        self.spurts = stats["spurts"]
+        self.pause_frames = round(stats["pause_seconds"] * frames_per_second)
+        self.pause_histogram = list(stats["pause_histogram"])
+        self.voiced = stats["voiced_frames"]
+        self.loudness = stats["loudness_db"]
+        self.loudness_m2 = stats["loudness_std_db"] ** 2 * self.voiced
+        self.interruptions = stats["interruptions"]
+
+    def feed(self, chunk: bytes) -> bool:
+        """Takes in one audio message; True when the speaker took or gave up the floor."""
+        data = self._partial + chunk
+        usable = len(data) // FRAME_BYTES * FRAME_BYTES
+        self._partial = data[usable:]
+        if not usable:
+            return False
+        frames = np.frombuffer(data, dtype=np.int16, count=usable // 2).reshape(-1, FRAME_BYTES // 2)
+        rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1)) / 32768
+        voiced = rms > DELIVERY_ENERGY_THRESHOLD
+        self.frames += len(frames)
+
+        if voiced.any():
+            levels = 20 * np.log10(rms[voiced])
+            count, mean = len(levels), float(levels.mean())
+            m2 = float(np.square(levels - mean).sum())
+            # Chan et al.: merge the message's mean and variance into the running ones
+            total = self.voiced + count
+            delta = mean - self.loudness
+            self.loudness += delta * count / total
+            self.loudness_m2 += m2 + delta * delta * self.voiced * count / total
+            self.voiced = total
+
+        # Walk the runs of equal frames, not the frames: a message holds only a few
+        changed = False
+        starts = np.concatenate(([0], np.flatnonzero(voiced[1:] != voiced[:-1]) + 1))
+        lengths = np.diff(np.append(starts, len(voiced)))
+        for start, length in zip(starts.tolist(), lengths.tolist()):
+            if voiced[start]:
+                if self.speaking:
+                    self.talk_frames += self._silent_frames  # a gap inside the spurt
+                else:
+                    if self.spurts:
+                        self._add_pause(self._silent_frames)
+                    self.spurts += 1
+                    self.speaking = self.started = changed = True
+                self.talk_frames += length
+                self._silent_frames = 0
+            else:
+                self._silent_frames += length
+                if self.speaking and self._silent_frames >= self._min_pause:
+                    self.speaking = False
+                    changed = True
+        return changed
+
+    def _add_pause(self, frames: int):
+        self.pause_frames += frames
+        bucket = int(np.searchsorted(PAUSE_BINS, frames * FRAME_MS / 1000, side="right")) - 1
+        self.pause_histogram[max(0, bucket)] += 1
+
+    def as_dict(self) -> dict:
+        seconds = FRAME_MS / 1000
+        return {
+            "audio_seconds": round(self.frames * seconds, 2),
+            "talk_seconds": round(self.talk_frames * seconds, 2),
+            "spurts": self.spurts,
+            "pauses": sum(self.pause_histogram),
+            "pause_seconds": round(self.pause_frames * seconds, 2),
+            "pause_histogram": self.pause_histogram,
+            "voiced_frames": self.voiced,
+            "loudness_db": round(self.loudness, 2),
+            "loudness_std_db": round((self.loudness_m2 / self.voiced) ** 0.5, 2) if self.voiced else 0.0,
+            "interruptions": self.interruptions,
+            "speaking": self.speaking,
+        }
+
+class SpeakerDelivery:
+    """A speaker's DeliveryTracker, shared with the rest of the room through the room backend.
+
+    The figures are published when the speaker takes or gives up the floor, and every
+    DELIVERY_PUBLISH_SECONDS of audio in between. Starting a spurt while anyone else in
+    the room holds the floor counts as an interruption. Once the room's figures are
+    cleared at debate end, this speaker's stop being published.
+    """
+
+    def __init__(self, room_code: str, user_id: str):
+        self.room_code = room_code
+        self.user_id = user_id
+        self.tracker: Optional[DeliveryTracker] = None
+        self.closed = False
+        self._published = False  # the room holds figures of ours
+        self._published_frames = 0
+
+    async def start(self):
+        previous = (await manager.get_delivery(self.room_code)).get(self.user_id)
+        self.tracker = DeliveryTracker(previous)
+        self._published = previous is not None
+        self._published_frames = self.tracker.frames
+
+    async def feed(self, chunk: bytes):
+        if self.closed:
+            return
+        changed = self.tracker.feed(chunk)
+        due = self.tracker.frames - self._published_frames >= DELIVERY_PUBLISH_SECONDS * 1000 // FRAME_MS
+        if changed or due:
+            await self.publish()
+
+    async def publish(self):
+        tracker = self.tracker
+        room = await manager.get_delivery(self.room_code)
+        if self._published and self.user_id not in room:
+            # The debate ended and its room was cleared; these figures belong to no later one
+            self.closed = True
+            return
+        if tracker.started:
+            tracker.started = False
+            if any(stats.get("speaking") for user_id, stats in room.items() if user_id != self.user_id):
+                tracker.interruptions += 1
+        self._published_frames = tracker.frames
+        await manager.set_delivery(self.room_code, self.user_id, tracker.as_dict())
+        self._published = True
+
+    async def close(self):
+        """The stream ended: whatever the speaker was saying is over. Only the first call publishes."""
+        if self.closed:
+            return
+        self.tracker.speaking = False
+        await self.publish()
+        self.closed = True
+
+def speaking_rates(delivery: Dict[str, dict], words: Dict[str, int]) -> Dict[str, dict]:
+    """Adds each speaker's share of the room's talk time, and words per minute of their own."""
+    room_talk = sum(stats["talk_seconds"] for stats in delivery.values())
+    rates = {}
+    for user_id, stats in delivery.items():
+        talk = stats["talk_seconds"]
+        rates[user_id] = dict(
+            stats,
+            talk_share=round(talk / room_talk, 3) if room_talk else None,
+            words_per_minute=round(60 * words[user_id] / talk, 1) if talk and user_id in words else None,
+        )
+    return rates
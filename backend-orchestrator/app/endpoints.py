@@ -1,9 +1,16 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from .connection_manager import manager
-from .services import stt_client_handler, mock_llm_judge
+from .services import stt_client_handler, final_pass_segments, AudioQueue, AUDIO_CODECS
+from .stt_pool import STT_FINAL_PASS
+from .judge import judge_engine
+from .delivery import SpeakerDelivery
+from .transcript_store import TranscriptSegment
+from .metrics import SegmentTracer, TRACE_SPANS, AUDIO_BYTES
+from .transcript_updates import UPDATE_MODES, encoding_error
 from .models import WsMsg_Transcript, WsMsg_DebateState, WsMsg_Error
 import asyncio
 import secrets
+import time
 import json
 
 router = APIRouter()
@@ -13,9 +20,34 @@ async def create_room():
     room_code = secrets.token_urlsafe(6).upper().replace("_", "-")
     return {"room_code": room_code}
 
+@router.get("/api/v1/rooms/{room_code}")
+async def get_room(room_code: str):
+    return {"room_code": room_code, "members": sorted(await manager.get_room_members(room_code))}
+
+async def reject(websocket: WebSocket, error: str):
+    """Turns a client away before it joins, explaining why."""
+    await websocket.accept()
+    await websocket.send_json(WsMsg_Error(user_id="system", error=error).dict())
+    await websocket.close(code=1003)
+
 @router.websocket("/ws/{room_code}/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, room_code: str, user_id: str):
-    await manager.connect(room_code, websocket)
+    # ?codec= is what the client sends; ?updates= and ?encoding= are what it wants back
+    codec = websocket.query_params.get("codec", "pcm")
+    updates = websocket.query_params.get("updates", "full")
+    encoding = websocket.query_params.get("encoding", "json")
+    if codec not in AUDIO_CODECS:
+        await reject(websocket, f"Unsupported audio codec '{codec}'. Use one of: {', '.join(AUDIO_CODECS)}.")
+        return
+    if updates not in UPDATE_MODES:
+        await reject(websocket, f"Unsupported update mode '{updates}'. Use one of: {', '.join(UPDATE_MODES)}.")
+        return
+    error = encoding_error(encoding)
+    if error:
+        await reject(websocket, error)
+        return
+
+    await manager.connect(room_code, websocket, user_id, updates, encoding)
     print(f"User {user_id} connected to room {room_code}")
 
     await manager.broadcast_json(room_code, WsMsg_DebateState(
@@ -23,9 +55,17 @@ async def websocket_endpoint(websocket: WebSocket, room_code: str, user_id: str)
         message=f"{user_id} has joined the debate."
     ).dict())
 
-    audio_to_stt_queue = asyncio.Queue()
+    audio_to_stt_queue = AudioQueue()
+    audio_bytes = AUDIO_BYTES.labels(codec)
+    # Spans map byte counts to stream time, which only raw PCM allows
+    tracer = SegmentTracer(room_code, user_id) if TRACE_SPANS and codec == "pcm" else None
+    # Delivery figures come from the samples themselves; encoded packets are only decoded by the STT service
+    delivery = SpeakerDelivery(room_code, user_id) if codec == "pcm" else None
+    if delivery:
+        await delivery.start()
 
     async def on_transcript_received(transcript_data: dict):
+        arrived = time.perf_counter()
         if transcript_data.get("type") == "error":
             await manager.send_personal_json(websocket, WsMsg_Error(
                 user_id="system",
@@ -36,41 +76,76 @@ async def websocket_endpoint(websocket: WebSocket, room_code: str, user_id: str)
         msg = WsMsg_Transcript(
             user_id=user_id,
             text=transcript_data.get("text", ""),
-            is_final=transcript_data.get("is_final", False)
+            is_final=transcript_data.get("is_final", False),
+            seq=transcript_data.get("seq"),
+            start=transcript_data.get("start"),
+            end=transcript_data.get("end"),
+            language=transcript_data.get("language"),
+            queue_depth=transcript_data.get("queue_depth"),
+            audio_queue_depth=audio_to_stt_queue.qsize(),
+            degraded=transcript_data.get("degraded", False),
+            tier=transcript_data.get("tier")
         )
         
         if msg.is_final and msg.text:
-            manager.add_transcript(room_code, user_id, msg.text)
+            await manager.add_transcript(room_code, user_id, msg.text, msg.seq, msg.start, msg.end, connection_id)
+            judge_engine.add_segment(room_code, TranscriptSegment(msg.seq, user_id, msg.start, msg.end, msg.text,
+                                                                  connection_id))
 
-        await manager.broadcast_json(room_code, msg.dict())
+        sent = manager.queue_transcript(room_code, msg.dict())
+        if tracer and msg.is_final and msg.end is not None:
+            sent.add_done_callback(lambda _: tracer.record(transcript_data, arrived, time.perf_counter()))
     
+    # Tells this connection's segments from an earlier one's of the same speaker, whose seq
+    # and start restarted from 0; also names its audio on the STT service for the final pass
+    connection_id = secrets.token_hex(8)
+    stt_session = None
+    if STT_FINAL_PASS:
+        stt_session = connection_id
+        await manager.add_stt_session(room_code, user_id, stt_session)
+
     stt_task = asyncio.create_task(
-        stt_client_handler(audio_to_stt_queue, on_transcript_received)
+        stt_client_handler(audio_to_stt_queue, on_transcript_received, websocket.query_params.get("language"), codec,
+                           stt_session)
     )
+    # Once the STT stream is over, however it ended, audio is dropped instead of queued
+    stt_task.add_done_callback(lambda _: audio_to_stt_queue.close())
 
     try:
         while True:
             data = await websocket.receive()
+            if data["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(data.get("code", 1000))
             
-            if "bytes" in data:
-                await audio_to_stt_queue.put(data["bytes"])
+            if data.get("bytes") is not None:
+                audio_bytes.inc(len(data["bytes"]))
+                if tracer:
+                    tracer.on_audio(len(data["bytes"]))
+                if delivery:
+                    await delivery.feed(data["bytes"])
+                await audio_to_stt_queue.put_audio(data["bytes"])
             
-            elif "text" in data:
+            elif data.get("text") is not None:
                 message = json.loads(data["text"])
                 
                 if message.get("event") == "debate_end":
                     print(f"Debate end triggered by {user_id} in room {room_code}.")
-                    await audio_to_stt_queue.put(None) 
+                    if not audio_to_stt_queue.closed:
+                        await audio_to_stt_queue.put(None)
                     await stt_task
-                    
-                    final_transcripts = manager.get_final_transcripts(room_code)
+                    if delivery:
+                        await delivery.close()
                     
                     await manager.broadcast_json(room_code, WsMsg_DebateState(
                         user_id="system",
                         message="Debate ended. Awaiting judgment..."
                     ).dict())
                     
-                    judge_result = await mock_llm_judge(final_transcripts)
+                    final_pass = None
+                    if STT_FINAL_PASS:
+                        # Other speakers may still be streaming; their pass covers what was said so far
+                        final_pass = await final_pass_segments(await manager.get_stt_sessions(room_code))
+                    judge_result = await judge_engine.verdict(room_code, final_pass)
                     
                     await manager.broadcast_json(room_code, {
                         "type": "judge_result",
@@ -78,18 +153,26 @@ async def websocket_endpoint(websocket: WebSocket, room_code: str, user_id: str)
                         "data": judge_result.dict()
                     })
                     
-                    manager.clear_room_data(room_code)
+                    await manager.clear_room_data(room_code)
 
     except WebSocketDisconnect:
         print(f"User {user_id} disconnected from room {room_code}")
     
     finally:
         if not stt_task.done():
-            await audio_to_stt_queue.put(None)
+            # No sentinel here: with a full queue and a dead STT stream it would never be taken
             stt_task.cancel()
+        # Already closed at debate end, before the room was cleared
+        if delivery and not delivery.closed:
+            try:
+                await delivery.close()
+            except Exception as e:
+                print(f"Could not publish delivery figures of {user_id} in room {room_code}: {e}")
         
+        await manager.disconnect(room_code, websocket)
         await manager.broadcast_json(room_code, WsMsg_DebateState(
             user_id="system",
             message=f"{user_id} has left the debate."
         ).dict())
-        manager.disconnect(room_code, websocket)
+        if not manager.get_users_in_room(room_code):
+            await manager.flush_transcripts(room_code)
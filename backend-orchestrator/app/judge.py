@@ -0,0 +1,333 @@
+import os
+import re
+import time
+import asyncio
+import aiohttp
+from typing import Dict, List, Optional
+from .models import (JudgeResult, JudgeScores, ScoreSet, JudgeFeedback, JudgeDelivery, DeliveryStats, JudgeEvaluation,
+                     WsMsg_ProvisionalScores)
+from .transcript_store import TranscriptSegment
+from .connection_manager import manager
+from .delivery import speaking_rates
+from .room_backend import ROOM_IDLE_TTL_SECONDS
+from .metrics import JUDGE_SECONDS
+
+# Stub or real LLM judge exposing POST /evaluate; unset uses the built-in mock judge
+JUDGE_BACKEND_URL = os.getenv("JUDGE_BACKEND_URL")
+# Judge calls in flight across all rooms on this worker
+JUDGE_MAX_CONCURRENCY = int(os.getenv("JUDGE_MAX_CONCURRENCY", "4"))
+# A room is re-evaluated (and provisional scores are sent) after this many new final segments
+JUDGE_EVAL_EVERY_SEGMENTS = int(os.getenv("JUDGE_EVAL_EVERY_SEGMENTS", "4"))
+# Simulated thinking time of the mock judge, per call
+JUDGE_MOCK_DELAY_SECONDS = float(os.getenv("JUDGE_MOCK_DELAY_SECONDS", "0"))
+JUDGE_HTTP_TIMEOUT_SECONDS = 60
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+LOGIC_WORDS = {"because", "therefore", "thus", "hence", "so", "since", "first", "second", "finally",
+               "however", "although", "consequently", "if", "then", "means"}
+EVIDENCE_WORDS = {"study", "studies", "data", "research", "percent", "evidence", "statistics",
+                  "according", "report", "survey", "example", "shows", "found"}
+EMOTION_WORDS = {"feel", "believe", "imagine", "love", "fear", "hope", "terrible", "amazing",
+                 "unfair", "heart", "children", "families", "suffer", "dream"}
+FILLER_WORDS = {"um", "uh", "er", "like", "basically", "actually", "literally"}
+# Speaking rates (words per minute) that are easy to follow; clarity drops a point per 25 wpm outside
+COMFORTABLE_WPM = (110, 180)
+
+class SpeakerFeatures:
+    """Running per-speaker counts, updated one segment at a time."""
+
+    __slots__ = ("segments", "words", "speaking_seconds", "logic", "evidence", "emotion",
+                 "fillers", "numbers", "exclamations")
+
+    def __init__(self):
+        self.segments = 0
+        self.words = 0
+        self.speaking_seconds = 0.0
+        self.logic = 0
+        self.evidence = 0
+        self.emotion = 0
+        self.fillers = 0
+        self.numbers = 0
+        self.exclamations = 0
+
+    def add(self, segment: TranscriptSegment):
+        words = WORD_PATTERN.findall(segment.text.lower())
+        self.segments += 1
+        self.words += len(words)
+        if segment.start is not None and segment.end is not None:
+            self.speaking_seconds += max(0.0, segment.end - segment.start)
+        for word in words:
+            if word in LOGIC_WORDS:
+                self.logic += 1
+            elif word in EVIDENCE_WORDS:
+                self.evidence += 1
+            elif word in EMOTION_WORDS:
+                self.emotion += 1
+            elif word in FILLER_WORDS:
+                self.fillers += 1
+            if word[0].isdigit():
+                self.numbers += 1
+        self.exclamations += segment.text.count("!")
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def _rate(count: int, words: int, per_100_for_full_marks: float) -> int:
+    """Maps occurrences per 100 words onto a 1-10 score."""
+    if not words:
+        return 1
+    per_100 = 100 * count / words
+    return max(1, min(10, round(1 + 9 * per_100 / per_100_for_full_marks)))
+
+def _pace_penalty(words_per_minute: Optional[float]) -> int:
+    if words_per_minute is None:
+        return 0
+    low, high = COMFORTABLE_WPM
+    off = max(low - words_per_minute, words_per_minute - high, 0)
+    return min(3, round(off / 25))
+
+class MockJudgeBackend:
+    """Scores from the running features alone; the verdict costs next to nothing.
+
+    Delivery figures, when the speaker's audio gave any, adjust two scores: an
+    uncomfortable pace costs clarity, and a lively voice (loudness that varies)
+    adds to emotional appeal.
+    """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def evaluate(self, request: dict) -> dict:
+        if JUDGE_MOCK_DELAY_SECONDS:
+            await asyncio.sleep(JUDGE_MOCK_DELAY_SECONDS)
+        scores, feedback = {}, {}
+        for user_id, speaker in request["speakers"].items():
+            features = speaker["features"]
+            delivery = speaker.get("delivery") or {}
+            words = features["words"]
+            pace = _pace_penalty(delivery.get("words_per_minute"))
+            vocal_variety = min(2, int(delivery.get("loudness_std_db", 0) // 4))
+            scores[user_id] = {
+                "clarity": max(1, 10 - _rate(features["fillers"], words, 5) + 1 - pace),
+                "logic": _rate(features["logic"], words, 6),
+                "evidence": _rate(features["evidence"] + features["numbers"], words, 4),
+                "emotional_appeal": min(10, _rate(features["emotion"] + features["exclamations"], words, 4)
+                                        + vocal_variety),
+            }
+            best = max(scores[user_id], key=scores[user_id].get)
+            worst = min(scores[user_id], key=scores[user_id].get)
+            feedback[user_id] = (
+                f"Strongest on {best.replace('_', ' ')}; weakest on {worst.replace('_', ' ')} "
+                f"over {words} words."
+            )
+            if delivery.get("words_per_minute") is not None:
+                feedback[user_id] += (
+                    f" Spoke {delivery['talk_share']:.0%} of the time at {delivery['words_per_minute']:.0f} "
+                    f"words per minute, with {delivery['interruptions']} interruption(s)."
+                )
+        winner = max(scores, key=lambda user_id: sum(scores[user_id].values()), default=None)
+        return {"winner": winner, "scores": scores, "feedback": feedback}
+
+class HttpJudgeBackend:
+    """An LLM judge behind POST {url}/evaluate.
+
+    Each request carries every speaker's running features and delivery figures, only
+    the text added since the previous evaluation of the room, and that evaluation's
+    result, so the final call at debate end is small. The response is {"winner", "scores", "feedback"},
+    keyed by user id (see JudgeEvaluation).
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/") + "/evaluate"
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=JUDGE_HTTP_TIMEOUT_SECONDS)
+        )
+
+    async def stop(self):
+        if self.session:
+            await self.session.close()
+
+    async def evaluate(self, request: dict) -> dict:
+        async with self.session.post(self.url, json=request) as response:
+            response.raise_for_status()
+            return await response.json()
+
+def _to_result(evaluation: dict, user_ids: List[str], delivery: Dict[str, dict]) -> JudgeResult:
+    """Fits a per-user evaluation into the two-sided JudgeResult the clients expect."""
+    user_a = user_ids[0] if len(user_ids) > 0 else "user_a"
+    user_b = user_ids[1] if len(user_ids) > 1 else "user_b"
+    empty = {"clarity": 1, "logic": 1, "evidence": 1, "emotional_appeal": 1}
+    scores, feedback = evaluation.get("scores", {}), evaluation.get("feedback", {})
+    stats = {user_id: DeliveryStats(**delivery[user_id]) if user_id in delivery else None
+             for user_id in (user_a, user_b)}
+    return JudgeResult(
+        winner=evaluation.get("winner") or user_a,
+        scores=JudgeScores(user_a=ScoreSet(**scores.get(user_a, empty)),
+                           user_b=ScoreSet(**scores.get(user_b, empty))),
+        feedback=JudgeFeedback(user_a=feedback.get(user_a, ""), user_b=feedback.get(user_b, "")),
+        delivery=JudgeDelivery(user_a=stats[user_a], user_b=stats[user_b]) if delivery else None,
+    )
+
+class RoomJudge:
+    """Judging state of one room, fed with final segments while the debate runs."""
+
+    def __init__(self, engine: "JudgeEngine", room_code: str):
+        self.engine = engine
+        self.room_code = room_code
+        self.speakers: Dict[str, SpeakerFeatures] = {}
+        self.new_text: Dict[str, List[str]] = {}
+        self.seen = set()
+        self.since_evaluation = 0
+        self.last_evaluation: Optional[dict] = None
+        self.last_delivery: Dict[str, dict] = {}
+        self.last_active = time.monotonic()
+        self._evaluation: Optional[asyncio.Task] = None
+
+    def add(self, segment: TranscriptSegment):
+        key = (segment.user_id, segment.connection, segment.seq, segment.start)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        self.speakers.setdefault(segment.user_id, SpeakerFeatures()).add(segment)
+        self.new_text.setdefault(segment.user_id, []).append(segment.text)
+        self.since_evaluation += 1
+        self.last_active = time.monotonic()
+        if self.since_evaluation >= JUDGE_EVAL_EVERY_SEGMENTS and not self._busy():
+            self._evaluation = asyncio.create_task(self._provisional())
+
+    def _busy(self) -> bool:
+        return self._evaluation is not None and not self._evaluation.done()
+
+    def _request(self, final: bool, delivery: Dict[str, dict]) -> dict:
+        self.last_delivery = speaking_rates(
+            delivery, {user_id: features.words for user_id, features in self.speakers.items()}
+        )
+        request = {
+            "room_code": self.room_code,
+            "final": final,
+            "previous": self.last_evaluation,
+            "speakers": {
+                user_id: {"features": features.as_dict(), "new_text": " ".join(self.new_text.get(user_id, [])),
+                          "delivery": self.last_delivery.get(user_id)}
+                for user_id, features in self.speakers.items()
+            },
+        }
+        self.new_text = {}
+        self.since_evaluation = 0
+        return request
+
+    def _restore(self, new_text: Dict[str, List[str]], count: int):
+        """Puts back text a failed evaluation took, ahead of anything added since."""
+        for user_id, texts in new_text.items():
+            self.new_text[user_id] = texts + self.new_text.get(user_id, [])
+        self.since_evaluation += count
+
+    async def _evaluate(self, final: bool) -> dict:
+        delivery = await manager.get_delivery(self.room_code)
+        taken, count = self.new_text, self.since_evaluation
+        request = self._request(final, delivery)
+        async with self.engine.slots:
+            try:
+                with JUDGE_SECONDS.labels("final" if final else "provisional").time():
+                    evaluation = await self.engine.backend.evaluate(request)
+                # A malformed answer counts as a failed call, before any client sees it
+                self.last_evaluation = JudgeEvaluation.parse_obj(evaluation).dict()
+            except Exception as e:
+                if not final:
+                    # The judge never saw this text; the next evaluation sends it again
+                    self._restore(taken, count)
+                    raise
+                # The debate still gets a verdict when the judge service is down
+                print(f"Judge backend failed for room {self.room_code}, scoring from features: {e}")
+                self.last_evaluation = await self.engine.fallback.evaluate(request)
+        return self.last_evaluation
+
+    async def _provisional(self):
+        try:
+            evaluation = await self._evaluate(final=False)
+        except Exception as e:
+            print(f"Provisional judging failed for room {self.room_code}: {e}")
+            return
+        await manager.broadcast_json(self.room_code, WsMsg_ProvisionalScores(
+            user_id="system",
+            data=_to_result(evaluation, list(self.speakers), self.last_delivery),
+            segments=sum(features.segments for features in self.speakers.values()),
+        ).dict())
+
+    async def verdict(self, segments: List[TranscriptSegment],
+                      final_pass: Optional[Dict[str, List[TranscriptSegment]]] = None) -> JudgeResult:
+        """Final result, from the running state plus whatever is still unevaluated.
+
+        Speakers in `final_pass` are scored on features recounted from its more accurate
+        transcript; the text sent along is still only what the judge has not seen.
+        """
+        for segment in segments:
+            self.add(segment)
+        if self._busy():
+            await self._evaluation
+        for user_id, final_segments in (final_pass or {}).items():
+            features = self.speakers[user_id] = SpeakerFeatures()
+            for segment in final_segments:
+                features.add(segment)
+        evaluation = await self._evaluate(final=True)
+        return _to_result(evaluation, list(self.speakers), self.last_delivery)
+
+class JudgeEngine:
+    """Incremental judging for every room on this worker, with a shared limit on judge calls."""
+
+    def __init__(self):
+        self.backend = HttpJudgeBackend(JUDGE_BACKEND_URL) if JUDGE_BACKEND_URL else MockJudgeBackend()
+        self.slots = asyncio.Semaphore(JUDGE_MAX_CONCURRENCY)
+        self.fallback = MockJudgeBackend()
+        self.rooms: Dict[str, RoomJudge] = {}
+        self._sweeper = None
+        # A cleared room's next debate starts from nothing: features, pending text and seen segments
+        manager.on_clear.append(self.drop)
+
+    async def start(self):
+        await self.backend.start()
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+        await self.backend.stop()
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for room_code, room in list(self.rooms.items()):
+                if now - room.last_active > ROOM_IDLE_TTL_SECONDS:
+                    self.drop(room_code)
+
+    def room(self, room_code: str) -> RoomJudge:
+        room = self.rooms.get(room_code)
+        if room is None:
+            room = self.rooms[room_code] = RoomJudge(self, room_code)
+        return room
+
+    def add_segment(self, room_code: str, segment: TranscriptSegment):
+        self.room(room_code).add(segment)
+
+    async def verdict(self, room_code: str,
+                      final_pass: Optional[Dict[str, List[TranscriptSegment]]] = None) -> JudgeResult:
+        print(f"Judging room {room_code}...")
+        started = time.perf_counter()
+        # Catches up on segments other workers saw, when room state is shared
+        result = await self.room(room_code).verdict(await manager.get_segments(room_code), final_pass)
+        print(f"Verdict for room {room_code} ready in {time.perf_counter() - started:.2f} s.")
+        return result
+
+    def drop(self, room_code: str):
+        room = self.rooms.pop(room_code, None)
+        if room is not None and room._busy():
+            room._evaluation.cancel()
+
+judge_engine = JudgeEngine()
@@ -1,11 +1,29 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from .endpoints import router
+from .stt_pool import stt_pool
+from .connection_manager import manager
+from .judge import judge_engine
+
+# --- Application Lifecycle ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Opens the shared STT connections, the room backend and the judge for the lifetime of the app."""
+    await stt_pool.start()
+    await manager.start()
+    await judge_engine.start()
+    yield
+    await judge_engine.stop()
+    await manager.stop()
+    await stt_pool.stop()
 
 app = FastAPI(
     title="AI Debate Judge - Backend Orchestrator",
     description="Manages debate rooms, users, and orchestrates STT and LLM services.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # --- Middleware ---
@@ -24,3 +42,9 @@ app.include_router(router)
 @app.get("/")
 async def root():
     return {"message": "AI Debate Judge Backend is running."}
+
+# --- Metrics Endpoint ---
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
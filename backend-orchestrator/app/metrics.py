@@ -0,0 +1,66 @@
+import os
+import time
+from collections import deque
+from typing import Optional
+from prometheus_client import Counter, Gauge, Histogram
+
+# Follow each final segment from audio receipt to broadcast, and log its timings
+TRACE_SPANS = os.getenv("TRACE_SPANS", "0") == "1"
+# PCM from the browser: 16 kHz mono 16-bit
+AUDIO_BYTES_PER_SECOND = 16000 * 2
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# --- Metrics ---
+ACTIVE_ROOMS = Gauge("debate_active_rooms", "Rooms with at least one socket on this worker")
+ACTIVE_CONNECTIONS = Gauge("debate_active_connections", "Client sockets open on this worker")
+SEND_QUEUE_DEPTH = Gauge("debate_send_queue_depth", "Messages waiting in client send queues, summed")
+AUDIO_QUEUE_DEPTH = Gauge("debate_audio_queue_depth", "Audio frames waiting to go to the STT service, summed")
+AUDIO_BYTES = Counter("debate_audio_bytes_total", "Audio received from clients, by codec", ["codec"])
+BROADCAST_SECONDS = Histogram("debate_broadcast_seconds", "Time to fan one message out to a room's local sockets",
+                              buckets=LATENCY_BUCKETS)
+DROPPED_MESSAGES = Counter("debate_dropped_messages_total", "Messages or audio frames that were never delivered",
+                           ["reason"])
+STT_RECONNECTS = Counter("debate_stt_reconnects_total", "Connections to the STT service re-established after one dropped",
+                         ["mode"])
+JUDGE_SECONDS = Histogram("debate_judge_seconds", "Judge backend calls", ["kind"], buckets=LATENCY_BUCKETS)
+SEGMENT_LATENCY = Histogram("debate_segment_latency_seconds",
+                            "Final segments from receipt of their last audio to broadcast, by stage (TRACE_SPANS=1)",
+                            ["stage"], buckets=LATENCY_BUCKETS)
+
+class SegmentTracer:
+    """Remembers when each stretch of a user's audio arrived, to time segments against it.
+
+    The STT service reports a final segment's end in seconds of the stream; the frame
+    that carried that moment was received at a known time, so the segment's latency is
+    measured from there. Only used with TRACE_SPANS=1.
+    """
+
+    def __init__(self, room_code: str, user_id: str):
+        self.room_code = room_code
+        self.user_id = user_id
+        self.received_bytes = 0
+        self.arrivals = deque()  # (stream seconds at the end of a frame, arrival time)
+
+    def on_audio(self, size: int):
+        self.received_bytes += size
+        self.arrivals.append((self.received_bytes / AUDIO_BYTES_PER_SECOND, time.perf_counter()))
+
+    def arrival_of(self, end: float) -> Optional[float]:
+        # Frames before the segment's end will not be asked about again
+        while len(self.arrivals) > 1 and self.arrivals[0][0] < end:
+            self.arrivals.popleft()
+        return self.arrivals[0][1] if self.arrivals and self.arrivals[0][0] >= end else None
+
+    def record(self, transcript: dict, arrived: float, broadcast: float):
+        received = self.arrival_of(transcript["end"])
+        if received is None:
+            return
+        stt, fanout = arrived - received, broadcast - arrived
+        SEGMENT_LATENCY.labels("stt").observe(stt)
+        SEGMENT_LATENCY.labels("broadcast").observe(fanout)
+        SEGMENT_LATENCY.labels("total").observe(broadcast - received)
+        timing = transcript.get("timing") or {}
+        print(f"Span room={self.room_code} user={self.user_id} seq={transcript.get('seq')} "
+              f"end={transcript['end']:.2f}s total={1000 * (broadcast - received):.0f}ms "
+              f"stt={1000 * stt:.0f}ms (queued={timing.get('queued_ms')}ms decode={timing.get('decode_ms')}ms) "
+              f"broadcast={1000 * fanout:.1f}ms")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 # --- WebSocket Message Models ---
 class WsMessage(BaseModel):
@@ -10,6 +10,40 @@ class WsMsg_Transcript(WsMessage):
     type: str = "transcript"
     text: str
     is_final: bool
+    seq: Optional[int] = None
+    # Seconds into the speaker's audio stream covered by a final segment
+    start: Optional[float] = None
+    end: Optional[float] = None
+    # Language the speaker's session is pinned to, once known
+    language: Optional[str] = None
+    # Segments still waiting to be decoded for this speaker
+    queue_depth: Optional[int] = None
+    # Audio frames waiting in the orchestrator to be sent to the STT service
+    audio_queue_depth: Optional[int] = None
+    # Decoded without context under overload; may be less accurate and is never final
+    degraded: bool = False
+    # STT model tier that decoded it; cheaper tiers take over while the STT service is overloaded
+    tier: Optional[str] = None
+
+class TranscriptUpdate(BaseModel):
+    # "final": a committed span, which also clears the speaker's partial;
+    # "partial": replaces the speaker's partial; "append": extends it with `text`
+    op: str
+    user_id: str
+    seq: Optional[int] = None
+    text: str
+    start: Optional[float] = None
+    end: Optional[float] = None
+    language: Optional[str] = None
+    queue_depth: Optional[int] = None
+    audio_queue_depth: Optional[int] = None
+    degraded: Optional[bool] = None
+    tier: Optional[str] = None
+
+class WsMsg_TranscriptBatch(WsMessage):
+    """Transcript changes in a room over one tick, for clients connected with ?updates=delta."""
+    type: str = "transcript_batch"
+    updates: List[TranscriptUpdate]
 
 class WsMsg_DebateState(WsMessage):
     type: str = "debate_state"
@@ -19,7 +53,7 @@ class WsMsg_Error(WsMessage):
     type: str = "error"
     error: str
 
-# --- LLM Judge Models (for our mock service) ---
+# --- LLM Judge Models ---
 class ScoreSet(BaseModel):
     clarity: int
     logic: int
@@ -34,7 +68,43 @@ class JudgeFeedback(BaseModel):
     user_a: str
     user_b: str
 
+class DeliveryStats(BaseModel):
+    """How a speaker talked, measured from their audio as it streamed in (raw PCM only)."""
+    audio_seconds: float
+    # Time spent in spurts of speech, short gaps included
+    talk_seconds: float
+    # Share of the room's talk time, and words per minute of the speaker's own
+    talk_share: Optional[float] = None
+    words_per_minute: Optional[float] = None
+    spurts: int
+    # Silences between spurts: count, total, and count per bucket of delivery.PAUSE_BINS
+    pauses: int
+    pause_seconds: float
+    pause_histogram: List[int]
+    # Mean and spread of voiced loudness, in dBFS
+    loudness_db: float
+    loudness_std_db: float
+    # Spurts started while someone else in the room held the floor
+    interruptions: int
+
+class JudgeDelivery(BaseModel):
+    user_a: Optional[DeliveryStats] = None
+    user_b: Optional[DeliveryStats] = None
+
+class JudgeEvaluation(BaseModel):
+    """What a judge backend answers, keyed by user id."""
+    winner: Optional[str] = None
+    scores: Dict[str, ScoreSet] = {}
+    feedback: Dict[str, str] = {}
+
 class JudgeResult(BaseModel):
     winner: str
     scores: JudgeScores
     feedback: JudgeFeedback
+    delivery: Optional[JudgeDelivery] = None
+
+class WsMsg_ProvisionalScores(WsMessage):
+    type: str = "provisional_scores"
+    data: JudgeResult
+    # Final segments the scores are based on
+    segments: int
@@ -0,0 +1,233 @@
+import os
+import json
+import asyncio
+from collections import defaultdict
+from typing import Callable, DefaultDict, Dict, List, Set, Tuple
+from .transcript_store import TranscriptStore, TranscriptSegment, join_segments
+
+# "memory" keeps rooms in this process (one worker); "redis" shares them between workers and nodes
+ROOM_BACKEND = os.getenv("ROOM_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Transcripts of idle rooms are dropped after this long
+ROOM_IDLE_TTL_SECONDS = int(os.getenv("ROOM_IDLE_TTL_SECONDS", "1800"))
+# Upper bound on in-process transcript memory; idle rooms are evicted oldest first to stay under it.
+# With the redis backend, cap memory with Redis' own maxmemory setting instead.
+TRANSCRIPT_MEMORY_CAP_MB = int(os.getenv("TRANSCRIPT_MEMORY_CAP_MB", "256"))
+REDIS_KEY_PREFIX = "debate:room:"
+
+# (room_code, encoded message) -> hand it to this worker's sockets in the room
+Deliver = Callable[[str, str], None]
+
+class InProcessRoomBackend:
+    """Room registry, transcripts and broadcast in this process's memory."""
+
+    def __init__(self):
+        self.transcripts = TranscriptStore()
+        self.members: DefaultDict[str, Dict[str, int]] = defaultdict(dict)
+        self.stt_sessions: DefaultDict[str, List[Tuple[str, str]]] = defaultdict(list)
+        self.delivery: DefaultDict[str, Dict[str, dict]] = defaultdict(dict)
+        self.deliver: Deliver = None
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def join(self, room_code: str, user_id: str):
+        room = self.members[room_code]
+        room[user_id] = room.get(user_id, 0) + 1
+
+    async def leave(self, room_code: str, user_id: str):
+        room = self.members.get(room_code, {})
+        room[user_id] = room.get(user_id, 1) - 1
+        if room[user_id] <= 0:
+            del room[user_id]
+        if not room:
+            self.members.pop(room_code, None)
+            # The idle clock for the room's transcript starts now
+            self.transcripts.touch(room_code)
+
+    async def room_members(self, room_code: str) -> Set[str]:
+        return set(self.members.get(room_code, ()))
+
+    async def publish(self, room_code: str, text: str):
+        self.deliver(room_code, text)
+
+    async def add_segment(self, room_code: str, segment: TranscriptSegment):
+        self.transcripts.append(room_code, segment)
+
+    async def get_transcripts(self, room_code: str) -> Dict[str, str]:
+        return self.transcripts.joined(room_code)
+
+    async def get_segments(self, room_code: str) -> List[TranscriptSegment]:
+        return list(self.transcripts.segments(room_code))
+
+    async def add_stt_session(self, room_code: str, user_id: str, session_id: str):
+        self.stt_sessions[room_code].append((user_id, session_id))
+
+    async def get_stt_sessions(self, room_code: str) -> List[Tuple[str, str]]:
+        return list(self.stt_sessions.get(room_code, ()))
+
+    async def set_delivery(self, room_code: str, user_id: str, stats: dict):
+        self.delivery[room_code][user_id] = stats
+
+    async def get_delivery(self, room_code: str) -> Dict[str, dict]:
+        return dict(self.delivery.get(room_code, {}))
+
+    async def clear(self, room_code: str):
+        self.transcripts.drop(room_code)
+        self.stt_sessions.pop(room_code, None)
+        self.delivery.pop(room_code, None)
+
+    async def sweep(self) -> List[str]:
+        evicted = self.transcripts.sweep(
+            self.members, ROOM_IDLE_TTL_SECONDS, TRANSCRIPT_MEMORY_CAP_MB * 1024 * 1024
+        )
+        # Session ids and delivery figures go with the room's transcript, or as soon as an empty room has none
+        for rooms in (self.stt_sessions, self.delivery):
+            for room_code in list(rooms):
+                if room_code not in self.members and room_code not in self.transcripts.rooms:
+                    del rooms[room_code]
+        return evicted
+
+class RedisRoomBackend:
+    """Room state in Redis (or anything speaking its protocol), shared by every worker.
+
+    Broadcasts go out on one pub/sub channel per room, and each worker subscribes only
+    while it has sockets in that room. Members and transcript segments are Redis keys
+    that expire after the idle TTL; every write refreshes it.
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = ROOM_IDLE_TTL_SECONDS):
+        self.url = url
+        self.ttl = ttl
+        self.redis = None
+        self.deliver: Deliver = None
+        self._pubsub = None
+        self._reader = None
+        self._local: Dict[str, int] = {}
+        self._errors = ()
+
+    async def start(self, deliver: Deliver):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("ROOM_BACKEND=redis needs the 'redis' package (pip install redis).")
+        self.deliver = deliver
+        self._errors = redis.RedisError
+        self.redis = redis.from_url(self.url, decode_responses=True)
+        self._pubsub = self.redis.pubsub()
+        # Keeps the subscriber connection open while this worker has no rooms
+        await self._pubsub.subscribe(REDIS_KEY_PREFIX + "_control")
+        self._reader = asyncio.create_task(self._read())
+        print(f"Room state is shared through {self.url}.")
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        try:
+            if self._pubsub:
+                await self._pubsub.aclose()
+            if self.redis:
+                await self.redis.aclose()
+        except self._errors:
+            pass
+
+    async def _read(self):
+        prefix_len = len(REDIS_KEY_PREFIX)
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message["type"] == "message":
+                        self.deliver(message["channel"][prefix_len:], message["data"])
+            except self._errors as e:
+                # The client re-subscribes to every channel when it reconnects
+                print(f"Lost the room backend subscription: {e}. Retrying...")
+                await asyncio.sleep(1)
+
+    def _key(self, room_code: str, kind: str) -> str:
+        return f"{REDIS_KEY_PREFIX}{room_code}:{kind}"
+
+    async def join(self, room_code: str, user_id: str):
+        self._local[room_code] = self._local.get(room_code, 0) + 1
+        if self._local[room_code] == 1:
+            await self._pubsub.subscribe(REDIS_KEY_PREFIX + room_code)
+        members = self._key(room_code, "members")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(members, user_id, 1)
+            pipe.expire(members, self.ttl)
+            pipe.expire(self._key(room_code, "segments"), self.ttl)
+            pipe.expire(self._key(room_code, "stt_sessions"), self.ttl)
+            pipe.expire(self._key(room_code, "delivery"), self.ttl)
+            await pipe.execute()
+
+    async def leave(self, room_code: str, user_id: str):
+        self._local[room_code] -= 1
+        if self._local[room_code] <= 0:
+            del self._local[room_code]
+            await self._pubsub.unsubscribe(REDIS_KEY_PREFIX + room_code)
+        members = self._key(room_code, "members")
+        if await self.redis.hincrby(members, user_id, -1) <= 0:
+            await self.redis.hdel(members, user_id)
+
+    async def room_members(self, room_code: str) -> Set[str]:
+        return set(await self.redis.hkeys(self._key(room_code, "members")))
+
+    async def publish(self, room_code: str, text: str):
+        await self.redis.publish(REDIS_KEY_PREFIX + room_code, text)
+
+    async def add_segment(self, room_code: str, segment: TranscriptSegment):
+        segments = self._key(room_code, "segments")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(segments, json.dumps(segment))
+            pipe.expire(segments, self.ttl)
+            await pipe.execute()
+
+    async def get_transcripts(self, room_code: str) -> Dict[str, str]:
+        return join_segments(await self.get_segments(room_code))
+
+    async def get_segments(self, room_code: str) -> List[TranscriptSegment]:
+        raw = await self.redis.lrange(self._key(room_code, "segments"), 0, -1)
+        return [TranscriptSegment(*json.loads(item)) for item in raw]
+
+    async def add_stt_session(self, room_code: str, user_id: str, session_id: str):
+        sessions = self._key(room_code, "stt_sessions")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(sessions, json.dumps([user_id, session_id]))
+            pipe.expire(sessions, self.ttl)
+            await pipe.execute()
+
+    async def get_stt_sessions(self, room_code: str) -> List[Tuple[str, str]]:
+        raw = await self.redis.lrange(self._key(room_code, "stt_sessions"), 0, -1)
+        return [tuple(json.loads(item)) for item in raw]
+
+    async def set_delivery(self, room_code: str, user_id: str, stats: dict):
+        delivery = self._key(room_code, "delivery")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(delivery, user_id, json.dumps(stats))
+            pipe.expire(delivery, self.ttl)
+            await pipe.execute()
+
+    async def get_delivery(self, room_code: str) -> Dict[str, dict]:
+        raw = await self.redis.hgetall(self._key(room_code, "delivery"))
+        return {user_id: json.loads(stats) for user_id, stats in raw.items()}
+
+    async def clear(self, room_code: str):
+        await self.redis.delete(self._key(room_code, "segments"), self._key(room_code, "stt_sessions"),
+                                self._key(room_code, "delivery"))
+
+    async def sweep(self) -> List[str]:
+        # Redis expires idle rooms itself
+        return []
+
+def create_room_backend(kind: str = ROOM_BACKEND):
+    if kind == "redis":
+        return RedisRoomBackend()
+    if kind == "memory":
+        return InProcessRoomBackend()
+    raise ValueError(f"Unknown ROOM_BACKEND '{kind}'; expected 'memory' or 'redis'.")
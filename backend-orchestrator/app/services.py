@@ -2,73 +2,164 @@ import os
 import asyncio
 import aiohttp
 import json
-from .models import JudgeResult, JudgeScores, ScoreSet, JudgeFeedback
+import weakref
+from typing import Dict, List, Optional, Tuple
+from .stt_pool import stt_pool
+from .transcript_store import TranscriptSegment
+from .metrics import AUDIO_QUEUE_DEPTH, DROPPED_MESSAGES, TRACE_SPANS
 
 # --- 1. Real STT Service Client ---
-STT_SERVICE_URL = os.getenv("STT_SERVICE_WS_URL", "ws://localhost:8000/ws/transcribe")
+# Audio frames buffered per user between the client socket and the STT stream (~5 s of 100 ms frames)
+AUDIO_QUEUE_MAXSIZE = int(os.getenv("AUDIO_QUEUE_MAXSIZE", "50"))
+# "block", "drop_oldest" or "partial_only". The STT service applies the same policy on its side;
+# at this hop partial_only behaves like block, since only the STT service can degrade decoding.
+OVERFLOW_POLICY = os.getenv("OVERFLOW_POLICY", "block")
+# "pcm" is 16 kHz int16; the others carry one encoded packet per message (~10x less traffic)
+AUDIO_CODECS = ("pcm", "opus", "flac")
+
+class AudioQueue(asyncio.Queue):
+    """Bounded queue of audio frames from one client on their way to the STT service."""
+
+    def __init__(self, maxsize: int = AUDIO_QUEUE_MAXSIZE, policy: str = OVERFLOW_POLICY):
+        super().__init__(maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        _audio_queues.add(self)
+
+    async def put_audio(self, chunk: bytes):
+        """Queues a frame; blocking here stops the caller reading from the client socket."""
+        if self.closed:
+            return
+        if self.full() and self.policy == "drop_oldest":
+            self.get_nowait()
+            self.dropped += 1
+            DROPPED_MESSAGES.labels("audio_overflow").inc()
+        await self.put(chunk)
+
+    def close(self):
+        """Nothing reads the queue any more: drops what is queued, and every frame from now on.
+
+        Emptying it also wakes a caller blocked in `put_audio`, so it goes back to reading
+        the client socket and notices when the client leaves.
+        """
+        self.closed = True
+        while not self.empty():
+            self.get_nowait()
+
+_audio_queues = weakref.WeakSet()
+AUDIO_QUEUE_DEPTH.set_function(lambda: sum(queue.qsize() for queue in list(_audio_queues)))
 
 async def stt_client_handler(
     audio_stream: asyncio.Queue, 
-    on_transcript: callable
+    on_transcript: callable,
+    language: str = None,
+    codec: str = "pcm",
+    session_id: str = None
 ):
+    if stt_pool.mux:
+        await _mux_client_handler(audio_stream, on_transcript, language, codec, session_id)
+        return
+
+    url = stt_pool.acquire_endpoint()
+    params = {"overflow": OVERFLOW_POLICY}
+    if language:
+        # Pins the speaker's language so the STT service never has to detect it
+        params["language"] = language
+    if codec != "pcm":
+        # Frames are forwarded still compressed; the STT service decodes them
+        params["codec"] = codec
+    if TRACE_SPANS:
+        # Asks for per-segment queue and decode timings in the results
+        params["trace"] = "1"
+    if session_id:
+        # The STT service keeps this stream's audio for its final pass under this id
+        params["session"] = session_id
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(STT_SERVICE_URL) as ws:
-                print("Connected to STT service.")
-                
-                async def send_audio():
-                    while True:
-                        audio_chunk = await audio_stream.get()
-                        if audio_chunk is None: 
-                            break
-                        await ws.send_bytes(audio_chunk)
-                    await ws.close(code=1000, message=b'Finished')
+        async with stt_pool.session.ws_connect(url, params=params) as ws:
+            print(f"Connected to STT service at {url}.")
+            
+            async def send_audio():
+                while True:
+                    audio_chunk = await audio_stream.get()
+                    if audio_chunk is None: 
+                        break
+                    await ws.send_bytes(audio_chunk)
+                # The STT service flushes its last segment and closes once it has replied
+                await ws.send_str(json.dumps({"event": "end_of_stream"}))
 
-                async def receive_transcripts():
-                    async for msg in ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            data = json.loads(msg.data)
-                            await on_transcript(data)
-                        elif msg.type == aiohttp.WSMsgType.ERROR:
-                            print(f"STT WS Error: {ws.exception()}")
-                            break
-                        elif msg.type == aiohttp.WSMsgType.CLOSED:
-                            break
-                
-                send_task = asyncio.create_task(send_audio())
-                receive_task = asyncio.create_task(receive_transcripts())
-                await asyncio.gather(send_task, receive_task)
+            async def receive_transcripts():
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        data = json.loads(msg.data)
+                        await on_transcript(data)
+                    elif msg.type == aiohttp.WSMsgType.ERROR:
+                        print(f"STT WS Error: {ws.exception()}")
+                        break
+                    elif msg.type == aiohttp.WSMsgType.CLOSED:
+                        break
+            
+            send_task = asyncio.create_task(send_audio())
+            receive_task = asyncio.create_task(receive_transcripts())
+            try:
+                await asyncio.wait([send_task, receive_task], return_when=asyncio.FIRST_COMPLETED)
+                if not (receive_task.done() or ws.closed):
+                    send_task.result()
+                # Once the STT service closes the stream (e.g. admission control turned it away),
+                # audio still on its way there no longer matters
+                await receive_task
+            finally:
+                send_task.cancel()
+                receive_task.cancel()
                 
     except Exception as e:
         print(f"Could not connect to STT service: {e}")
         await on_transcript({"type": "error", "error": "STT Service connection failed."})
     finally:
+        stt_pool.release_endpoint(url)
         print("STT client handler finished.")
 
-# --- 2. Mock LLM Judge Service ---
-async def mock_llm_judge(transcripts: dict) -> JudgeResult:
-    print("Mock LLM Judge is 'evaluating' transcripts...")
-    await asyncio.sleep(3) 
+async def _mux_client_handler(audio_stream: asyncio.Queue, on_transcript: callable, language: str = None,
+                              codec: str = "pcm", session_id: str = None):
+    """Same as stt_client_handler, over a shared multiplexed STT connection."""
+    stream = await stt_pool.open_stream(on_transcript, OVERFLOW_POLICY, language, codec, session_id)
+    try:
+        while True:
+            audio_chunk = await audio_stream.get()
+            if audio_chunk is None:
+                break
+            if stream.closed.is_set():
+                # The STT service closed the stream (e.g. admission control turned it away)
+                return
+            await stream.send_audio(audio_chunk)
+        await stream.end()
+        await stream.closed.wait()
+    finally:
+        stt_pool.close_stream(stream)
+        print("STT client handler finished.")
 
-    user_ids = list(transcripts.keys())
-    user_a_id = user_ids[0] if len(user_ids) > 0 else "user_a"
-    user_b_id = user_ids[1] if len(user_ids) > 1 else "user_b"
+async def final_pass_segments(stt_sessions: List[Tuple[str, str]]) -> Dict[str, List[TranscriptSegment]]:
+    """Each speaker's final-pass transcript from the STT service.
 
-    mock_scores = JudgeScores(
-        user_a=ScoreSet(clarity=8, logic=9, evidence=7, emotional_appeal=5),
-        user_b=ScoreSet(clarity=7, logic=6, evidence=5, emotional_appeal=8)
-    )
-    
-    mock_feedback = JudgeFeedback(
-        user_a="User A had stronger evidence and a more logical flow.",
-        user_b="User B had a powerful emotional appeal but lacked supporting facts."
-    )
-    
-    result = JudgeResult(
-        winner=user_a_id,
-        scores=mock_scores,
-        feedback=mock_feedback
-    )
-    
-    print("Mock LLM Judge has 'decided'.")
-    return result
+    `stt_sessions` are the room's (user_id, STT session id) pairs in the order they
+    opened. A speaker is left out unless every one of their sessions has a finished
+    pass, so the judge keeps their live transcript instead.
+    """
+    session_ids = [session_id for _, session_id in stt_sessions]
+    results = dict(zip(session_ids, await asyncio.gather(*map(stt_pool.final_transcript, session_ids))))
+    segments: Dict[str, List[TranscriptSegment]] = {}
+    missing = set()
+    for user_id, session_id in stt_sessions:
+        parts: Optional[List[dict]] = results[session_id]
+        if parts is None:
+            missing.add(user_id)
+            continue
+        for part in parts:
+            segments.setdefault(user_id, []).extend(
+                TranscriptSegment(None, user_id, segment["start"], segment["end"], segment["text"])
+                for segment in part["segments"]
+            )
+    for user_id in missing:
+        print(f"No final pass for {user_id}; judging their live transcript.")
+        segments.pop(user_id, None)
+    return segments
@@ -0,0 +1,278 @@
+import os
+import asyncio
+import itertools
+import json
+import aiohttp
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from .metrics import STT_RECONNECTS, TRACE_SPANS
+
+# One or more STT endpoints, comma-separated; streams are spread across all of them
+STT_SERVICE_URLS = [
+    url.strip()
+    for url in os.getenv("STT_SERVICE_WS_URL", "ws://localhost:8000/ws/transcribe").split(",")
+    if url.strip()
+]
+# Carry every user's audio over one WebSocket per STT endpoint instead of one per user
+STT_MUX = os.getenv("STT_MUX", "0") == "1"
+RECONNECT_BACKOFF_MAX_SECONDS = 10
+# Judge from the STT service's final pass (WHISPER_FINAL_MODEL there) instead of the live transcript
+STT_FINAL_PASS = os.getenv("STT_FINAL_PASS", "0") == "1"
+# How long debate_end waits for final passes before judging from the live transcript
+STT_FINAL_WAIT_SECONDS = float(os.getenv("STT_FINAL_WAIT_SECONDS", "60"))
+
+def http_base(url: str) -> str:
+    """An STT endpoint's HTTP root, from its WebSocket URL."""
+    parts = urlsplit(url)
+    scheme = {"ws": "http", "wss": "https"}.get(parts.scheme, parts.scheme)
+    return f"{scheme}://{parts.netloc}"
+
+class MuxStream:
+    """One user's audio stream inside a multiplexed STT connection."""
+
+    def __init__(self, pool: "STTConnectionPool", stream_id: int, on_transcript, overflow: str,
+                 language: Optional[str] = None, codec: str = "pcm", session_id: Optional[str] = None):
+        self.pool = pool
+        self.id = stream_id
+        self.header = stream_id.to_bytes(4, "big")
+        self.on_transcript = on_transcript
+        self.overflow = overflow
+        self.language = language
+        self.codec = codec
+        self.session_id = session_id
+        self.connection: Optional["MuxConnection"] = None
+        self.ended = False
+        self.closed = asyncio.Event()
+
+    async def send_audio(self, chunk: bytes):
+        connection = await self.pool.wait_connected(self)
+        try:
+            await connection.send_bytes(self.header + chunk)
+        except (ConnectionError, RuntimeError, aiohttp.ClientError) as e:
+            print(f"Dropped audio for STT stream {self.id}: {e}")
+
+    async def end(self):
+        """Asks the STT service to flush this stream; `closed` is set after its last result."""
+        self.ended = True
+        connection = await self.pool.wait_connected(self)
+        try:
+            await connection.send_json({"op": "end", "stream": self.id})
+        except (ConnectionError, RuntimeError, aiohttp.ClientError):
+            self.closed.set()
+
+    async def abort(self, connection: "MuxConnection"):
+        """Tells the STT service to drop this stream without flushing it."""
+        try:
+            await connection.send_json({"op": "abort", "stream": self.id})
+        except (ConnectionError, RuntimeError, aiohttp.ClientError):
+            pass
+
+class MuxConnection:
+    """A self-healing WebSocket to one STT endpoint that carries many streams."""
+
+    def __init__(self, pool: "STTConnectionPool", url: str):
+        self.pool = pool
+        self.url = url.rstrip("/") + "/mux"
+        self.streams: Dict[int, MuxStream] = {}
+        self.connected = asyncio.Event()
+        self._ws = None
+        self._send_lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def send_bytes(self, data: bytes):
+        async with self._send_lock:
+            await self._ws.send_bytes(data)
+
+    async def send_json(self, message: dict):
+        async with self._send_lock:
+            await self._ws.send_str(json.dumps(message))
+
+    async def attach(self, stream: MuxStream):
+        self.streams[stream.id] = stream
+        stream.connection = self
+        if self.connected.is_set():
+            await self._open(stream)
+
+    def detach(self, stream: MuxStream):
+        self.streams.pop(stream.id, None)
+
+    async def _open(self, stream: MuxStream):
+        await self.send_json({
+            "op": "open", "stream": stream.id, "overflow": stream.overflow, "language": stream.language,
+            "trace": TRACE_SPANS, "codec": stream.codec, "session": stream.session_id,
+        })
+
+    async def _run(self):
+        backoff = 0.5
+        dropped = False  # a connection was up before and went down
+        while True:
+            try:
+                async with self.pool.session.ws_connect(self.url, heartbeat=30) as ws:
+                    self._ws = ws
+                    backoff = 0.5
+                    if dropped:
+                        STT_RECONNECTS.labels("mux").inc()
+                    print(f"Multiplexed STT connection to {self.url} established.")
+                    for stream in list(self.streams.values()):
+                        await self._open(stream)
+                    self.connected.set()
+                    await self._read(ws)
+            except (aiohttp.ClientError, OSError) as e:
+                print(f"Multiplexed STT connection to {self.url} failed: {e}")
+            except Exception as e:
+                # Every stream on this socket depends on the loop; it must outlive any bug
+                print(f"Multiplexed STT connection to {self.url} broke unexpectedly: {e!r}")
+            finally:
+                dropped = dropped or self._ws is not None
+                self.connected.clear()
+                self._ws = None
+
+            # Streams that were already flushing lost their tail with the connection;
+            # the rest are moved to a healthy endpoint if there is one, or re-opened here
+            for stream in list(self.streams.values()):
+                if stream.ended:
+                    self.detach(stream)
+                    stream.closed.set()
+            try:
+                await self.pool.rebalance(self)
+            except Exception as e:
+                print(f"Could not move streams off {self.url}: {e!r}")
+            print(f"Reconnecting to {self.url} in {backoff:.1f} s...")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX_SECONDS)
+
+    async def _read(self, ws):
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                data = json.loads(msg.data)
+                stream = self.streams.get(data.pop("stream", None))
+                if stream is None:
+                    continue
+                if data.get("op") == "closed":
+                    self.detach(stream)
+                    stream.closed.set()
+                else:
+                    try:
+                        await stream.on_transcript(data)
+                    except Exception as e:
+                        # One stream's handler (e.g. a room backend error) must not stall the others
+                        print(f"Transcript handler of STT stream {stream.id} failed: {e!r}")
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                print(f"STT WS Error: {ws.exception()}")
+                break
+
+class STTConnectionPool:
+    """App-lifetime HTTP session and STT connections shared by every user."""
+
+    def __init__(self, urls: List[str] = STT_SERVICE_URLS, mux: bool = STT_MUX):
+        self.urls = urls
+        self.mux = mux
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.connections: List[MuxConnection] = []
+        self._load: Dict[str, int] = {url: 0 for url in urls}
+        self._stream_ids = itertools.count(1)
+
+    async def start(self):
+        self.session = aiohttp.ClientSession()
+        if self.mux:
+            self.connections = [MuxConnection(self, url) for url in self.urls]
+            for connection in self.connections:
+                connection.start()
+
+    async def stop(self):
+        for connection in self.connections:
+            await connection.stop()
+        if self.session:
+            await self.session.close()
+
+    def acquire_endpoint(self) -> str:
+        """Picks the endpoint with the fewest open streams (per-user connection mode)."""
+        url = min(self.urls, key=self._load.__getitem__)
+        self._load[url] += 1
+        return url
+
+    def release_endpoint(self, url: str):
+        self._load[url] -= 1
+
+    def _least_loaded(self, candidates: List[MuxConnection]) -> MuxConnection:
+        return min(candidates, key=lambda c: len(c.streams))
+
+    async def open_stream(self, on_transcript, overflow: str, language: Optional[str] = None,
+                          codec: str = "pcm", session_id: Optional[str] = None) -> MuxStream:
+        stream = MuxStream(self, next(self._stream_ids), on_transcript, overflow, language, codec, session_id)
+        healthy = [c for c in self.connections if c.connected.is_set()]
+        await self._least_loaded(healthy or self.connections).attach(stream)
+        return stream
+
+    def close_stream(self, stream: MuxStream):
+        connection = stream.connection
+        if connection is None:
+            return
+        connection.detach(stream)
+        if not stream.closed.is_set() and connection.connected.is_set():
+            # The user left mid-stream; free the session on the STT node too
+            asyncio.create_task(stream.abort(connection))
+
+    async def wait_connected(self, stream: MuxStream) -> MuxConnection:
+        """Waits until the stream's connection is up; follows the stream if it gets moved."""
+        while True:
+            connection = stream.connection
+            try:
+                await asyncio.wait_for(connection.connected.wait(), 1)
+                return connection
+            except asyncio.TimeoutError:
+                continue
+
+    async def rebalance(self, failed: MuxConnection):
+        healthy = [c for c in self.connections if c is not failed and c.connected.is_set()]
+        streams = list(failed.streams.values())
+        if not healthy or not streams:
+            return
+        for stream in streams:
+            failed.detach(stream)
+            await self._least_loaded(healthy).attach(stream)
+        print(f"Moved {len(streams)} stream(s) off {failed.url} to healthy STT endpoints.")
+
+    async def final_transcript(self, session_id: str, wait: float = STT_FINAL_WAIT_SECONDS) -> Optional[List[dict]]:
+        """The final-pass parts of one STT session, oldest first, or None if any is missing.
+
+        Every endpoint is asked, since a stream that reconnected or was moved has a part
+        on each node it used; a node that doesn't know the session has no part.
+        """
+        async def fetch(url: str) -> Optional[List[dict]]:
+            try:
+                async with self.session.get(
+                    f"{http_base(url)}/sessions/{session_id}/final", params={"wait": str(wait)},
+                    timeout=aiohttp.ClientTimeout(total=wait + 10),
+                ) as response:
+                    if response.status == 404:
+                        return []
+                    body = await response.json()
+                    if response.status != 200:
+                        print(f"Final pass of STT session {session_id} on {url} not done after {wait:.0f} s.")
+                        return None
+                    return body["parts"]
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Could not fetch the final pass of STT session {session_id} from {url}: {e}")
+                return None
+
+        results = await asyncio.gather(*(fetch(url) for url in self.urls))
+        if any(parts is None for parts in results):
+            return None
+        parts = sorted((part for node in results for part in node), key=lambda part: part["opened_at"])
+        if not parts or any(part["status"] != "done" for part in parts):
+            return None
+        return parts
+
+stt_pool = STTConnectionPool()
@@ -0,0 +1,90 @@
+import sys
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# Rough per-segment cost on top of the text itself (tuple, floats, ints)
+SEGMENT_OVERHEAD_BYTES = 160
+
+class TranscriptSegment(NamedTuple):
+    seq: Optional[int]
+    user_id: str
+    start: Optional[float]
+    end: Optional[float]
+    text: str
+    # The speaker's connection it came from; seq and start restart with every connection
+    connection: Optional[str] = None
+
+def join_segments(segments: Iterable[TranscriptSegment]) -> Dict[str, str]:
+    """Each speaker's full transcript, in the order their segments arrived."""
+    parts: Dict[str, List[str]] = {}
+    for segment in segments:
+        parts.setdefault(segment.user_id, []).append(segment.text)
+    return {user_id: " ".join(texts) for user_id, texts in parts.items()}
+
+class RoomLog:
+    """Append-only list of one room's final segments."""
+
+    __slots__ = ("segments", "size", "last_active")
+
+    def __init__(self):
+        self.segments: List[TranscriptSegment] = []
+        self.size = 0
+        self.last_active = time.monotonic()
+
+class TranscriptStore:
+    """Per-room segment logs, joined into text only when the judge asks for them.
+
+    Appending never rebuilds earlier text, and every segment keeps its timing. The
+    approximate memory held is tracked so the sweeper can enforce a cap.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, RoomLog] = {}
+        self.size = 0
+
+    def append(self, room_code: str, segment: TranscriptSegment):
+        log = self.rooms.get(room_code)
+        if log is None:
+            log = self.rooms[room_code] = RoomLog()
+        cost = sys.getsizeof(segment.text) + SEGMENT_OVERHEAD_BYTES
+        log.segments.append(segment)
+        log.size += cost
+        log.last_active = time.monotonic()
+        self.size += cost
+
+    def touch(self, room_code: str):
+        log = self.rooms.get(room_code)
+        if log is not None:
+            log.last_active = time.monotonic()
+
+    def segments(self, room_code: str) -> List[TranscriptSegment]:
+        log = self.rooms.get(room_code)
+        return log.segments if log else []
+
+    def joined(self, room_code: str) -> Dict[str, str]:
+        return join_segments(self.segments(room_code))
+
+    def drop(self, room_code: str):
+        log = self.rooms.pop(room_code, None)
+        if log is not None:
+            self.size -= log.size
+
+    def sweep(self, live_rooms: Iterable[str], ttl: float, max_bytes: int) -> List[str]:
+        """Evicts rooms nobody is connected to once idle for `ttl` seconds, then the
+        least recently active of them until the store fits in `max_bytes`."""
+        live = set(live_rooms)
+        now = time.monotonic()
+        idle = sorted(
+            (log.last_active, room_code)
+            for room_code, log in self.rooms.items()
+            if room_code not in live
+        )
+        evicted = []
+        for last_active, room_code in idle:
+            if now - last_active < ttl and self.size <= max_bytes:
+                break
+            self.drop(room_code)
+            evicted.append(room_code)
+        if self.size > max_bytes:
+            print(f"Transcript store holds {self.size} bytes across live rooms (cap {max_bytes}).")
+        return evicted
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from .models import TranscriptUpdate, WsMsg_Transcript, WsMsg_TranscriptBatch
+
+# Transcript events of a room are gathered for this long and sent as one batch
+TRANSCRIPT_TICK_MS = int(os.getenv("TRANSCRIPT_TICK_MS", "50"))
+# "full": one transcript message per update (the original protocol); "delta": transcript_batch messages
+UPDATE_MODES = ("full", "delta")
+# "msgpack" sends every message as a binary frame instead of JSON text
+ENCODINGS = ("json", "msgpack")
+# How a published batch starts, so delivery can tell it apart without parsing everything
+BATCH_PREFIX = '{"type": "transcript_batch"'
+
+def encoding_error(encoding: str) -> Optional[str]:
+    """Why a client can't have this encoding, or None if it can."""
+    if encoding not in ENCODINGS:
+        return f"Unsupported encoding '{encoding}'. Use one of: {', '.join(ENCODINGS)}."
+    if encoding == "msgpack":
+        try:
+            import msgpack  # noqa: F401
+        except ImportError:
+            return "msgpack encoding is not available on this server; use json."
+    return None
+
+def pack(message: dict) -> bytes:
+    import msgpack
+    return msgpack.packb(message)
+
+class TranscriptCoalescer:
+    """Turns one room's transcript events on this worker into a delta batch per tick.
+
+    Finals are committed spans and always go out, in order. A final clears its speaker's
+    partial, and only the newest partial after it survives the tick. A partial that
+    extends the one last sent for the same segment goes out as an "append" of the new
+    text only; an unchanged one is not sent at all. A client that joins mid-segment
+    may miss the start of a partial until that speaker's next segment.
+    """
+
+    def __init__(self, room_code: str, publish: Callable[[str, str], Awaitable[None]],
+                 tick_ms: int = TRANSCRIPT_TICK_MS):
+        self.room_code = room_code
+        self.publish = publish
+        self.tick = tick_ms / 1000
+        self.pending: Dict[str, List[dict]] = {}
+        self.partials: Dict[str, Tuple[Optional[int], str]] = {}
+        self._flushed: Optional[asyncio.Future] = None
+        self._timer: Optional[asyncio.Task] = None
+
+    def add(self, message: dict) -> asyncio.Future:
+        """Queues a transcript message; the returned future is done once it is published."""
+        events = self.pending.setdefault(message["user_id"], [])
+        if events and not events[-1]["is_final"]:
+            # Never sent, and superseded either way
+            events.pop()
+        events.append(message)
+        if self._flushed is None:
+            self._flushed = asyncio.get_running_loop().create_future()
+            self._timer = asyncio.create_task(self._flush_later())
+        return self._flushed
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.tick)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """Publishes whatever is pending right away."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flushed is None:
+            return
+        pending, self.pending = self.pending, {}
+        flushed, self._flushed = self._flushed, None
+        updates = [update for events in pending.values() for update in map(self._delta, events) if update]
+        try:
+            if updates:
+                batch = WsMsg_TranscriptBatch(user_id="system", updates=updates)
+                await self.publish(self.room_code, json.dumps(batch.dict(exclude_none=True)))
+        finally:
+            flushed.set_result(None)
+
+    def _delta(self, message: dict) -> Optional[TranscriptUpdate]:
+        user_id, seq, text = message["user_id"], message.get("seq"), message["text"]
+        common = {"queue_depth": message.get("queue_depth"), "audio_queue_depth": message.get("audio_queue_depth"),
+                  "tier": message.get("tier")}
+        if message["is_final"]:
+            self.partials.pop(user_id, None)
+            return TranscriptUpdate(op="final", user_id=user_id, seq=seq, text=text, start=message.get("start"),
+                                    end=message.get("end"), language=message.get("language"), **common)
+        last_seq, last_text = self.partials.get(user_id, (None, None))
+        self.partials[user_id] = (seq, text)
+        if last_seq == seq and last_text is not None and text.startswith(last_text):
+            if len(text) == len(last_text):
+                return None
+            return TranscriptUpdate(op="append", user_id=user_id, seq=seq, text=text[len(last_text):], **common)
+        return TranscriptUpdate(op="partial", user_id=user_id, seq=seq, text=text,
+                                degraded=message.get("degraded") or None, **common)
+
+def apply_batch(partials: Dict[str, str], batch: dict) -> List[Tuple[dict, str]]:
+    """Follows a batch's updates, returning each with its speaker's full text after it.
+
+    `partials` is the room's current partial per speaker, as this worker has seen it.
+    """
+    applied = []
+    for update in batch["updates"]:
+        user_id, op = update["user_id"], update["op"]
+        if op == "final":
+            partials.pop(user_id, None)
+            text = update["text"]
+        elif op == "append":
+            text = partials[user_id] = partials.get(user_id, "") + update["text"]
+        else:
+            text = partials[user_id] = update["text"]
+        applied.append((update, text))
+    return applied
+
+def full_messages(applied: List[Tuple[dict, str]]) -> List[dict]:
+    """One transcript message per update, as clients on the "full" protocol expect."""
+    return [
+        WsMsg_Transcript(
+            user_id=update["user_id"],
+            text=text,
+            is_final=update["op"] == "final",
+            seq=update.get("seq"),
+            start=update.get("start"),
+            end=update.get("end"),
+            language=update.get("language"),
+            queue_depth=update.get("queue_depth"),
+            audio_queue_depth=update.get("audio_queue_depth"),
+            degraded=update.get("degraded", False),
+            tier=update.get("tier"),
+        ).dict()
+        for update, text in applied
+    ]
@@ -0,0 +1,51 @@
+"""A stand-in LLM judge for local runs and load tests.
+
+Serves POST /evaluate with the request/response shape HttpJudgeBackend uses, and
+takes longer the more new text it is sent, like a real model reading its prompt.
+
+    python stub_llm_server.py --port 9000
+    JUDGE_BACKEND_URL=http://localhost:9000 uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import time
+from aiohttp import web
+
+def score(features: dict) -> dict:
+    words = max(1, features["words"])
+    clamp = lambda value: max(1, min(10, round(value)))
+    return {
+        "clarity": clamp(10 - 100 * features["fillers"] / words),
+        "logic": clamp(2 + 100 * features["logic"] / words),
+        "evidence": clamp(2 + 100 * (features["evidence"] + features["numbers"]) / words),
+        "emotional_appeal": clamp(2 + 100 * (features["emotion"] + features["exclamations"]) / words),
+    }
+
+def make_app(base_latency: float, seconds_per_word: float) -> web.Application:
+    async def evaluate(request: web.Request) -> web.Response:
+        body = await request.json()
+        new_words = sum(len(speaker["new_text"].split()) for speaker in body["speakers"].values())
+        delay = base_latency + seconds_per_word * new_words
+        await asyncio.sleep(delay)
+        scores = {user_id: score(speaker["features"]) for user_id, speaker in body["speakers"].items()}
+        winner = max(scores, key=lambda user_id: sum(scores[user_id].values()), default=None)
+        print(f"{time.strftime('%H:%M:%S')} room={body['room_code']} final={body['final']} "
+              f"new_words={new_words} took={delay:.2f}s winner={winner}")
+        return web.json_response({
+            "winner": winner,
+            "scores": scores,
+            "feedback": {user_id: f"Stub verdict over {speaker['features']['words']} words."
+                         for user_id, speaker in body["speakers"].items()},
+        })
+
+    app = web.Application()
+    app.router.add_post("/evaluate", evaluate)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--base-latency", type=float, default=0.5, help="seconds per call")
+    parser.add_argument("--seconds-per-word", type=float, default=0.002, help="extra seconds per new word")
+    args = parser.parse_args()
+    web.run_app(make_app(args.base_latency, args.seconds_per_word), port=args.port)
@@ -0,0 +1,292 @@
+# load_test.py
+# Load generator for the whole debate pipeline: N rooms x 2 debaters stream PCM into
+# the orchestrator's /ws/{room_code}/{user_id} like browsers would, then end the debate
+# and wait for the verdict. Works against the real STT service or bench/stub_stt.py.
+#
+#   python bench/stub_stt.py --port 8000 &
+#   (cd backend-orchestrator && uvicorn app.main:app --port 8001) &
+#   python bench/load_test.py --rooms 20 --seconds 30 --speed 1
+#
+# Reported per run:
+#   time to first partial  first audio frame sent -> first transcript of that speaker
+#   final latency          audio at a final segment's end was sent -> that final arrived
+#   real-time factor       first frame -> last final, over the audio's playback time
+#                          at --speed (1.0 means the pipeline kept pace exactly)
+#   judge turnaround       debate_end sent -> judge_result arrived
+#   orchestrator RSS       sampled from /proc/<pid>/status during the run
+#   messages and bytes     received per client, spectators included
+#
+# --updates delta and --encoding msgpack make every client ask for those wire formats.
+import argparse
+import asyncio
+import json
+import os
+import time
+import wave
+import aiohttp
+import numpy as np
+from typing import List, Optional
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.1  # the browser client sends 100 ms frames
+RSS_SAMPLE_SECONDS = 0.5
+
+def synthetic_speech(seconds: float, seed: int) -> bytes:
+    """Bursts of modulated noise separated by pauses, so a VAD has something to cut."""
+    rng = np.random.default_rng(seed)
+    pieces, total = [], 0
+    while total < seconds * SAMPLE_RATE:
+        talk = int(rng.uniform(1.5, 4.0) * SAMPLE_RATE)
+        envelope = 0.5 + 0.5 * np.sin(np.linspace(0, rng.uniform(6, 20), talk))
+        pieces.append(rng.normal(0, 4000, talk) * envelope)
+        pause = int(rng.uniform(0.4, 1.0) * SAMPLE_RATE)
+        pieces.append(rng.normal(0, 30, pause))
+        total += talk + pause
+    audio = np.concatenate(pieces)[:int(seconds * SAMPLE_RATE)]
+    return np.clip(audio, -32768, 32767).astype(np.int16).tobytes()
+
+def read_wav(path: str, seconds: float) -> bytes:
+    with wave.open(path, "rb") as f:
+        if f.getframerate() != SAMPLE_RATE or f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise SystemExit(f"{path} must be 16 kHz mono 16-bit PCM")
+        return f.readframes(int(seconds * SAMPLE_RATE))
+
+def find_orchestrator_pid() -> Optional[int]:
+    """The first process whose command line runs the orchestrator app."""
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                if b"app.main:app" in f.read().split(b"\0"):
+                    return int(entry)
+        except OSError:
+            continue
+    return None
+
+def rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def decode(msg) -> Optional[dict]:
+    if msg.type == aiohttp.WSMsgType.TEXT:
+        return json.loads(msg.data)
+    if msg.type == aiohttp.WSMsgType.BINARY:
+        import msgpack
+        return msgpack.unpackb(msg.data)
+    return None
+
+def transcripts(data: dict):
+    """(user_id, is_final, end) of every transcript update in a message, in either update mode."""
+    if data.get("type") == "transcript":
+        yield data.get("user_id"), data.get("is_final"), data.get("end")
+    elif data.get("type") == "transcript_batch":
+        for update in data["updates"]:
+            yield update["user_id"], update["op"] == "final", update.get("end")
+
+class Debater:
+    """One simulated browser: streams its audio and records what the room sends back."""
+
+    def __init__(self, room_code: str, user_id: str, audio: bytes, speed: float):
+        self.room_code = room_code
+        self.user_id = user_id
+        self.audio = audio
+        self.speed = speed
+        self.audio_seconds = len(audio) / 2 / SAMPLE_RATE
+        self.started: Optional[float] = None
+        self.first_partial: Optional[float] = None
+        self.last_final: Optional[float] = None
+        self.final_latencies: List[float] = []
+        self.judge_sent: Optional[float] = None
+        self.judge_turnaround: Optional[float] = None
+        self.errors: List[str] = []
+        self.judged = asyncio.Event()
+        self.messages = 0
+        self.bytes = 0
+
+    async def stream(self, ws):
+        frame_bytes = int(FRAME_SECONDS * SAMPLE_RATE) * 2
+        self.started = time.perf_counter()
+        for i, offset in enumerate(range(0, len(self.audio), frame_bytes)):
+            # Paced against absolute deadlines so slow sends don't add up to drift
+            delay = self.started + i * FRAME_SECONDS / self.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await ws.send_bytes(self.audio[offset:offset + frame_bytes])
+
+    async def receive(self, ws):
+        async for msg in ws:
+            data = decode(msg)
+            if data is None:
+                break
+            now = time.perf_counter()
+            self.messages += 1
+            self.bytes += len(msg.data)
+            kind = data.get("type")
+            for user_id, is_final, end in transcripts(data):
+                if user_id != self.user_id or self.started is None:
+                    continue
+                if self.first_partial is None:
+                    self.first_partial = now - self.started
+                if is_final:
+                    self.last_final = now
+                    if end is not None:
+                        self.final_latencies.append(now - (self.started + end / self.speed))
+            if kind == "error":
+                self.errors.append(data.get("error", "unknown error"))
+            elif kind == "judge_result":
+                if self.judge_sent is not None:
+                    self.judge_turnaround = now - self.judge_sent
+                self.judged.set()
+                return
+
+async def run_room(session: aiohttp.ClientSession, base_url: str, index: int, args, audios: List[bytes],
+                   debaters: List[Debater], listeners: List[Debater]):
+    ws_base = base_url.replace("http", "ws", 1)
+    async with session.post(f"{base_url}/api/v1/rooms/create") as response:
+        room_code = (await response.json())["room_code"]
+    pair = [Debater(room_code, f"r{index}-{side}", audio, args.speed) for side, audio in zip("ab", audios)]
+    # Spectators only listen; they never start streaming
+    spectators = [Debater(room_code, f"r{index}-s{i}", b"", args.speed) for i in range(args.spectators)]
+    debaters.extend(pair)
+    listeners.extend(pair + spectators)
+    query = f"?updates={args.updates}&encoding={args.encoding}"
+    sockets = [await session.ws_connect(f"{ws_base}/ws/{room_code}/{d.user_id}{query}", max_msg_size=0)
+               for d in pair + spectators]
+    readers = [asyncio.create_task(d.receive(ws)) for d, ws in zip(pair + spectators, sockets)]
+    try:
+        await asyncio.gather(*(d.stream(ws) for d, ws in zip(pair, sockets)))
+        # Lets the other debater's last segments come back before the verdict is asked for
+        await asyncio.sleep(args.settle)
+        pair[0].judge_sent = time.perf_counter()
+        await sockets[0].send_str(json.dumps({"event": "debate_end"}))
+        await asyncio.wait_for(pair[0].judged.wait(), args.judge_timeout)
+    except (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError) as e:
+        pair[0].errors.append(f"room {room_code}: {type(e).__name__} {e}")
+    finally:
+        for ws in sockets:
+            await ws.close()
+        for reader in readers:
+            reader.cancel()
+
+async def sample_rss(pid: int, samples: List[float], stop: asyncio.Event):
+    while not stop.is_set():
+        value = rss_mb(pid)
+        if value is not None:
+            samples.append(value)
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+def summarize(debaters: List[Debater], listeners: List[Debater], rss: List[float], args, wall: float) -> dict:
+    def stats(values: List[float]) -> Optional[dict]:
+        if not values:
+            return None
+        return {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                "p99": percentile(values, 99), "max": max(values)}
+
+    playback = [d.audio_seconds / d.speed for d in debaters]
+    return {
+        "rooms": args.rooms,
+        "debaters": len(debaters),
+        "audio_seconds_per_debater": args.seconds,
+        "speed": args.speed,
+        "wall_seconds": wall,
+        "time_to_first_partial": stats([d.first_partial for d in debaters if d.first_partial is not None]),
+        "final_latency": stats([latency for d in debaters for latency in d.final_latencies]),
+        "real_time_factor": stats([(d.last_final - d.started) / p for d, p in zip(debaters, playback)
+                                   if d.last_final is not None]),
+        "judge_turnaround": stats([d.judge_turnaround for d in debaters if d.judge_turnaround is not None]),
+        "orchestrator_rss_mb": {"start": rss[0], "peak": max(rss), "end": rss[-1]} if rss else None,
+        "updates": args.updates,
+        "encoding": args.encoding,
+        "clients": len(listeners),
+        "messages_per_client": sum(d.messages for d in listeners) / max(1, len(listeners)),
+        "bytes_per_client": sum(d.bytes for d in listeners) / max(1, len(listeners)),
+        "without_transcripts": sum(d.first_partial is None for d in debaters),
+        "errors": [error for d in debaters for error in d.errors],
+    }
+
+def report(summary: dict):
+    print(f"\n{summary['rooms']} rooms, {summary['debaters']} debaters, "
+          f"{summary['audio_seconds_per_debater']:.0f} s of audio each at {summary['speed']}x, "
+          f"{summary['wall_seconds']:.1f} s wall time\n")
+    print(f"{'':<24}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for key, unit in (("time_to_first_partial", "s"), ("final_latency", "s"),
+                      ("real_time_factor", "x"), ("judge_turnaround", "s")):
+        values = summary[key]
+        if values is None:
+            print(f"{key.replace('_', ' '):<24}{'-':>6}")
+            continue
+        print(f"{key.replace('_', ' '):<24}{values['n']:>6}" +
+              "".join(f"{values[q]:>8.3f}{unit}" for q in ("p50", "p95", "p99", "max")))
+    rss = summary["orchestrator_rss_mb"]
+    print(f"\n{summary['clients']} clients ({summary['updates']} updates, {summary['encoding']}): "
+          f"{summary['messages_per_client']:.0f} messages and {summary['bytes_per_client'] / 1024:.1f} KiB received each")
+    if rss:
+        print(f"orchestrator RSS: {rss['start']:.1f} MB at start, {rss['peak']:.1f} MB peak, {rss['end']:.1f} MB at end")
+    if summary["without_transcripts"]:
+        print(f"{summary['without_transcripts']} debater(s) never got a transcript back")
+    for error in summary["errors"][:10]:
+        print(f"error: {error}")
+
+async def main(args):
+    if args.wav:
+        audios = [read_wav(args.wav, args.seconds)] * 2
+    else:
+        audios = [synthetic_speech(args.seconds, seed) for seed in (1, 2)]
+    pid = args.orchestrator_pid or find_orchestrator_pid()
+    if pid is None:
+        print("Orchestrator process not found; RSS will not be reported (use --orchestrator-pid).")
+
+    debaters: List[Debater] = []
+    listeners: List[Debater] = []
+    rss: List[float] = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(pid, rss, stop)) if pid else None
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        rooms = []
+        for index in range(args.rooms):
+            rooms.append(asyncio.create_task(run_room(session, args.url, index, args, audios, debaters, listeners)))
+            if args.ramp:
+                await asyncio.sleep(args.ramp / args.rooms)
+        await asyncio.gather(*rooms, return_exceptions=True)
+    wall = time.perf_counter() - started
+    stop.set()
+    if sampler:
+        await sampler
+
+    summary = summarize(debaters, listeners, rss, args, wall)
+    report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the debate pipeline end to end.")
+    parser.add_argument("--url", default="http://localhost:8001", help="orchestrator base URL")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=30, help="audio per debater")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback rate; 1 is real time")
+    parser.add_argument("--wav", help="16 kHz mono fixture instead of synthetic speech")
+    parser.add_argument("--spectators", type=int, default=0, help="listen-only clients per room")
+    parser.add_argument("--updates", choices=("full", "delta"), default="full")
+    parser.add_argument("--encoding", choices=("json", "msgpack"), default="json")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which rooms are started")
+    parser.add_argument("--settle", type=float, default=1, help="seconds between end of audio and debate_end")
+    parser.add_argument("--judge-timeout", type=float, default=60)
+    parser.add_argument("--orchestrator-pid", type=int, help="defaults to the first process running app.main:app")
+    parser.add_argument("--json", help="also write the summary to this file")
+    asyncio.run(main(parser.parse_args()))
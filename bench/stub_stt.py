@@ -0,0 +1,150 @@
+# stub_stt.py
+# A deterministic stand-in for the STT service, speaking the same WebSocket protocol
+# (/ws/transcribe and /ws/transcribe/mux), so the orchestrator can be load-tested
+# without a GPU or a model. Every `chunk` seconds of audio becomes one final segment
+# after a simulated decode time; a partial, one word longer each time, goes out for
+# each `partial` seconds heard.
+#
+#   python bench/stub_stt.py --port 8000 --rtf 0.1
+import argparse
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict
+import uvicorn
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+
+SAMPLE_RATE = 16000
+CONFIG = {
+    "chunk_seconds": 2.0,    # audio per final segment
+    "partial_seconds": 0.5,  # audio between partials
+    "rtf": 0.1,              # decode time per second of audio
+}
+
+app = FastAPI(title="Stub STT Service")
+
+class StubSession:
+    """One audio stream: counts samples and emits segments in order from a decode task."""
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]]):
+        self.send = send
+        self.samples = 0
+        self.cut = 0          # first sample not yet in a final segment
+        self.partial_at = 0   # sample count at the last partial
+        self.seq = 0
+        self.jobs: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._decode())
+
+    async def _decode(self):
+        while True:
+            job = await self.jobs.get()
+            if job is None:
+                return
+            start, end = job
+            await asyncio.sleep(CONFIG["rtf"] * (end - start) / SAMPLE_RATE)
+            await self.send({
+                "text": f"segment {self.seq} from {start / SAMPLE_RATE:.1f} to {end / SAMPLE_RATE:.1f}",
+                "is_final": True,
+                "seq": self.seq,
+                "start": round(start / SAMPLE_RATE, 2),
+                "end": round(end / SAMPLE_RATE, 2),
+                "language": "en",
+                "queue_depth": self.jobs.qsize(),
+            })
+            self.seq += 1
+
+    async def feed(self, data: bytes):
+        self.samples += len(data) // 2
+        chunk = int(CONFIG["chunk_seconds"] * SAMPLE_RATE)
+        while self.samples - self.cut >= chunk:
+            self.jobs.put_nowait((self.cut, self.cut + chunk))
+            self.cut += chunk
+        if self.samples - self.partial_at >= CONFIG["partial_seconds"] * SAMPLE_RATE:
+            self.partial_at = self.samples
+            words = int((self.samples - self.cut) / (CONFIG["partial_seconds"] * SAMPLE_RATE))
+            await self.send({
+                "text": " ".join(f"word{i}" for i in range(words + 1)),
+                "is_final": False,
+                "seq": self.seq,
+                "queue_depth": self.jobs.qsize(),
+            })
+
+    async def finish(self):
+        if self.samples > self.cut:
+            self.jobs.put_nowait((self.cut, self.samples))
+        self.jobs.put_nowait(None)
+        await self.task
+
+    def close(self):
+        self.task.cancel()
+
+@app.get("/ready")
+async def readiness():
+    return {"status": "ready", "model": "stub"}
+
+@app.websocket("/ws/transcribe")
+async def websocket_transcribe(websocket: WebSocket):
+    await websocket.accept()
+    session = StubSession(websocket.send_json)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                await session.feed(message["bytes"])
+            elif message.get("text") and json.loads(message["text"]).get("event") == "end_of_stream":
+                break
+        await session.finish()
+        await websocket.close()
+    except WebSocketDisconnect:
+        session.close()
+
+@app.websocket("/ws/transcribe/mux")
+async def websocket_transcribe_mux(websocket: WebSocket):
+    await websocket.accept()
+    sessions: Dict[int, StubSession] = {}
+    send_lock = asyncio.Lock()
+
+    def sender(stream_id: int):
+        async def send(message: dict):
+            message["stream"] = stream_id
+            async with send_lock:
+                await websocket.send_json(message)
+        return send
+
+    async def finish_stream(stream_id: int, session: StubSession):
+        await session.finish()
+        await sender(stream_id)({"op": "closed"})
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                data = message["bytes"]
+                session = sessions.get(int.from_bytes(data[:4], "big"))
+                if session is not None:
+                    await session.feed(data[4:])
+            elif message.get("text"):
+                control = json.loads(message["text"])
+                stream_id = control.get("stream")
+                if control.get("op") == "open" and stream_id not in sessions:
+                    sessions[stream_id] = StubSession(sender(stream_id))
+                elif control.get("op") == "end" and stream_id in sessions:
+                    asyncio.create_task(finish_stream(stream_id, sessions.pop(stream_id)))
+                elif control.get("op") == "abort" and stream_id in sessions:
+                    sessions.pop(stream_id).close()
+    except WebSocketDisconnect:
+        for session in sessions.values():
+            session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stub of the STT service.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--chunk", type=float, default=CONFIG["chunk_seconds"], help="seconds of audio per final segment")
+    parser.add_argument("--partial", type=float, default=CONFIG["partial_seconds"], help="seconds of audio between partials")
+    parser.add_argument("--rtf", type=float, default=CONFIG["rtf"], help="simulated decode seconds per audio second")
+    args = parser.parse_args()
+    CONFIG.update(chunk_seconds=args.chunk, partial_seconds=args.partial, rtf=args.rtf)
+    uvicorn.run(app, port=args.port, log_level="warning")
@@ -0,0 +1,61 @@
+from typing import Optional
+from metrics import UNDECODABLE_PACKETS
+
+# Formats a live client may send. Apart from raw PCM, every binary message is one
+# packet of the codec, as a WebCodecs AudioEncoder emits them (no container).
+CODECS = ("pcm", "opus", "flac")
+# FFmpeg decoder and the rate its packets decode at, before resampling to the session rate
+_DECODERS = {"opus": ("opus", 48000), "flac": ("flac", 16000)}
+
+def codec_error(codec: str) -> Optional[str]:
+    """Why this node can't take a stream in `codec`, or None if it can."""
+    if codec not in CODECS:
+        return f"Unsupported audio codec '{codec}'. Use one of: {', '.join(CODECS)}."
+    if codec != "pcm":
+        try:
+            import av  # noqa: F401
+        except ImportError:
+            return f"This STT node cannot decode {codec}; send pcm instead."
+    return None
+
+class PacketDecoder:
+    """Decodes one stream's compressed packets into 16-bit mono PCM as they arrive.
+
+    FFmpeg keeps the codec state between packets, so each packet costs only its own
+    decode; nothing is buffered here beyond what the codec and resampler need.
+    """
+
+    def __init__(self, codec: str, sample_rate: int = 16000):
+        import av
+        self._av = av
+        name, rate = _DECODERS[codec]
+        self.codec = codec
+        self.context = av.CodecContext.create(name, "r")
+        self.context.sample_rate = rate
+        self.context.layout = "mono"
+        self.resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+        self.bad_packets = 0
+
+    def _pcm(self, frames) -> bytes:
+        return b"".join(
+            resampled.to_ndarray().tobytes() for frame in frames for resampled in self.resampler.resample(frame)
+        )
+
+    def decode(self, packet: bytes) -> bytes:
+        """PCM for one packet; a packet the codec rejects is skipped, not fatal."""
+        try:
+            return self._pcm(self.context.decode(self._av.Packet(bytes(packet))))
+        except self._av.error.FFmpegError as e:
+            self.bad_packets += 1
+            UNDECODABLE_PACKETS.inc()
+            if self.bad_packets == 1 or self.bad_packets % 100 == 0:
+                print(f"Skipped {self.bad_packets} undecodable {self.codec} packet(s): {e}")
+            return b""
+
+    def flush(self) -> bytes:
+        """Whatever the codec and resampler still hold at the end of the stream."""
+        try:
+            pcm = self._pcm(self.context.decode(None))
+        except self._av.error.FFmpegError:
+            pcm = b""
+        return pcm + b"".join(frame.to_ndarray().tobytes() for frame in self.resampler.resample(None))
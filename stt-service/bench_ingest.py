@@ -0,0 +1,117 @@
+# bench_ingest.py
+# Microbenchmark for the live ingest path: how many bytes get copied per second of audio
+# by the old bytearray slicing, the bare ring buffer, and TranscriptionSession._ingest
+# itself (ring write, VAD framing and per-segment conversion).
+import asyncio
+import time
+import numpy as np
+from ring_buffer import PCMRingBuffer, Float32Pool
+from session import TranscriptionSession
+
+SAMPLE_RATE = 16000
+CHUNK_DURATION_SECONDS = 5
+CHUNK_SIZE_BYTES = CHUNK_DURATION_SECONDS * SAMPLE_RATE * 2
+MESSAGE_BYTES = 3200  # 100 ms frames, as the browser client sends them
+AUDIO_SECONDS = 600
+
+def bytearray_ingest(messages):
+    """The original loop: slice off chunks, copy to bytes, then convert with two temporaries."""
+    copied = 0
+    audio_buffer = bytearray()
+    for data in messages:
+        audio_buffer.extend(data)
+        copied += len(data)
+        while len(audio_buffer) >= CHUNK_SIZE_BYTES:
+            chunk_to_process = audio_buffer[:CHUNK_SIZE_BYTES]
+            audio_buffer = audio_buffer[CHUNK_SIZE_BYTES:]
+            copied += CHUNK_SIZE_BYTES + len(audio_buffer)
+            chunk = bytes(chunk_to_process)
+            copied += len(chunk)
+            audio_np = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32768.0
+            copied += 2 * audio_np.nbytes
+    return copied
+
+def ring_buffer_ingest(messages):
+    """The new loop: one copy into the ring, one in-place conversion into a pooled array."""
+    copied = 0
+    ring = PCMRingBuffer(2 * CHUNK_DURATION_SECONDS * SAMPLE_RATE)
+    pool = Float32Pool(CHUNK_DURATION_SECONDS * SAMPLE_RATE)
+    chunk_samples = CHUNK_SIZE_BYTES // 2
+    for data in messages:
+        copied += ring.write(data)
+        while len(ring) >= chunk_samples:
+            scratch = pool.acquire()
+            audio_np = ring.to_float32(ring.start, ring.start + chunk_samples, scratch)
+            copied += audio_np.nbytes
+            ring.release(ring.start + chunk_samples)
+            pool.release(scratch)
+    return copied
+
+def session_ingest(messages):
+    """The real live path: TranscriptionSession._ingest, with a decoder that returns at once.
+
+    On top of the ring write and the pooled conversion, every message goes through
+    StreamingVAD.feed, which joins it to the last partial frame, keeps the new partial
+    frame, and builds full-size float32 and mask temporaries to classify the frames.
+    """
+    copied = 0
+
+    async def transcribe(audio, prompt, language):
+        return "", "en", "bench"
+
+    async def send(message):
+        pass
+
+    async def ingest():
+        nonlocal copied
+        session = TranscriptionSession(transcribe, send, max_segment_seconds=CHUNK_DURATION_SECONDS)
+        ring, vad = session.ring, session.vad
+        ring_write, ring_to_float32, vad_feed = ring.write, ring.to_float32, vad.feed
+
+        def write(data):
+            nonlocal copied
+            consumed = ring_write(data)
+            copied += consumed
+            return consumed
+
+        def to_float32(start, end, out):
+            nonlocal copied
+            audio_np = ring_to_float32(start, end, out)
+            copied += audio_np.nbytes
+            return audio_np
+
+        def feed(samples):
+            nonlocal copied
+            total = vad._remainder.size + samples.size
+            usable = total // vad.frame_size * vad.frame_size
+            if vad._remainder.size:
+                copied += 2 * total  # np.concatenate with the remainder
+            copied += 2 * (total - usable)  # the new remainder's copy
+            # astype(float32) and / 32768 (4 + 4 bytes), then classify's square (4),
+            # sign bits (1) and the compared sign bits (1) per sample
+            copied += 14 * usable
+            return vad_feed(samples)
+
+        ring.write, ring.to_float32, vad.feed = write, to_float32, feed
+        for data in messages:
+            await session._ingest(data)
+        await session.finish()
+        await session.close()
+
+    asyncio.run(ingest())
+    return copied
+
+def run(name, ingest, messages):
+    start = time.perf_counter()
+    copied = ingest(messages)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {copied / AUDIO_SECONDS / 1024:10.1f} KiB copied per audio second"
+          f"   {elapsed * 1000 / AUDIO_SECONDS:8.3f} ms CPU per audio second")
+
+if __name__ == "__main__":
+    audio = (np.random.randn(AUDIO_SECONDS * SAMPLE_RATE) * 3000).astype(np.int16).tobytes()
+    messages = [audio[i:i + MESSAGE_BYTES] for i in range(0, len(audio), MESSAGE_BYTES)]
+    print(f"Ingesting {AUDIO_SECONDS} s of 16 kHz PCM in {MESSAGE_BYTES}-byte messages\n")
+    run("bytearray", bytearray_ingest, messages)
+    run("ring buffer", ring_buffer_ingest, messages)
+    run("session", session_ingest, messages)
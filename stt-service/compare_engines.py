@@ -0,0 +1,154 @@
+# compare_engines.py
+# Compares transcription engines (STT_ENGINE) on the same audio: real-time factor, memory
+# footprint and word error rate, to pick the speed/accuracy trade-off for a deployment.
+#
+# Fixtures are pairs in one directory: `name.wav` (any rate; 16 kHz mono 16-bit is read
+# directly, anything else goes through ffmpeg) and `name.txt` with its reference text.
+# fixtures/debate_opening is a 20 s opening statement, synthesized with espeak-ng (en-us)
+# so it can ship with the repo; add recordings of real speakers next to it for a truer WER.
+# Without fixtures, synthetic audio still gives the speed and memory columns.
+#
+#   python compare_engines.py --model base --fixtures fixtures/
+#   python compare_engines.py --model tiny,base --engines float32,int8 --threads 4 --json
+import argparse
+import glob
+import io
+import json
+import multiprocessing as mp
+import os
+import re
+import time
+import wave
+import numpy as np
+from engines import ENGINES
+from vad import StreamingVAD
+
+SAMPLE_RATE = 16000
+# Same cut as uploads: at pauses, up to Whisper's window
+MAX_SEGMENT_SECONDS = 28
+BATCH_SIZE = 8
+SYNTHETIC_SECONDS = 60
+
+def load_fixtures(directory: str):
+    """(name, int16 PCM, reference text or None) for every wav in the directory."""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+        with wave.open(path, "rb") as wav:
+            if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) == (SAMPLE_RATE, 1, 2):
+                pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+            else:
+                from whisper.audio import load_audio
+                pcm = (load_audio(path, SAMPLE_RATE) * 32767).astype(np.int16)
+        reference = os.path.splitext(path)[0] + ".txt"
+        text = open(reference, encoding="utf-8").read() if os.path.exists(reference) else None
+        fixtures.append((os.path.basename(path), pcm, text))
+    return fixtures
+
+def synthetic_fixture():
+    """Noise bursts between pauses: no words to score, but realistic segment lengths."""
+    rng = np.random.default_rng(0)
+    parts = []
+    while sum(map(len, parts)) < SYNTHETIC_SECONDS * SAMPLE_RATE:
+        parts.append((rng.standard_normal(int(rng.uniform(2, 8) * SAMPLE_RATE)) * 3000).astype(np.int16))
+        parts.append((rng.standard_normal(SAMPLE_RATE) * 20).astype(np.int16))
+    return [("synthetic", np.concatenate(parts), None)]
+
+def segments(pcm: np.ndarray):
+    vad = StreamingVAD(SAMPLE_RATE, max_segment_seconds=MAX_SEGMENT_SECONDS)
+    cuts = [(start, end) for start, end, _ in vad.feed(pcm)] + [(start, end) for start, end, _ in vad.flush()]
+    return [pcm[start:end].astype(np.float32) / 32768 for start, end in cuts]
+
+def words(text: str):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+def word_errors(reference, hypothesis) -> int:
+    """Substitutions + deletions + insertions (Levenshtein over words)."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1]
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(model_name: str, kind: str, fixtures, threads: int, language: str) -> dict:
+    """Runs in a fresh process, so its memory readings belong to this engine alone."""
+    import torch
+    from engines import create_engine
+    if threads:
+        torch.set_num_threads(threads)
+    torch.zeros(1)  # torch's own footprint is not the engine's
+    before = rss_mb()
+    started = time.perf_counter()
+    engine = create_engine(model_name, kind)
+    load_seconds = time.perf_counter() - started
+    buffer = io.BytesIO()
+    torch.save(engine.model.state_dict(), buffer)
+    engine.transcribe([np.zeros(SAMPLE_RATE, dtype=np.float32)], [None], [language])  # warmup
+
+    audio_seconds = decode_seconds = 0.0
+    errors = reference_words = 0
+    for _, pcm, reference in fixtures:
+        chunks = segments(pcm)
+        texts = []
+        started = time.perf_counter()
+        for i in range(0, len(chunks), BATCH_SIZE):
+            batch = chunks[i:i + BATCH_SIZE]
+            texts += [text for text, _ in engine.transcribe(batch, [None] * len(batch), [language] * len(batch))]
+        decode_seconds += time.perf_counter() - started
+        audio_seconds += len(pcm) / SAMPLE_RATE
+        if reference is not None:
+            expected = words(reference)
+            errors += word_errors(expected, words(" ".join(texts)))
+            reference_words += len(expected)
+    return {
+        "model": model_name,
+        "engine": kind,
+        "load_seconds": round(load_seconds, 2),
+        "model_mb": round(buffer.tell() / 1e6, 1),
+        "rss_mb": round(rss_mb() - before, 1),
+        "rtf": round(decode_seconds / audio_seconds, 3) if audio_seconds else None,
+        "wer": round(errors / reference_words, 3) if reference_words else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare transcription engines on the same audio.")
+    parser.add_argument("--model", default="base", help="Whisper model name(s), comma-separated")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="engines to compare, comma-separated")
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"),
+                        help="directory of name.wav + name.txt pairs")
+    parser.add_argument("--language", default="en", help="pinned language, as the live path does once known")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads per engine (0: torch default)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if os.path.isdir(args.fixtures) else []
+    if not fixtures:
+        print(f"No fixtures in {args.fixtures}; timing {SYNTHETIC_SECONDS} s of synthetic audio (no WER).")
+        fixtures = synthetic_fixture()
+    total = sum(len(pcm) for _, pcm, _ in fixtures) / SAMPLE_RATE
+    print(f"{len(fixtures)} fixture(s), {total:.1f} s of audio.")
+
+    results = []
+    context = mp.get_context("spawn")
+    for model_name in args.model.split(","):
+        for kind in args.engines.split(","):
+            with context.Pool(1) as pool:
+                results.append(pool.apply(measure, (model_name, kind, fixtures, args.threads, args.language)))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'model':<10}{'engine':<10}{'load s':>8}{'model MB':>10}{'RSS MB':>9}{'RTF':>8}{'WER':>8}")
+        for r in results:
+            wer = f"{r['wer']:.1%}" if r["wer"] is not None else "n/a"
+            print(f"{r['model']:<10}{r['engine']:<10}{r['load_seconds']:>8}{r['model_mb']:>10}{r['rss_mb']:>9}"
+                  f"{r['rtf']:>8}{wer:>8}")
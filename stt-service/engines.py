@@ -0,0 +1,52 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+# "float32" runs openai-whisper as it is; "int8" quantizes its linear layers for CPU-only nodes
+ENGINES = ("float32", "int8")
+
+class TranscriptionEngine:
+    """A loaded Whisper model behind the one call the service makes on it: a batch of
+    float32 chunks in, (text, language) per chunk out."""
+
+    kind = "float32"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.model = self.load()
+
+    def load(self):
+        import whisper
+        return whisper.load_model(self.model_name)
+
+    def transcribe(self, audios: List[np.ndarray], prompts: Optional[List[Optional[str]]] = None,
+                   languages: Optional[List[Optional[str]]] = None) -> List[Tuple[str, str]]:
+        from inference import decode_chunks
+        return decode_chunks(self.model, audios, prompts, languages)
+
+class Int8Engine(TranscriptionEngine):
+    """Whisper with every linear layer dynamically quantized to int8, on the CPU.
+
+    Weights are stored as int8 and activations are quantized on the fly per batch, so
+    the attention and MLP matmuls (most of the work) run on int8 kernels. Convolutions,
+    embeddings and layer norms stay float32. The same Whisper decoding code runs on top.
+    """
+
+    kind = "int8"
+
+    def load(self):
+        import torch
+        import whisper
+        model = whisper.load_model(self.model_name, device="cpu")
+        for module in model.modules():
+            if isinstance(module, torch.nn.Linear):
+                # Whisper's subclass only casts weights to the input dtype, which float32
+                # decoding never needs; the quantizer swaps plain nn.Linear layers only
+                module.__class__ = torch.nn.Linear
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def create_engine(model_name: str, kind: str = "float32") -> TranscriptionEngine:
+    if kind == "int8":
+        return Int8Engine(model_name)
+    if kind == "float32":
+        return TranscriptionEngine(model_name)
+    raise ValueError(f"Unknown STT_ENGINE '{kind}'; expected one of: {', '.join(ENGINES)}.")
@@ -0,0 +1,153 @@
+import asyncio
+import shutil
+import time
+import numpy as np
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+from vad import StreamingVAD
+from ring_buffer import PCMRingBuffer, Float32Pool
+
+# Compressed bytes handed to ffmpeg, and PCM bytes read back, per step
+READ_CHUNK_BYTES = 64 * 1024
+# How much of ffmpeg's error output is kept for the error message
+STDERR_TAIL_BYTES = 4096
+
+class FfmpegNotFound(RuntimeError):
+    pass
+
+async def _pump_upload(read: Callable[[int], Awaitable[bytes]], stdin: asyncio.StreamWriter):
+    """Streams the upload into ffmpeg; blocks whenever ffmpeg (and so the decoder) is behind."""
+    try:
+        while True:
+            chunk = await read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            stdin.write(chunk)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # ffmpeg gave up on the input; its exit status tells the reader why
+        pass
+    finally:
+        stdin.close()
+
+async def _drain_stderr(stderr: asyncio.StreamReader) -> bytes:
+    """Reads ffmpeg's error output as it comes, so a noisy decode never fills the pipe and
+    stalls; returns its last STDERR_TAIL_BYTES."""
+    tail = b""
+    while True:
+        chunk = await stderr.read(READ_CHUNK_BYTES)
+        if not chunk:
+            return tail
+        tail = (tail + chunk)[-STDERR_TAIL_BYTES:]
+
+async def transcribe_upload(
+    read: Callable[[int], Awaitable[bytes]],
+    transcribe: Callable[[np.ndarray, Optional[str], Optional[str]], Awaitable[Tuple[str, str]]],
+    sample_rate: int = 16000,
+    max_segment_seconds: float = 28,
+    energy_threshold: float = 0.01,
+    min_silence_ms: int = 500,
+    max_inflight: int = 8,
+    language: Optional[str] = None,
+) -> AsyncIterator[dict]:
+    """Decodes an uploaded file of any format and yields its segments as they are transcribed.
+
+    The file is piped through ffmpeg and cut at pauses by the VAD; up to `max_inflight`
+    segments are decoded at once, so results may arrive out of order and carry their
+    own index and timestamps. Memory stays bounded by the ring buffer and the segments
+    in flight, however long the file is: while every slot is busy, reading stops.
+    Without a `language`, the first segment with speech decides it for the rest.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise FfmpegNotFound("ffmpeg is not installed on this node.")
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg, "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    pump = asyncio.create_task(_pump_upload(read, process.stdin))
+    errors = asyncio.create_task(_drain_stderr(process.stderr))
+    # A file has no need to revisit audio across cuts, so segments don't overlap
+    vad = StreamingVAD(
+        sample_rate,
+        energy_threshold=energy_threshold,
+        min_silence_ms=min_silence_ms,
+        max_segment_seconds=max_segment_seconds,
+    )
+    ring = PCMRingBuffer(int(2 * max_segment_seconds * sample_rate))
+    float_pool = Float32Pool(int((max_segment_seconds + 1) * sample_rate))
+    slots = asyncio.Semaphore(max_inflight)
+    results: asyncio.Queue = asyncio.Queue()
+    tasks = set()
+
+    async def decode(index: int, start: int, end: int, scratch: np.ndarray, audio: np.ndarray):
+        nonlocal language
+        began = time.perf_counter()
+        try:
+            text, detected = await transcribe(audio, None, language)
+            if language is None and text.strip():
+                language = detected
+        finally:
+            float_pool.release(scratch)
+            slots.release()
+        await results.put({
+            "index": index,
+            "start": round(start / sample_rate, 2),
+            "end": round(end / sample_rate, 2),
+            "text": text.strip(),
+            "language": language,
+            "decode_seconds": round(time.perf_counter() - began, 2),
+        })
+
+    async def submit(index: int, start: int, end: int):
+        await slots.acquire()
+        scratch = float_pool.acquire()
+        audio = ring.to_float32(start, min(end, start + float_pool.size), scratch)
+        task = asyncio.create_task(decode(index, start, end, scratch, audio))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def split():
+        index = 0
+        while True:
+            data = await process.stdout.read(READ_CHUNK_BYTES)
+            if not data:
+                break
+            data = memoryview(data)
+            while data:
+                fed = ring.end
+                data = data[ring.write(data):]
+                for part in ring.views(fed, ring.end):
+                    for start, end, _ in vad.feed(part):
+                        await submit(index, start, end)
+                        index += 1
+                ring.release(vad.retain_from)
+        for start, end, _ in vad.flush():
+            await submit(index, start, end)
+            index += 1
+        await pump
+        if await process.wait() != 0:
+            error = (await errors).decode(errors="replace").strip()
+            raise RuntimeError(f"ffmpeg could not decode the upload: {error or process.returncode}")
+        if tasks:
+            await asyncio.gather(*tasks)
+        return index, vad.position / sample_rate
+
+    splitter = asyncio.create_task(split())
+    splitter.add_done_callback(lambda _: results.put_nowait(None))
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            yield item
+        segments, duration = splitter.result()
+        yield {"done": True, "segments": segments, "duration_seconds": round(duration, 2)}
+    finally:
+        for task in (splitter, pump, errors, *tasks):
+            task.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
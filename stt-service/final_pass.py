@@ -0,0 +1,224 @@
+import asyncio
+import os
+import time
+import uuid
+import numpy as np
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from vad import StreamingVAD
+from metrics import FINAL_PASS_SECONDS
+
+# Spilled audio is fed to the VAD this many samples at a time, to bound the float copies
+VAD_BLOCK_SAMPLES = 30 * 16000
+
+class SessionAudio:
+    """Everything one live session heard, appended as int16 PCM to a spill file.
+
+    Nothing is kept in memory: a final pass maps the file read-only and slices its
+    segments straight out of the page cache.
+    """
+
+    def __init__(self, session_id: str, path: str):
+        self.session_id = session_id
+        self.path = path
+        self.file = open(path, "wb")
+        self.samples = 0
+        self.language: Optional[str] = None
+        self.opened_at = time.time()
+        self.closed_at: Optional[float] = None
+        self.result: Optional[dict] = None  # the newest finished pass
+        self.task: Optional[asyncio.Task] = None
+
+    def write(self, data):
+        self.file.write(data)
+        self.samples += len(data) // 2
+
+    def pcm(self, samples: int) -> np.ndarray:
+        """The first `samples` samples, memory-mapped."""
+        if not self.file.closed:
+            self.file.flush()
+        if samples == 0:
+            return np.empty(0, dtype=np.int16)
+        return np.memmap(self.path, dtype=np.int16, mode="r", shape=(samples,))
+
+    def covers(self, samples: int) -> bool:
+        """Whether the newest pass heard at least the first `samples` samples."""
+        return self.result is not None and "error" not in self.result and self.result["samples"] >= samples
+
+    def delete(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class FinalPassStore:
+    """Spills live sessions' audio and re-transcribes it with a larger model in the background.
+
+    A pass starts when a session closes, or when its result is asked for while it is
+    still open (covering the audio so far). Passes share `concurrency` slots, so the
+    final model never competes with more than that many jobs at once. Results and
+    spill files are deleted `retention_seconds` after their session closed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: int = 16000,
+        max_segment_seconds: float = 28,
+        energy_threshold: float = 0.01,
+        min_silence_ms: int = 500,
+        batch_size: int = 4,
+        concurrency: int = 1,
+        retention_seconds: float = 900,
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_segment_seconds = max_segment_seconds
+        self.energy_threshold = energy_threshold
+        self.min_silence_ms = min_silence_ms
+        self.batch_size = batch_size
+        self.retention_seconds = retention_seconds
+        self.slots = asyncio.Semaphore(concurrency)
+        # One id may have several parts: a stream that reconnected, or moved to this node and back
+        self.sessions: Dict[str, List[SessionAudio]] = {}
+        self.decode: Optional[Callable[..., Awaitable[List[Tuple[str, str]]]]] = None
+        self.model_ready = asyncio.Event()
+        self.error: Optional[str] = None  # set if the final model never loads
+        self._sweeper: Optional[asyncio.Task] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, decode: Callable[..., Awaitable[List[Tuple[str, str]]]]):
+        """Passes wait until the final model is loaded and `decode` can run it."""
+        self.decode = decode
+        self.model_ready.set()
+        self._start_sweeper()
+
+    def fail(self, error: str):
+        """The final model could not be loaded: waiting and future passes fail with `error`.
+
+        Sessions spilled before this are still deleted once their retention is over.
+        """
+        self.error = error
+        self.model_ready.set()
+        self._start_sweeper()
+
+    def _start_sweeper(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+        for parts in self.sessions.values():
+            for audio in parts:
+                if audio.task:
+                    audio.task.cancel()
+                audio.delete()
+        self.sessions.clear()
+
+    def open(self, session_id: str) -> SessionAudio:
+        audio = SessionAudio(session_id, os.path.join(self.directory, f"{uuid.uuid4().hex}.pcm"))
+        self.sessions.setdefault(session_id, []).append(audio)
+        return audio
+
+    def close(self, audio: SessionAudio, language: Optional[str]):
+        """Ends a session's spill and schedules its final pass."""
+        audio.language = language
+        audio.closed_at = time.time()
+        audio.file.close()
+        self._schedule(audio)
+
+    def _schedule(self, audio: SessionAudio) -> asyncio.Task:
+        if audio.task is None or audio.task.done():
+            audio.task = asyncio.create_task(self._run(audio))
+        return audio.task
+
+    async def result(self, session_id: str, wait: float) -> Optional[List[dict]]:
+        """Each part's pass over the audio heard so far, waiting up to `wait` s for any still
+        running; None for an unknown session."""
+        parts = self.sessions.get(session_id)
+        if parts is None:
+            return None
+        targets = [audio.samples for audio in parts]
+        tasks = [self._schedule(audio) for audio, samples in zip(parts, targets) if not audio.covers(samples)]
+        if tasks and wait > 0:
+            await asyncio.wait([asyncio.shield(task) for task in tasks], timeout=wait)
+        return [self._describe(audio, samples) for audio, samples in zip(parts, targets)]
+
+    def _describe(self, audio: SessionAudio, samples: int) -> dict:
+        part = {"opened_at": audio.opened_at, "closed": audio.closed_at is not None}
+        if audio.covers(samples):
+            part.update(status="done", audio_seconds=round(audio.result["samples"] / self.sample_rate, 2),
+                        **{k: v for k, v in audio.result.items() if k != "samples"})
+        elif audio.result and "error" in audio.result and audio.task.done():
+            part.update(status="failed", error=audio.result["error"])
+        else:
+            part["status"] = "pending"
+        return part
+
+    async def _run(self, audio: SessionAudio):
+        while True:
+            samples = audio.samples
+            try:
+                audio.result = await self._transcribe(audio, samples)
+            except Exception as e:
+                print(f"Final pass of session {audio.session_id} failed: {e}")
+                audio.result = {"samples": samples, "error": str(e)}
+                return
+            # A session that closed while the pass ran needs one more, over everything
+            if audio.closed_at is None or audio.covers(audio.samples):
+                return
+
+    def _cut(self, pcm: np.ndarray) -> List[Tuple[int, int]]:
+        """VAD segments over the whole recording, up to Whisper's window and without overlap."""
+        vad = StreamingVAD(
+            self.sample_rate,
+            energy_threshold=self.energy_threshold,
+            min_silence_ms=self.min_silence_ms,
+            max_segment_seconds=self.max_segment_seconds,
+        )
+        cuts = []
+        for offset in range(0, len(pcm), VAD_BLOCK_SAMPLES):
+            cuts += [(start, end) for start, end, _ in vad.feed(pcm[offset:offset + VAD_BLOCK_SAMPLES])]
+        return cuts + [(start, end) for start, end, _ in vad.flush()]
+
+    async def _transcribe(self, audio: SessionAudio, samples: int) -> dict:
+        await self.model_ready.wait()
+        if self.decode is None:
+            raise RuntimeError(f"Final-pass model is unavailable: {self.error}")
+        async with self.slots:
+            started = time.perf_counter()
+            pcm = audio.pcm(samples)
+            cuts = await asyncio.to_thread(self._cut, pcm)
+            language = audio.language
+            segments = []
+            for i in range(0, len(cuts), self.batch_size):
+                batch = cuts[i:i + self.batch_size]
+                audios = [pcm[start:end].astype(np.float32) / 32768 for start, end in batch]
+                results = await self.decode(audios, [None] * len(batch), [language] * len(batch))
+                for (start, end), (text, detected) in zip(batch, results):
+                    if language is None and text.strip():
+                        language = detected
+                    if text.strip():
+                        segments.append({"start": round(start / self.sample_rate, 2),
+                                         "end": round(end / self.sample_rate, 2), "text": text.strip()})
+            del pcm
+            elapsed = time.perf_counter() - started
+            FINAL_PASS_SECONDS.observe(elapsed)
+            print(f"Final pass of session {audio.session_id}: {samples / self.sample_rate:.1f} s of audio, "
+                  f"{len(segments)} segments in {elapsed:.2f} s.")
+            return {"samples": samples, "language": language, "segments": segments,
+                    "text": " ".join(segment["text"] for segment in segments)}
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - self.retention_seconds
+            for session_id, parts in list(self.sessions.items()):
+                expired = [audio for audio in parts if audio.closed_at is not None and audio.closed_at < cutoff
+                           and (audio.task is None or audio.task.done())]
+                for audio in expired:
+                    audio.delete()
+                    parts.remove(audio)
+                if not parts:
+                    del self.sessions[session_id]
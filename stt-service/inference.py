@@ -0,0 +1,70 @@
+import re
+import threading
+import numpy as np
+import torch
+import whisper
+from dataclasses import replace
+from typing import List, Optional, Tuple
+from whisper.audio import N_FFT, HOP_LENGTH, N_SAMPLES, mel_filters
+
+# Options used for every live chunk. Chunks are short, so we only need text tokens.
+CHUNK_DECODING_OPTIONS = whisper.DecodingOptions(fp16=False, without_timestamps=True)
+# Special-token markup occasionally leaks into decoded text; it must never come back as a prompt
+SPECIAL_TOKEN_PATTERN = re.compile(r"<\|[^|]*\|>")
+
+# Per-thread scratch reused by every batch: the 30 s padding rows and the STFT window
+_scratch = threading.local()
+
+def _padded_batch(audios: List[np.ndarray]) -> torch.Tensor:
+    """Copies each chunk into a reused zero-padded 30 s row, instead of np.pad per chunk."""
+    buffer = getattr(_scratch, "buffer", None)
+    if buffer is None or len(buffer) < len(audios):
+        buffer = _scratch.buffer = np.zeros((len(audios), N_SAMPLES), dtype=np.float32)
+    for row, audio in zip(buffer, audios):
+        n = min(len(audio), N_SAMPLES)
+        row[:n] = audio[:n]
+        row[n:] = 0
+    return torch.from_numpy(buffer[:len(audios)])
+
+def log_mel_batch(audios: List[np.ndarray], n_mels: int, device) -> torch.Tensor:
+    """Whisper's log-mel spectrogram for a whole batch in one STFT; same values per chunk."""
+    window = getattr(_scratch, "window", None)
+    if window is None:
+        window = _scratch.window = torch.hann_window(N_FFT)
+    stft = torch.stft(_padded_batch(audios), N_FFT, HOP_LENGTH, window=window, return_complex=True)
+    magnitudes = stft[..., :-1].abs() ** 2
+    mel_spec = mel_filters(magnitudes.device, n_mels) @ magnitudes
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    # The dynamic range is clamped per chunk, exactly as whisper.log_mel_spectrogram does
+    log_spec = torch.maximum(log_spec, log_spec.amax(dim=(1, 2), keepdim=True) - 8.0)
+    return ((log_spec + 4.0) / 4.0).to(device)
+
+def decode_batch(model, audios: List[np.ndarray], prompts: Optional[List[Optional[str]]] = None,
+                 languages: Optional[List[Optional[str]]] = None, options=CHUNK_DECODING_OPTIONS):
+    """Runs one batched mel+encoder+decoder pass over several float32 audio chunks.
+
+    The encoder always sees the whole batch. Whisper's decoder needs one prompt and one
+    language per call, so chunks are decoded together per distinct (prompt, language).
+    A chunk without a language gets Whisper's language detection pass.
+    """
+    mels = log_mel_batch(audios, model.dims.n_mels, model.device)
+    with torch.no_grad():
+        features = model.embed_audio(mels)
+
+    groups = {}
+    keys = zip(prompts or [None] * len(audios), languages or [None] * len(audios))
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+
+    results = [None] * len(audios)
+    for (prompt, language), indices in groups.items():
+        decoded = whisper.decode(model, features[indices], replace(options, prompt=prompt, language=language))
+        for i, result in zip(indices, decoded):
+            results[i] = result
+    return results
+
+def decode_chunks(model, audios: List[np.ndarray], prompts: Optional[List[Optional[str]]] = None,
+                  languages: Optional[List[Optional[str]]] = None) -> List[Tuple[str, str]]:
+    """Same as decode_batch, but returns (stripped transcript, language) for each chunk."""
+    results = decode_batch(model, audios, prompts, languages)
+    return [(SPECIAL_TOKEN_PATTERN.sub("", result.text).strip(), result.language) for result in results]
@@ -0,0 +1,23 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+ACTIVE_SESSIONS = Gauge("stt_active_sessions", "Live transcription sessions open on this node")
+SCHEDULER_QUEUE_DEPTH = Gauge("stt_scheduler_queue_depth", "Chunks waiting to be put in a batch")
+SEGMENTS = Counter("stt_segments_total", "Speech segments cut by the VAD in live sessions")
+DROPPED_SEGMENTS = Counter("stt_dropped_segments_total", "Segments discarded by an overflow policy (drop_oldest or partial_only)",
+                           ["policy"])
+DEGRADED_SEGMENTS = Counter("stt_degraded_segments_total", "Segments decoded without context by partial_only")
+UNDECODABLE_PACKETS = Counter("stt_undecodable_packets_total", "Compressed audio packets the codec rejected")
+DECODE_ERRORS = Counter("stt_decode_errors_total", "Batches that failed to decode")
+BATCH_SIZE = Histogram("stt_batch_size", "Chunks per batched decode", buckets=(1, 2, 4, 8, 16, 32))
+BATCH_SECONDS = Histogram("stt_batch_inference_seconds", "Time to decode one batch", buckets=LATENCY_BUCKETS)
+CHUNK_SECONDS = Histogram("stt_chunk_latency_seconds",
+                          "Submit to transcript for one chunk, including cache, queueing and batching",
+                          buckets=LATENCY_BUCKETS)
+REAL_TIME_FACTOR = Histogram("stt_real_time_factor", "Batch decode time over the seconds of audio in it",
+                             buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5))
+FINAL_PASS_SECONDS = Histogram("stt_final_pass_seconds", "Time to re-transcribe one session's audio with the final model",
+                               buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+MODEL_TIER = Gauge("stt_model_tier", "Tier new live chunks go to, 0 being the cheapest model")
+TIER_CHUNKS = Counter("stt_tier_chunks_total", "Live chunks decoded, by model tier", ["tier"])
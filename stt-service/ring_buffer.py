@@ -0,0 +1,90 @@
+import numpy as np
+from typing import List
+
+class PCMRingBuffer:
+    """Preallocated int16 ring buffer addressed by absolute stream position (in samples).
+
+    Reads hand out zero-copy numpy views into the backing array, so audio is copied
+    exactly once on the way in and once more when it is converted for the model.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self.start = 0  # oldest sample still held
+        self.end = 0  # one past the newest sample
+        self._odd_byte = None  # first half of a sample split across two writes
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def free(self) -> int:
+        return self.capacity - len(self)
+
+    def write(self, data) -> int:
+        """Copies as much of `data` (little-endian int16 bytes) as fits; returns bytes consumed."""
+        data = memoryview(data).cast("B")
+        consumed = 0
+        if self._odd_byte is not None:
+            if not data or not self.free:
+                return 0
+            self._put(np.frombuffer(bytes((self._odd_byte, data[0])), dtype=np.int16))
+            self._odd_byte = None
+            consumed = 1
+
+        whole = (len(data) - consumed) // 2
+        count = min(whole, self.free)
+        if count:
+            self._put(np.frombuffer(data, dtype=np.int16, count=count, offset=consumed))
+            consumed += count * 2
+        if count == whole and consumed == len(data) - 1:
+            self._odd_byte = data[consumed]
+            consumed += 1
+        return consumed
+
+    def _put(self, samples: np.ndarray):
+        offset = self.end % self.capacity
+        head = min(len(samples), self.capacity - offset)
+        self._data[offset:offset + head] = samples[:head]
+        self._data[:len(samples) - head] = samples[head:]
+        self.end += len(samples)
+
+    def views(self, start: int, end: int) -> List[np.ndarray]:
+        """Returns the samples in [start, end) as one or two views (two when they wrap)."""
+        if start < self.start or end > self.end:
+            raise IndexError(f"[{start}, {end}) is outside the buffered range [{self.start}, {self.end})")
+        length = end - start
+        if length <= 0:
+            return []
+        offset = start % self.capacity
+        head = min(length, self.capacity - offset)
+        parts = [self._data[offset:offset + head]]
+        if head < length:
+            parts.append(self._data[:length - head])
+        return parts
+
+    def to_float32(self, start: int, end: int, out: np.ndarray) -> np.ndarray:
+        """Converts [start, end) to float32 in [-1, 1) in place in `out`; returns the filled slice."""
+        filled = 0
+        for part in self.views(start, end):
+            np.multiply(part, np.float32(1 / 32768), out=out[filled:filled + len(part)], dtype=np.float32)
+            filled += len(part)
+        return out[:filled]
+
+    def release(self, upto: int):
+        """Frees everything before `upto` for reuse."""
+        self.start = max(self.start, min(upto, self.end))
+
+class Float32Pool:
+    """Reusable per-session float32 scratch arrays, so converting a segment never allocates."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._free: List[np.ndarray] = []
+
+    def acquire(self) -> np.ndarray:
+        return self._free.pop() if self._free else np.empty(self.size, dtype=np.float32)
+
+    def release(self, array: np.ndarray):
+        self._free.append(array)
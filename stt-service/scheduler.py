@@ -0,0 +1,155 @@
+import asyncio
+import time
+import numpy as np
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from transcript_cache import TranscriptCache
+from metrics import BATCH_SECONDS, BATCH_SIZE, CHUNK_SECONDS, DECODE_ERRORS, REAL_TIME_FACTOR
+
+# Every chunk is 16 kHz float32, as Whisper expects
+SAMPLE_RATE = 16000
+
+# (text, language) of one chunk
+Transcript = Tuple[str, str]
+# (audios, prompts, languages) -> one transcript per audio; a None language is detected
+BatchDecoder = Callable[[List[np.ndarray], List[Optional[str]], List[Optional[str]]], Awaitable[List[Transcript]]]
+# (queue wait, batch decode seconds, batch real-time factor) of each decoded chunk
+ChunkObserver = Callable[[float, float, float], None]
+
+class InferenceScheduler:
+    """Gathers pending chunks from all live sessions and decodes them as one batch.
+
+    `decode` runs a whole batch; up to `concurrency` batches may be in flight at once
+    (one per model replica). At most `max_queued` chunks wait across the whole node;
+    beyond that, submitting blocks. With a `cache`, a chunk that was transcribed before
+    (or is being transcribed right now) is never decoded again. `observe` hears the
+    timings of every chunk that was actually decoded, unless it was submitted with
+    `observed=False`.
+    """
+
+    def __init__(self, decode: BatchDecoder, max_batch_size: int = 8, max_wait_ms: int = 50,
+                 concurrency: int = 1, max_queued: int = 0, cache: Optional[TranscriptCache] = None,
+                 observe: Optional[ChunkObserver] = None):
+        self.decode = decode
+        self.cache = cache
+        self.observe = observe
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pending: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._batches = set()
+        self._runner = None
+
+    def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+        for task in list(self._batches):
+            task.cancel()
+        while not self.pending.empty():
+            *_, future = self.pending.get_nowait()
+            if not future.done():
+                future.cancel()
+
+    async def submit(self, audio: np.ndarray, prompt: str = None, language: str = None,
+                     observed: bool = True) -> Transcript:
+        """Queues a chunk for the next batch and waits for its (text, language)."""
+        with CHUNK_SECONDS.time():
+            return await self._submit(audio, prompt, language, observed)
+
+    async def _submit(self, audio: np.ndarray, prompt: Optional[str], language: Optional[str],
+                      observed: bool) -> Transcript:
+        if self.cache is None:
+            return await self._enqueue(audio, prompt, language, observed)
+
+        key = self.cache.key(audio, prompt, language)
+        transcript = await self.cache.get(key)
+        if transcript is not None:
+            return transcript
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.cache.shared += 1
+            return await asyncio.shield(shared)
+
+        shared = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            transcript = await self._enqueue(audio, prompt, language, observed)
+        except BaseException as e:
+            # Anyone who joined this decode needs an answer even if its owner went away
+            shared.set_exception(RuntimeError(f"Shared decode failed: {e!r}"))
+            shared.exception()  # retrieved here, so an unjoined failure isn't logged
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        shared.set_result(transcript)
+        await self.cache.put(key, transcript)
+        return transcript
+
+    async def _enqueue(self, audio: np.ndarray, prompt: Optional[str], language: Optional[str],
+                       observed: bool) -> Transcript:
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((audio, prompt, language, observed, time.perf_counter(), future))
+        return await future
+
+    async def _collect_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.pending.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Sessions that disconnected while waiting don't need their result any more
+        return [item for item in batch if not item[-1].cancelled()]
+
+    async def _run(self):
+        while True:
+            # Chunks keep queueing while every replica is busy, so the next batch is fuller
+            await self._slots.acquire()
+            batch = await self._collect_batch()
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._decode_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _decode_batch(self, batch):
+        print(f"Decoding a batch of {len(batch)} chunk(s)...")
+        audios = [audio for audio, *_ in batch]
+        prompts = [prompt for _, prompt, *_ in batch]
+        languages = [language for _, _, language, *_ in batch]
+        started = time.perf_counter()
+        try:
+            transcripts = await self.decode(audios, prompts, languages)
+        except Exception as e:
+            DECODE_ERRORS.inc()
+            print(f"Error during batched transcription: {e}")
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        elapsed = time.perf_counter() - started
+        BATCH_SIZE.observe(len(batch))
+        BATCH_SECONDS.observe(elapsed)
+        audio_seconds = sum(len(audio) for audio in audios) / SAMPLE_RATE
+        rtf = elapsed / audio_seconds if audio_seconds else 0.0
+        if audio_seconds:
+            REAL_TIME_FACTOR.observe(rtf)
+        for (*_, observed, queued, future), transcript in zip(batch, transcripts):
+            if self.observe and observed:
+                self.observe(started - queued, elapsed, rtf)
+            if not future.done():
+                future.set_result(transcript)
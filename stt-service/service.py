@@ -1,33 +1,227 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
 import uvicorn
 from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect
-import time
-import whisper
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import os
-import tempfile
 from contextlib import asynccontextmanager
 import asyncio
 import numpy as np
 import io
+import json
+import functools
+import tempfile
+import traceback
+from typing import Dict
+# Whisper and torch are imported at startup, not here, so the server starts listening at once
+from scheduler import InferenceScheduler
+from worker_pool import WorkerPool
+from session import TranscriptionSession
+from streaming import OVERFLOW_POLICIES
+from file_transcription import transcribe_upload
+from transcript_cache import TranscriptCache
+from metrics import ACTIVE_SESSIONS, SCHEDULER_QUEUE_DEPTH, TIER_CHUNKS
+from audio_codecs import codec_error
+from final_pass import FinalPassStore
+from tiering import TierController
+from engines import ENGINES, create_engine
 
 # --- Configuration ---
 # This must match what the audio source sends. Whisper expects 16kHz mono.
 SAMPLE_RATE = 16000
-# Process audio in 5-second chunks for a balance of latency and context
+# Longest segment the VAD lets build up before cutting it, for a balance of latency and context
 CHUNK_DURATION_SECONDS = 5
-# Calculate the number of bytes for a 5-second chunk of 16-bit (2-byte) audio
-CHUNK_SIZE_BYTES = CHUNK_DURATION_SECONDS * SAMPLE_RATE * 2
+# A pause this long ends the current segment
+VAD_MIN_SILENCE_MS = int(os.getenv("STT_VAD_MIN_SILENCE_MS", "500"))
+# Frames quieter than this RMS (full scale = 1.0) never count as speech
+VAD_ENERGY_THRESHOLD = float(os.getenv("STT_VAD_ENERGY_THRESHOLD", "0.01"))
+# Audio re-heard by the next segment when one is cut mid-utterance, for local agreement
+STREAM_OVERLAP_MS = int(os.getenv("STT_STREAM_OVERLAP_MS", "1000"))
+# How long the scheduler waits to gather chunks from other sessions into one batch
+BATCH_MAX_WAIT_MS = int(os.getenv("STT_BATCH_MAX_WAIT_MS", "50"))
+# Upper bound on the number of chunks decoded in a single batched pass
+BATCH_MAX_SIZE = int(os.getenv("STT_BATCH_MAX_SIZE", "8"))
+# "thread" decodes on the in-process model; "process" runs a pool of model replicas
+EXECUTION_MODE = os.getenv("STT_EXECUTION_MODE", "thread")
+# Torch intra-op threads per worker process
+WORKER_TORCH_THREADS = int(os.getenv("STT_WORKER_TORCH_THREADS", "2"))
+# Worker processes in "process" mode; by default enough to cover every core
+WORKER_COUNT = int(os.getenv("STT_WORKERS", str(max(1, (os.cpu_count() or 1) // WORKER_TORCH_THREADS))))
+# Model behind live partials and finals (and uploads); small enough to keep up with speech
+MODEL_NAME = os.getenv("WHISPER_LIVE_MODEL") or os.getenv("WHISPER_MODEL", "base")
+# "float32" runs openai-whisper as is; "int8" dynamically quantizes its linear layers (CPU only)
+ENGINE = os.getenv("STT_ENGINE", "float32")
+if ENGINE not in ENGINES:
+    raise ValueError(f"Unknown STT_ENGINE '{ENGINE}'; expected one of: {', '.join(ENGINES)}.")
+# Live model tiers, cheapest first (e.g. "tiny,base,small"); new chunks move down a tier while the
+# latency SLO is at risk and back up once there is headroom. Unset keeps every chunk on the live model.
+MODEL_TIERS = [name.strip() for name in os.getenv("STT_MODEL_TIERS", "").split(",") if name.strip()] or [MODEL_NAME]
+# Submit-to-transcript time of a live chunk that the tier controller keeps under
+LATENCY_SLO_MS = int(os.getenv("STT_LATENCY_SLO_MS", "2000"))
+# Least time between two tier changes, so each step can show its effect
+TIER_HOLD_SECONDS = float(os.getenv("STT_TIER_HOLD_SECONDS", "5"))
+# Larger model that re-transcribes each live session once it closes; unset turns the final pass off
+FINAL_MODEL_NAME = os.getenv("WHISPER_FINAL_MODEL") or None
+# Decode a bit of synthetic audio on every model replica before reporting ready
+WARMUP = os.getenv("STT_WARMUP", "1") == "1"
+# Segments a session may have waiting for the model before the overflow policy applies
+MAX_PENDING_SEGMENTS = int(os.getenv("STT_MAX_PENDING_SEGMENTS", "4"))
+# "block", "drop_oldest" or "partial_only"; a client may ask for another one with ?overflow=
+OVERFLOW_POLICY = os.getenv("STT_OVERFLOW_POLICY", "block")
+# Chunks waiting for the scheduler across all sessions on this node
+SCHEDULER_QUEUE_SIZE = int(os.getenv("STT_SCHEDULER_QUEUE_SIZE", "64"))
+# Live sessions this node accepts before turning new ones away
+MAX_SESSIONS = int(os.getenv("STT_MAX_SESSIONS", "32"))
+# Uploaded files are cut at pauses into segments up to this long (Whisper's window is 30 s)
+FILE_SEGMENT_MAX_SECONDS = 28
+# Segments of one upload decoded at once; this also bounds the upload's memory
+FILE_MAX_INFLIGHT_SEGMENTS = int(os.getenv("STT_FILE_MAX_INFLIGHT_SEGMENTS", "8"))
+# Transcripts kept in memory by audio content; 0 turns the cache off
+CACHE_MAX_ENTRIES = int(os.getenv("STT_CACHE_MAX_ENTRIES", "4096"))
+# Also keep them on disk here, across restarts and shared by replicas on one volume
+CACHE_DIR = os.getenv("STT_CACHE_DIR") or None
+# Live sessions' audio is spilled here as int16 PCM for the final pass
+SPILL_DIR = os.getenv("STT_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "stt-spill")
+# Final passes run at once; each one decodes its segments in batches of FINAL_BATCH_SIZE
+FINAL_CONCURRENCY = int(os.getenv("STT_FINAL_CONCURRENCY", "1"))
+FINAL_BATCH_SIZE = int(os.getenv("STT_FINAL_BATCH_SIZE", "4"))
+# Spilled audio and final transcripts are deleted this long after their session closed
+FINAL_RETENTION_SECONDS = float(os.getenv("STT_FINAL_RETENTION_SECONDS", "900"))
+# Longest a GET /sessions/{id}/final request may hold on for a pass to finish
+FINAL_MAX_WAIT_SECONDS = float(os.getenv("STT_FINAL_MAX_WAIT_SECONDS", "120"))
+
+# --- Model State ---
+# Set up by `start_inference` once the server is already accepting connections
+engines = {}  # in-process engines by model name ("thread" mode only)
+worker_pools = []
+schedulers = []  # one per tier, cheapest first
+transcript_caches = []
+tier_controller = None
+final_passes = None
+ready = False
+startup_error = None  # why the models failed to load, if they did
+active_sessions = 0
+
+ACTIVE_SESSIONS.set_function(lambda: active_sessions)
+SCHEDULER_QUEUE_DEPTH.set_function(lambda: sum(scheduler.pending.qsize() for scheduler in schedulers))
+
+async def decode_on_local_engine(name, audios, prompts, languages):
+    return await asyncio.to_thread(engines[name].transcribe, audios, prompts, languages)
+
+async def start_model(name: str, workers: int):
+    """Loads one model, in-process or as a worker pool; returns its (batch decoder, concurrency)."""
+    if EXECUTION_MODE == "process":
+        # The workers each load their own replica; the parent never needs one
+        pool = WorkerPool(name, workers, WORKER_TORCH_THREADS, ENGINE)
+        await pool.start()
+        worker_pools.append(pool)
+        return pool.decode, workers
+    if name not in engines:
+        print(f"Loading Whisper model '{name}' ({ENGINE})...")
+        # Imports Whisper and torch too, off the event loop
+        engines[name] = await asyncio.to_thread(create_engine, name, ENGINE)
+    return functools.partial(decode_on_local_engine, name), 1
+
+async def start_final_model():
+    """Loads the final-pass model after the live one, so it never delays readiness."""
+    started = time.perf_counter()
+    # In-process, a final model that is also a live tier is shared with it
+    decode, _ = await start_model(FINAL_MODEL_NAME, FINAL_CONCURRENCY)
+    final_passes.start(decode)
+    print(f"Final-pass model '{FINAL_MODEL_NAME}' loaded in {time.perf_counter() - started:.2f} s.")
+
+async def warm_up():
+    """Runs one decode per replica, so first-inference costs are not paid on user audio."""
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal(SAMPLE_RATE) * 0.05).astype(np.float32)
+    replicas = WORKER_COUNT if worker_pools else 1
+    # Bypasses the cache; concurrent batches land on different workers
+    await asyncio.gather(*(
+        scheduler.decode([audio], [None], [None]) for scheduler in schedulers for _ in range(replicas)
+    ))
+
+async def start_inference():
+    global tier_controller, final_passes, ready
+    started = time.perf_counter()
+    from inference import CHUNK_DECODING_OPTIONS
+    tier_controller = TierController(MODEL_TIERS, LATENCY_SLO_MS / 1000, TIER_HOLD_SECONDS)
+    for level, name in enumerate(MODEL_TIERS):
+        decode, concurrency = await start_model(name, WORKER_COUNT)
+        # Keyed by PCM content, model, engine and decode options, so identical audio is never decoded twice
+        cache = None
+        if CACHE_MAX_ENTRIES > 0:
+            model_key = name if ENGINE == "float32" else f"{name}:{ENGINE}"
+            cache = TranscriptCache(f"{model_key}|{CHUNK_DECODING_OPTIONS}", CACHE_MAX_ENTRIES, CACHE_DIR)
+        # All live sessions share each tier's scheduler, so concurrent chunks are decoded together
+        scheduler = InferenceScheduler(
+            decode,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            concurrency=concurrency,
+            max_queued=SCHEDULER_QUEUE_SIZE,
+            cache=cache,
+            observe=functools.partial(tier_controller.observe, level),
+        )
+        scheduler.start()
+        schedulers.append(scheduler)
+        transcript_caches.append(cache)
+    print(f"Whisper model(s) {', '.join(MODEL_TIERS)} loaded in {time.perf_counter() - started:.2f} s.")
+
+    if WARMUP:
+        warmup_started = time.perf_counter()
+        await warm_up()
+        print(f"Warmup decode finished in {time.perf_counter() - warmup_started:.2f} s.")
+
+    if FINAL_MODEL_NAME:
+        # Sessions spill from now on; their passes wait until the final model is loaded
+        final_passes = FinalPassStore(
+            SPILL_DIR,
+            SAMPLE_RATE,
+            max_segment_seconds=FILE_SEGMENT_MAX_SECONDS,
+            energy_threshold=VAD_ENERGY_THRESHOLD,
+            min_silence_ms=VAD_MIN_SILENCE_MS,
+            batch_size=FINAL_BATCH_SIZE,
+            concurrency=FINAL_CONCURRENCY,
+            retention_seconds=FINAL_RETENTION_SECONDS,
+        )
+    ready = True
+    print(f"STT service ready {time.perf_counter() - started:.2f} s after startup began.")
+    if FINAL_MODEL_NAME:
+        await start_final_model()
 
-# --- Model Loading ---
-print("Loading Whisper model...")
-model = whisper.load_model("base")
-print("Whisper model loaded successfully.")
+def on_startup_done(task: asyncio.Task):
+    """Reports a failed model load: /ready says why, and waiting final passes fail."""
+    global startup_error
+    if task.cancelled() or task.exception() is None:
+        return
+    error = task.exception()
+    startup_error = repr(error)
+    print("STT service startup failed:")
+    traceback.print_exception(type(error), error, error.__traceback__)
+    if final_passes:
+        final_passes.fail(startup_error)
 
 # --- Application Lifecycle ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Handles startup and shutdown events for the application."""
+    """Handles startup and shutdown events for the application.
+
+    The model loads in the background: the server answers right away, and /ready
+    reports healthy once the model is loaded and warm.
+    """
     print("AI Debate Judge STT Service is starting up.")
+    startup = asyncio.create_task(start_inference())
+    startup.add_done_callback(on_startup_done)
     yield
+    if not startup.done():
+        startup.cancel()
+    for scheduler in schedulers:
+        await scheduler.stop()
+    if final_passes:
+        await final_passes.stop()
+    for pool in worker_pools:
+        await pool.stop()
     print("AI Debate Judge STT Service is shutting down.")
 
 # --- FastAPI App Initialization ---
@@ -38,122 +232,309 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# --- Helper function for chunk transcription ---
-async def transcribe_chunk(audio_data: bytes):
-    """A helper function to transcribe a single chunk of audio data."""
-    if not audio_data:
-        return ""
-    # Convert raw bytes to a NumPy array that Whisper can process
-    audio_np = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+# --- Helper functions for chunk transcription ---
+async def transcribe_chunk(audio: np.ndarray, prompt: str = None, language: str = None):
+    """Transcribes one live chunk of float32 audio on the tier the controller picks;
+    returns (text, language, tier)."""
+    level = tier_controller.choose()
+    tier = MODEL_TIERS[level]
+    if not audio.size:
+        return "", language, tier
+    TIER_CHUNKS.labels(tier).inc()
     try:
-        def run_transcription():
-            return model.transcribe(audio_np, fp16=False)
-        result = await asyncio.to_thread(run_transcription)
-        return result["text"].strip()
+        text, language = await schedulers[level].submit(audio, prompt, language)
     except Exception as e:
         print(f"Error during chunk transcription: {e}")
-        return ""
+        text = ""
+    return text, language, tier
+
+async def transcribe_file_chunk(audio: np.ndarray, prompt: str = None, language: str = None):
+    """Transcribes one segment of an upload on the best tier; returns (text, language).
+
+    Upload segments run up to Whisper's whole window, so their timings are kept out of
+    the tier controller, which holds live chunks to the latency SLO.
+    """
+    if not audio.size:
+        return "", language
+    try:
+        return await schedulers[-1].submit(audio, prompt, language, observed=False)
+    except Exception as e:
+        print(f"Error during chunk transcription: {e}")
+        return "", language
+
+def language_code(hint: str = None):
+    """Whisper's code for a client language hint ("en", "english", ...), or None to detect it."""
+    if not hint:
+        return None
+    from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+    hint = hint.strip().lower()
+    if hint in LANGUAGES:
+        return hint
+    if hint not in TO_LANGUAGE_CODE:
+        print(f"Ignoring unknown language hint '{hint}'; it will be detected instead.")
+    return TO_LANGUAGE_CODE.get(hint)
+
+# --- Readiness Endpoint ---
+@app.get("/ready", tags=["Health"])
+async def readiness():
+    """Healthy (200) only once the model is loaded and warmed up; 503 until then."""
+    body = {"ready": ready, "model": MODEL_TIERS[-1], "tiers": MODEL_TIERS,
+            "tier": tier_controller.tier if tier_controller else None,
+            "final_model": FINAL_MODEL_NAME, "engine": ENGINE, "execution_mode": EXECUTION_MODE}
+    if startup_error:
+        # Live transcription still works if only the final-pass model failed
+        body["error"] = startup_error
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+# --- Live session helpers ---
+CAPACITY_ERROR = "STT service is at capacity. Try again later."
+NOT_READY_ERROR = "STT service is still loading its model. Try again later."
+
+def admission_error():
+    """Why a new live session can't be admitted right now, or None if it can."""
+    if not ready:
+        return NOT_READY_ERROR
+    if active_sessions >= MAX_SESSIONS:
+        print(f"Rejecting live transcription: {active_sessions} sessions already active.")
+        return CAPACITY_ERROR
+    return None
+
+def open_session(send, overflow_policy: str = None, language: str = None, trace: bool = False,
+                 codec: str = "pcm", session_id: str = None):
+    """Starts a live session; check `admission_error` and `codec_error` first.
+
+    With a `session_id` and a final model, the session's audio is spilled for a final pass.
+    """
+    global active_sessions
+    if overflow_policy not in OVERFLOW_POLICIES:
+        overflow_policy = OVERFLOW_POLICY
+    active_sessions += 1
+    # A node whose final model failed to load has no use for the audio
+    spilling = final_passes is not None and final_passes.error is None
+    spill = final_passes.open(session_id[:64]) if spilling and session_id else None
+    return TranscriptionSession(
+        transcribe_chunk,
+        send,
+        SAMPLE_RATE,
+        max_segment_seconds=CHUNK_DURATION_SECONDS,
+        energy_threshold=VAD_ENERGY_THRESHOLD,
+        min_silence_ms=VAD_MIN_SILENCE_MS,
+        overlap_ms=STREAM_OVERLAP_MS,
+        max_pending=MAX_PENDING_SEGMENTS,
+        overflow_policy=overflow_policy,
+        language=language_code(language),
+        trace=trace,
+        codec=codec,
+        spill=spill,
+    )
+
+def release_session(session: TranscriptionSession):
+    """Frees the session's slot and queues its final pass, whether it finished or was dropped."""
+    global active_sessions
+    active_sessions -= 1
+    if session.spill is not None:
+        final_passes.close(session.spill, session.decoder.language)
 
 # --- LIVE WebSocket Endpoint ---
 @app.websocket("/ws/transcribe")
 async def websocket_transcribe(websocket: WebSocket):
     """Handles real-time audio streaming and transcription over a WebSocket."""
     await websocket.accept()
+
+    async def send(message: dict):
+        try:
+            await websocket.send_json(message)
+        except Exception as e:
+            print(f"Error sending transcript: {e}")
+
+    params = websocket.query_params
+    codec = params.get("codec", "pcm")
+    error = codec_error(codec)
+    if error:
+        await websocket.send_json({"type": "error", "error": error})
+        await websocket.close(code=1003)
+        return
+    error = admission_error()
+    if error:
+        await websocket.send_json({"type": "error", "error": error})
+        await websocket.close(code=1013)
+        return
+    session = open_session(send, params.get("overflow"), params.get("language"), params.get("trace") == "1", codec,
+                           params.get("session"))
     print("WebSocket connection established for live transcription.")
-    audio_buffer = bytearray()
-    transcription_tasks=set()
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                await session.feed(message["bytes"])
+            elif message.get("text"):
+                # The client says it has sent everything; results still flow back before we close
+                if json.loads(message["text"]).get("event") == "end_of_stream":
+                    break
+
+        print("End of stream received. Processing any remaining audio.")
+        await session.finish()
+        await websocket.close()
+        print("Live transcription session finished.")
+
+    except WebSocketDisconnect:
+        print("WebSocket disconnected before end of stream. Dropping pending audio.")
+        await session.close()
+    finally:
+        release_session(session)
+
+# --- Multiplexed LIVE WebSocket Endpoint ---
+@app.websocket("/ws/transcribe/mux")
+async def websocket_transcribe_mux(websocket: WebSocket):
+    """Carries many live audio streams over one WebSocket.
+
+    Binary frames are a 4-byte big-endian stream id followed by PCM, or by one packet of
+    the stream's codec. Text frames are JSON control messages: {"op": "open", "stream": id,
+    "overflow": ..., "language": ..., "trace": ..., "codec": ..., "session": ...}, {"op": "end", "stream": id}
+    to flush a stream and {"op": "abort", "stream": id} to drop it. Every reply carries its
+    "stream" id, and {"op": "closed", "stream": id} follows a stream's last result. Streams
+    share the socket, so a stream blocked by backpressure also holds up the others.
+    """
+    await websocket.accept()
+    print("Multiplexed WebSocket connection established for live transcription.")
+    sessions: Dict[int, TranscriptionSession] = {}
+    finishing = set()
+    send_lock = asyncio.Lock()
+
+    async def send_to(stream_id: int, message: dict):
+        message["stream"] = stream_id
+        try:
+            async with send_lock:
+                await websocket.send_json(message)
+        except Exception as e:
+            print(f"Error sending transcript for stream {stream_id}: {e}")
+
+    async def finish_stream(stream_id: int, session: TranscriptionSession):
+        try:
+            await session.finish()
+        finally:
+            release_session(session)
+        await send_to(stream_id, {"op": "closed"})
+
     try:
         while True:
-            data = await websocket.receive_bytes()
-            audio_buffer.extend(data)
-            # Process audio in chunks as it comes in
-            while len(audio_buffer) >= CHUNK_SIZE_BYTES:
-                chunk_to_process = audio_buffer[:CHUNK_SIZE_BYTES]
-                audio_buffer = audio_buffer[CHUNK_SIZE_BYTES:]
-                
-                print(f"Processing a {CHUNK_DURATION_SECONDS}-second chunk of audio...")
-                task=asyncio.create_task(transcribe_chunk(bytes(chunk_to_process)))
-                transcription_tasks.add(task)
-                def task_done_callback(t:asyncio.Task):
-                    transcription_tasks.discard(t)
-                    if t.exception():
-                        print(f"Task failed: {t.exception()}")
-                        return
-                    transcription_text=t.result()
-                    if transcription_text:
-                        print(f"Partial transcript: {transcription_text}")
-                        asyncio.create_task(websocket.send_json({
-                            "is_final": False,
-                            "text": transcription_text
-                        }))
-                task.add_done_callback(task_done_callback)        
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                data = memoryview(message["bytes"])
+                session = sessions.get(int.from_bytes(data[:4], "big"))
+                if session is not None:
+                    await session.feed(data[4:])
+            elif message.get("text"):
+                control = json.loads(message["text"])
+                stream_id = control.get("stream")
+                if control.get("op") == "open" and stream_id not in sessions:
+                    codec = control.get("codec") or "pcm"
+                    error = codec_error(codec) or admission_error()
+                    if error:
+                        await send_to(stream_id, {"type": "error", "error": error})
+                        await send_to(stream_id, {"op": "closed"})
+                    else:
+                        sessions[stream_id] = open_session(
+                            functools.partial(send_to, stream_id), control.get("overflow"), control.get("language"),
+                            bool(control.get("trace")), codec, control.get("session"),
+                        )
+                elif control.get("op") == "end" and stream_id in sessions:
+                    task = asyncio.create_task(finish_stream(stream_id, sessions.pop(stream_id)))
+                    finishing.add(task)
+                    task.add_done_callback(finishing.discard)
+                elif control.get("op") == "abort" and stream_id in sessions:
+                    session = sessions.pop(stream_id)
+                    await session.close()
+                    release_session(session)
 
     except WebSocketDisconnect:
-        print("WebSocket disconnected. Processing any remaining audio.")
-        if audio_buffer:
-            print(f"Processing final chunck of {len(audio_buffer)} bytes...")
-            final_chunk_task=asyncio.create_task(transcribe_chunk(bytes(audio_buffer)))
-            transcription_tasks.add(final_chunck_task)
-            if transcription_tasks:
-                await asyncio.gather(*transcription_tasks, return_exceptions=True)
-                print("All pending transcription tasks completed.")
-            
-            if 'final_chunk_task' in locals() and final_chunk_task.done():
-                try:
-                    transcription_text = final_chunk_task.result()
-                    if transcription_text:
-                        await websocket.send_json({
-                            "is_final": True,
-                            "text": transcription_text
-                        })
-                except Exception as e:
-                    print(f"Error during final result retrieval: {e}")
-
-            print("Live transcription session finished.")
+        print(f"Multiplexed WebSocket disconnected. Dropping {len(sessions) + len(finishing)} open stream(s).")
+        for task in list(finishing):
+            task.cancel()
+        for session in sessions.values():
+            await session.close()
+            release_session(session)
+
+# --- Metrics Endpoint ---
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    """Prometheus text format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# --- Final Pass Endpoint ---
+@app.get("/sessions/{session_id}/final", tags=["Transcription"])
+async def final_transcript(session_id: str, wait: float = 0):
+    """The final-pass transcript of a live session opened with ?session= (or "session" on mux).
+
+    Each part is one stream that used the id on this node, with its own "status",
+    "segments" and "text". A part still open is transcribed up to the audio heard
+    so far. `?wait=` holds the request up to that many seconds for passes to finish;
+    the reply is 200 once every part is done or failed, 202 while any is pending.
+    """
+    if final_passes is None:
+        return JSONResponse({"error": "The final pass is off on this node (no WHISPER_FINAL_MODEL)."}, status_code=404)
+    parts = await final_passes.result(session_id, min(max(wait, 0), FINAL_MAX_WAIT_SECONDS))
+    if parts is None:
+        return JSONResponse({"error": f"No session '{session_id}' on this node."}, status_code=404)
+    pending = any(part["status"] == "pending" for part in parts)
+    body = {"session_id": session_id, "model": FINAL_MODEL_NAME, "parts": parts}
+    return JSONResponse(body, status_code=202 if pending else 200)
+
+# --- Cache Stats Endpoint ---
+@app.get("/cache/stats", tags=["Transcription"])
+async def cache_stats():
+    """Hit and miss counters of the transcript cache (of the best tier, and per tier if several)."""
+    if not transcript_caches or transcript_caches[-1] is None:
+        return {"enabled": False}
+    body = {"enabled": True, **transcript_caches[-1].stats()}
+    if len(MODEL_TIERS) > 1:
+        body["tiers"] = {name: cache.stats() for name, cache in zip(MODEL_TIERS, transcript_caches)}
+    return body
 
 # --- File Upload Endpoint ---
 @app.post("/transcribe/", tags=["Transcription"])
-async def transcribe_audio(file: UploadFile = File(...)):
-    """Handles transcription of a single uploaded audio file."""
-    start_time = time.time()
+async def transcribe_audio(file: UploadFile = File(...), language: str = None):
+    """Transcribes an uploaded audio file, streaming NDJSON as segments complete.
+
+    Each line is {"index", "start", "end", "text", "decode_seconds"} for one segment, in
+    completion order; the last line is {"done": true, ...} or {"error": ...}.
+    `?language=` pins the language; otherwise it is detected once for the file.
+    """
+    if not ready:
+        return JSONResponse({"error": NOT_READY_ERROR}, status_code=503)
     print(f"Starting transcription for {file.filename}...")
-    
-    # Use asyncio.to_thread for the file writing to keep the event loop non-blocking
-    def sync_write_file(content):
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            temp_file.write(content)
-            return temp_file.name
-
-    content = await file.read()
-    temp_audio_path = await asyncio.to_thread(sync_write_file, content)
-        
-    print(f"Saved temporary audio file to {temp_audio_path}")
-    
-    try:
-        # Use asyncio.to_thread for the main transcription call
-        def sync_transcribe_file():
-            return model.transcribe(temp_audio_path, fp16=False)
 
-        result = await asyncio.to_thread(sync_transcribe_file)
-        transcription_text = result["text"]
-        print("Transcription completed successfully!")
-    except Exception as e:
-        print(f"Error occurred during transcription: {e}")
-        return {"error": "Transcription failed"}
-    finally:
-        # Use asyncio.to_thread for file deletion too
-        await asyncio.to_thread(os.remove, temp_audio_path)
-        print(f"Temporary file {temp_audio_path} deleted")
-        
-    end_time = time.time()
-    processing_time = round(end_time - start_time, 2)
-    print(f"Transcription completed in {processing_time} seconds")
-    
-    return {
-        "filename": file.filename,
-        "transcription": transcription_text,
-        "processing_time_seconds": processing_time,
-    }
+    async def lines():
+        start_time = time.time()
+        try:
+            async for item in transcribe_upload(
+                file.read,
+                transcribe_file_chunk,
+                SAMPLE_RATE,
+                max_segment_seconds=FILE_SEGMENT_MAX_SECONDS,
+                energy_threshold=VAD_ENERGY_THRESHOLD,
+                min_silence_ms=VAD_MIN_SILENCE_MS,
+                max_inflight=FILE_MAX_INFLIGHT_SEGMENTS,
+                language=language_code(language),
+            ):
+                if item.get("done"):
+                    item["filename"] = file.filename
+                    item["processing_time_seconds"] = round(time.time() - start_time, 2)
+                    print(f"Transcription of {file.filename} completed in {item['processing_time_seconds']} seconds")
+                yield json.dumps(item) + "\n"
+        except Exception as e:
+            print(f"Error occurred during transcription: {e}")
+            yield json.dumps({"error": "Transcription failed", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+print(f"STT service module imported in {time.perf_counter() - _IMPORT_STARTED:.2f} s.")
+
 if __name__ == "__main__":
     print("Starting the Uvicorn server for the STT service...")
     uvicorn.run(app, host="0.0.0.0", port=8000)
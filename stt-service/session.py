@@ -0,0 +1,94 @@
+import numpy as np
+from typing import Awaitable, Callable, Optional, Tuple
+from vad import StreamingVAD
+from ring_buffer import PCMRingBuffer, Float32Pool
+from streaming import StreamingDecoder
+from metrics import SEGMENTS
+from audio_codecs import PacketDecoder
+from final_pass import SessionAudio
+
+class TranscriptionSession:
+    """Ingest state for one live audio stream: ring buffer, VAD and in-order decoder.
+
+    With a `codec` other than "pcm", each fed message is a compressed packet that is
+    decoded straight into the ring buffer. With a `spill`, all PCM is also appended
+    there for the final pass.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[np.ndarray, Optional[str], Optional[str]], Awaitable[Tuple[str, str, str]]],
+        send: Callable[[dict], Awaitable[None]],
+        sample_rate: int = 16000,
+        max_segment_seconds: float = 5,
+        energy_threshold: float = 0.01,
+        min_silence_ms: int = 500,
+        overlap_ms: int = 1000,
+        max_pending: int = 4,
+        overflow_policy: str = "block",
+        language: Optional[str] = None,
+        trace: bool = False,
+        codec: str = "pcm",
+        spill: Optional[SessionAudio] = None,
+    ):
+        self.sample_rate = sample_rate
+        self.spill = spill
+        self.packets = PacketDecoder(codec, sample_rate) if codec != "pcm" else None
+        self.vad = StreamingVAD(
+            sample_rate,
+            energy_threshold=energy_threshold,
+            min_silence_ms=min_silence_ms,
+            max_segment_seconds=max_segment_seconds,
+            overlap_ms=overlap_ms,
+        )
+        # The ring must hold the longest segment plus the VAD's lookbehind
+        self.ring = PCMRingBuffer(int(2 * max_segment_seconds * sample_rate))
+        # Scratch arrays fit the longest segment, with a second of slack for padding
+        self.float_pool = Float32Pool(int((max_segment_seconds + 1) * sample_rate))
+        self.decoder = StreamingDecoder(
+            transcribe, send, sample_rate, overlap_ms / 1000,
+            max_pending=max_pending, overflow_policy=overflow_policy, language=language, trace=trace,
+        )
+
+    async def feed(self, data: bytes):
+        """Buffers incoming PCM and queues any speech segments the VAD closes.
+
+        With the "block" overflow policy this waits while the decoder is behind.
+        """
+        if self.packets is not None:
+            data = self.packets.decode(data)
+        await self._ingest(data)
+
+    async def _ingest(self, data: bytes):
+        if self.spill is not None:
+            self.spill.write(data)
+        data = memoryview(data)
+        while data:
+            fed = self.ring.end
+            data = data[self.ring.write(data):]
+
+            # Segments close at a pause or at the max duration; silence never reaches the model
+            for part in self.ring.views(fed, self.ring.end):
+                for start, end, forced in self.vad.feed(part):
+                    await self._submit(start, end, forced)
+            self.ring.release(self.vad.retain_from)
+
+    async def _submit(self, start: int, end: int, forced: bool):
+        SEGMENTS.inc()
+        print(f"Processing a {(end - start) / self.sample_rate:.2f}-second speech segment...")
+        # Convert now, while the samples are still in the ring; the scratch array
+        # goes back to the pool once the segment has been decoded
+        scratch = self.float_pool.acquire()
+        audio = self.ring.to_float32(start, min(end, start + self.float_pool.size), scratch)
+        await self.decoder.submit(audio, start, end, forced, lambda: self.float_pool.release(scratch))
+
+    async def finish(self):
+        """Flushes the last segment and waits until every result has been sent."""
+        if self.packets is not None:
+            await self._ingest(self.packets.flush())
+        for start, end, forced in self.vad.flush():
+            await self._submit(start, end, forced)
+        await self.decoder.finish()
+
+    async def close(self):
+        await self.decoder.close()
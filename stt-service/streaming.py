@@ -0,0 +1,245 @@
+import asyncio
+import math
+import re
+import time
+import numpy as np
+from typing import Awaitable, Callable, List, Optional, Tuple
+from metrics import DEGRADED_SEGMENTS, DROPPED_SEGMENTS
+
+# Whisper's prompt window is ~224 tokens; the last couple of sentences are plenty of context
+PROMPT_MAX_CHARS = 200
+# Committed words kept around for the prompt and for de-duplicating overlaps
+COMMITTED_HISTORY_WORDS = 64
+# What to do with a new segment when the session's decode queue is full
+OVERFLOW_POLICIES = ("block", "drop_oldest", "partial_only")
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+def _agreed_prefix(previous: List[str], current: List[str]) -> int:
+    """Number of leading words on which two hypotheses agree."""
+    count = 0
+    for a, b in zip(previous, current):
+        if _normalize(a) != _normalize(b):
+            break
+        count += 1
+    return count
+
+def _align(unstable: List[str], words: List[str]):
+    """Finds where a new hypothesis starts inside the previous provisional tail.
+
+    Returns (offset, agreed): the tail words before `offset` were not re-heard, and the
+    next `agreed` words are confirmed by both hypotheses.
+    """
+    for offset in range(len(unstable)):
+        agreed = _agreed_prefix(unstable[offset:], words)
+        if agreed:
+            return offset, agreed
+    return len(unstable), 0
+
+def _drop_repeated(committed: List[str], words: List[str], max_ngram: int = 5) -> List[str]:
+    """Drops words at the start of `words` that repeat the end of the committed text."""
+    for n in range(min(max_ngram, len(committed), len(words)), 0, -1):
+        if _agreed_prefix(committed[-n:], words[:n]) == n:
+            return words[n:]
+    return words
+
+class StreamingDecoder:
+    """Decodes one session's segments strictly in order and emits sequence-numbered results.
+
+    The committed text so far is passed as the prompt for the next segment. Segments cut
+    at the max duration overlap the next one; the words in that overlap are sent as a
+    provisional partial (is_final False) and only committed once the next segment's
+    hypothesis agrees with them (local agreement); if it does not, the next hypothesis
+    replaces them, so no stretch of audio is committed twice. Everything else is final
+    as soon as it is decoded, so no audio is ever decoded more than once beyond the overlap.
+
+    At most `max_pending` segments wait for decoding. When a new one arrives on a full
+    queue, the overflow policy decides: "block" makes the caller wait (and so stops it
+    reading from its socket), "drop_oldest" discards the oldest waiting segment, and
+    "partial_only" decodes the new segment straight away without context or ordering
+    and sends it as a degraded partial. At most `max_pending` of those run at once;
+    beyond that, new segments are dropped.
+
+    The language is pinned for the whole session: either the client's hint, or the
+    one Whisper detects on the first segment with speech. Later segments skip detection.
+
+    With `trace`, final results also carry how long their segment waited to be decoded
+    and how long decoding took. Every result names the model "tier" that decoded it.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[np.ndarray, Optional[str], Optional[str]], Awaitable[Tuple[str, str, str]]],
+        send: Callable[[dict], Awaitable[None]],
+        sample_rate: int = 16000,
+        overlap_seconds: float = 1.0,
+        max_pending: int = 4,
+        overflow_policy: str = "block",
+        language: Optional[str] = None,
+        trace: bool = False,
+    ):
+        self.transcribe = transcribe
+        self.trace = trace
+        self.language = language
+        self.send = send
+        self.sample_rate = sample_rate
+        self.overlap_seconds = overlap_seconds
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self.committed: List[str] = []
+        self.unstable: List[str] = []
+        # Leading words of `unstable` estimated to come before the overlap, so never re-heard
+        self._unstable_lead = 0
+        self._next_seq = 0
+        self._last_seq = -1
+        self._prev_end = 0
+        self._last_span = (None, None)
+        self._last_timing = None
+        self._last_tier = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._partials = set()
+        self._worker = asyncio.create_task(self._run())
+
+    @property
+    def prompt(self) -> Optional[str]:
+        return " ".join(self.committed)[-PROMPT_MAX_CHARS:] or None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() + len(self._partials)
+
+    async def submit(self, audio: np.ndarray, start: int, end: int, forced: bool,
+                     on_done: Callable[[], None] = None) -> int:
+        """Queues a segment behind the ones already pending; returns its sequence number."""
+        seq = self._next_seq
+        self._next_seq += 1
+        if self._queue.full():
+            if self.overflow_policy == "drop_oldest":
+                dropped = self._queue.get_nowait()
+                self.dropped += 1
+                DROPPED_SEGMENTS.labels(self.overflow_policy).inc()
+                print(f"Dropping segment {dropped[0]}: {self._queue.maxsize} segments already waiting.")
+                if dropped[-1] is not None:
+                    dropped[-1]()
+            elif self.overflow_policy == "partial_only":
+                if len(self._partials) >= self._queue.maxsize:
+                    self.dropped += 1
+                    DROPPED_SEGMENTS.labels(self.overflow_policy).inc()
+                    print(f"Dropping segment {seq}: {len(self._partials)} degraded partials already decoding.")
+                    if on_done is not None:
+                        on_done()
+                    return seq
+                DEGRADED_SEGMENTS.inc()
+                task = asyncio.create_task(self._decode_partial(seq, audio, on_done))
+                self._partials.add(task)
+                task.add_done_callback(self._partials.discard)
+                return seq
+        await self._queue.put((seq, audio, start, end, forced, time.perf_counter(), on_done))
+        return seq
+
+    async def finish(self):
+        """Decodes everything still queued and commits the provisional tail."""
+        await self._queue.put(None)
+        await self._worker
+        if self._partials:
+            await asyncio.gather(*self._partials, return_exceptions=True)
+
+    async def close(self):
+        """Abandons pending segments (the client went away)."""
+        for task in list(self._partials):
+            task.cancel()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None and item[-1] is not None:
+                item[-1]()
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                await self._emit(self._last_seq, self.unstable, [], self._last_span)
+                return
+            seq, audio, start, end, forced, queued, on_done = item
+            started = time.perf_counter()
+            try:
+                text, language, self._last_tier = await self.transcribe(audio, self.prompt, self.language)
+                if self.language is None and text:
+                    self.language = language
+                    print(f"Pinned session language: {language}")
+            except Exception as e:
+                print(f"Error decoding segment {seq}: {e}")
+                text = ""
+            finally:
+                if on_done is not None:
+                    on_done()
+            self._last_timing = {"queued_ms": round(1000 * (started - queued)),
+                                 "decode_ms": round(1000 * (time.perf_counter() - started))}
+            await self._apply(seq, text.split(), start, end, forced)
+
+    async def _decode_partial(self, seq: int, audio: np.ndarray, on_done: Callable[[], None]):
+        try:
+            text, _, tier = await self.transcribe(audio, None, self.language)
+        finally:
+            if on_done is not None:
+                on_done()
+        if text:
+            print(f"Degraded partial transcript [{seq}]: {text}")
+            await self.send({"seq": seq, "is_final": False, "text": text, "degraded": True,
+                             "queue_depth": self.queue_depth, "tier": tier})
+
+    async def _apply(self, seq: int, words: List[str], start: int, end: int, forced: bool):
+        final = []
+        if start < self._prev_end:
+            # This segment re-heard the tail of the previous one
+            words = _drop_repeated(self.committed, words)
+            offset, agreed = _align(self.unstable, words)
+            if agreed:
+                final, words = self.unstable[:offset + agreed], words[agreed:]
+            else:
+                # The hypotheses disagree on the overlap; the newer one heard it with more
+                # context, so it alone stands for that audio
+                final = self.unstable[:self._unstable_lead]
+                words = _drop_repeated(self.committed + final, words)
+        else:
+            # Nothing will ever revisit the previous tail, so it stands as decoded
+            final = self.unstable
+
+        unstable = []
+        self._unstable_lead = 0
+        if forced and words:
+            duration = (end - start) / self.sample_rate
+            # Words in the overlap at this segment's pace, plus one in case a word straddles its start
+            overlap_words = math.ceil(len(words) * self.overlap_seconds / duration)
+            tail = min(len(words), overlap_words + 1)
+            words, unstable = words[:-tail], words[-tail:]
+            self._unstable_lead = max(0, tail - overlap_words)
+
+        self._prev_end = end
+        self._last_seq = seq
+        self._last_span = (round(start / self.sample_rate, 2), round(end / self.sample_rate, 2))
+        await self._emit(seq, final + words, unstable, self._last_span)
+
+    async def _emit(self, seq: int, final: List[str], unstable: List[str], span=(None, None)):
+        self.unstable = unstable
+        if final:
+            self.committed = (self.committed + final)[-COMMITTED_HISTORY_WORDS:]
+            text = " ".join(final)
+            print(f"Final transcript [{seq}]: {text}")
+            # start/end: seconds into the stream of the segment that settled these words
+            message = {"seq": seq, "is_final": True, "text": text, "start": span[0],
+                       "end": span[1], "language": self.language, "queue_depth": self.queue_depth,
+                       "tier": self._last_tier}
+            if self.trace:
+                message["timing"] = self._last_timing
+            await self.send(message)
+        if unstable:
+            text = " ".join(unstable)
+            print(f"Partial transcript [{seq}]: {text}")
+            await self.send({"seq": seq, "is_final": False, "text": text, "queue_depth": self.queue_depth,
+                             "tier": self._last_tier})
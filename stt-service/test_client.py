@@ -1,42 +1,59 @@
+import json
+import os
+import requests
+
+API_URL = "http://127.0.0.1:8000/transcribe/"
+
 def send_for_transcription(audio_filename):
-    """Sends the audio file to the FastAPI service and prints the response."""
+    """Sends the audio file to the FastAPI service and prints the segments as they stream back."""
     print(f"\n🚀 Sending '{audio_filename}' to the transcription service at {API_URL}...")
-    
+
     try:
-        # Prepare the file for the POST request
+        # Prepare the file for the POST request; the response is NDJSON, one line per segment
         with open(audio_filename, 'rb') as f:
             files = {'file': (audio_filename, f, 'audio/wav')}
-            response = requests.post(API_URL, files=files)
-        
+            response = requests.post(API_URL, files=files, stream=True)
+
         # Check if the request was successful
         if response.status_code == 200:
-            result = response.json()
-            
-            # --- NEW: Check for a server-side error message ---
-            if result.get("error"):
-                print("\n" + "="*50)
-                print("❌ SERVER-SIDE TRANSCRIPTION FAILED")
-                print("="*50)
-                print(f"   The STT service returned this error: {result['error']}")
-            
-            # If no error, print the success
-            elif result.get("transcription") is not None:
-                print("\n" + "="*50)
-                print("✅ TRANSCRIPTION SUCCESSFUL")
-                print("="*50)
-                print(f"🗣️ Text: '{result.get('transcription')}'")
-                print(f"⏱️ Processing Time: {result.get('processing_time_seconds')} seconds")
-            else:
-                print("\n" + "="*50)
-                print("❌ UNKNOWN ERROR")
-                print("="*50)
-                print(f"   The server returned an unexpected JSON: {result}")
-            # --- END OF NEW CODE ---
-                
+            segments = []
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+
+                # A server-side error ends the stream
+                if result.get("error"):
+                    print("\n" + "="*50)
+                    print("❌ SERVER-SIDE TRANSCRIPTION FAILED")
+                    print("="*50)
+                    print(f"   The STT service returned this error: {result['error']} {result.get('detail', '')}")
+                    return
+
+                # The last line sums up the file
+                if result.get("done"):
+                    # Segments arrive in completion order; the transcript reads in audio order
+                    text = " ".join(s["text"] for s in sorted(segments, key=lambda s: s["index"]) if s["text"])
+                    print("\n" + "="*50)
+                    print("✅ TRANSCRIPTION SUCCESSFUL")
+                    print("="*50)
+                    print(f"🗣️ Text: '{text}'")
+                    print(f"🎧 Audio: {result.get('duration_seconds')} seconds in {result.get('segments')} segment(s)")
+                    print(f"⏱️ Processing Time: {result.get('processing_time_seconds')} seconds")
+                    return
+
+                segments.append(result)
+                print(f"   [{result['start']:.1f}-{result['end']:.1f} s] {result['text']}")
+
+            print("\n" + "="*50)
+            print("❌ UNKNOWN ERROR")
+            print("="*50)
+            print("   The stream ended before the server said it was done.")
+
         else:
             print(f"❌ Error: Server returned status code {response.status_code}")
             print(f"Response: {response.text}")
-            
+
     except requests.exceptions.ConnectionError:
         print("\n❌ CONNECTION ERROR: Could not connect to the server.")
         print("Please make sure your 'stt_service.py' is running in another terminal.")
@@ -44,4 +61,4 @@ def send_for_transcription(audio_filename):
         # Clean up the created audio file
         if os.path.exists(audio_filename):
             os.remove(audio_filename)
-            print(f"\n🗑️ Cleaned up temporary file '{audio_filename}'.")
\ No newline at end of file
+            print(f"\n🗑️ Cleaned up temporary file '{audio_filename}'.")
@@ -0,0 +1,81 @@
+import time
+from typing import List, Optional
+from metrics import MODEL_TIER
+
+# Share of the SLO the estimated chunk latency may reach before moving to a cheaper tier
+DOWNSHIFT_AT = 0.8
+# ...and below which the next tier up is tried again
+UPSHIFT_BELOW = 0.4
+# Weight of the newest chunk in the running averages
+EWMA_ALPHA = 0.2
+
+class TierController:
+    """Picks the model tier for new live chunks, keeping chunk latency under the SLO.
+
+    `tiers` are model names, cheapest first; chunks start on the last (best) one. Each
+    decoded chunk reports its queue wait and its batch's decode time and real-time
+    factor, and an exponentially weighted average of wait + decode per tier estimates
+    what the next chunk will see. Past DOWNSHIFT_AT of the SLO, new chunks move one
+    tier down. They move back up once the tier above is expected below UPSHIFT_BELOW:
+    the current wait plus the current decode time scaled by the two tiers' real-time
+    factors, as last measured. After a change the tier is held for `hold_seconds`, so
+    a step has time to show its effect before the next.
+    """
+
+    def __init__(self, tiers: List[str], slo_seconds: float, hold_seconds: float = 5):
+        self.tiers = tiers
+        self.slo = slo_seconds
+        self.hold = hold_seconds
+        self.level = len(tiers) - 1
+        self.changed_at = 0.0
+        # Per tier; wait and decode restart whenever the tier is chosen, RTF is kept
+        self.wait: List[Optional[float]] = [None] * len(tiers)
+        self.decode: List[Optional[float]] = [None] * len(tiers)
+        self.rtf: List[Optional[float]] = [None] * len(tiers)
+        MODEL_TIER.set(self.level)
+
+    @property
+    def tier(self) -> str:
+        return self.tiers[self.level]
+
+    def observe(self, level: int, wait: float, decode: float, rtf: float):
+        """Folds in one decoded chunk of tier `level`."""
+        for averages, value in ((self.wait, wait), (self.decode, decode), (self.rtf, rtf)):
+            previous = averages[level]
+            averages[level] = value if previous is None else previous + EWMA_ALPHA * (value - previous)
+
+    def latency(self, level: int) -> float:
+        """Expected submit-to-transcript time of a chunk on this tier."""
+        return (self.wait[level] or 0.0) + (self.decode[level] or 0.0)
+
+    def latency_above(self) -> float:
+        """What the current load would take on the next tier up."""
+        current, above = self.rtf[self.level], self.rtf[self.level + 1]
+        scale = above / current if current and above else 1.0
+        return (self.wait[self.level] or 0.0) + (self.decode[self.level] or 0.0) * scale
+
+    def choose(self) -> int:
+        """The tier for the next chunk, after stepping down or up if it is time to."""
+        now = time.monotonic()
+        if len(self.tiers) == 1 or now - self.changed_at < self.hold:
+            return self.level
+        if self.decode[self.level] is None:
+            # Nothing decoded on this tier yet, so nothing to go on
+            return self.level
+        estimate = self.latency(self.level)
+        if self.level > 0 and estimate > DOWNSHIFT_AT * self.slo:
+            self._move(self.level - 1, estimate, now)
+        elif self.level < len(self.tiers) - 1 and self.latency_above() < UPSHIFT_BELOW * self.slo:
+            self._move(self.level + 1, self.latency_above(), now)
+        return self.level
+
+    def _move(self, level: int, estimate: float, now: float):
+        rtf = self.rtf[self.level]
+        print(f"Moving live chunks from tier '{self.tier}' to '{self.tiers[level]}': "
+              f"expected latency {1000 * estimate:.0f} ms against a {1000 * self.slo:.0f} ms SLO"
+              f"{f', RTF {rtf:.2f}' if rtf is not None else ''}.")
+        # The new tier's latency was measured under another load; it starts afresh
+        self.wait[level] = self.decode[level] = None
+        self.level = level
+        self.changed_at = now
+        MODEL_TIER.set(level)
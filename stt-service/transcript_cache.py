@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# (text, language)
+Transcript = Tuple[str, str]
+
+class TranscriptCache:
+    """Content-addressed transcripts: an in-memory LRU with an optional on-disk tier.
+
+    Keys hash the exact float32 PCM together with the prompt, the pinned language (if
+    any) and a namespace naming the model and decode options, so a hit is always what
+    the model would have said. Disk entries are one small file each and are never
+    evicted by the service.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 4096, directory: Optional[str] = None):
+        self.namespace = namespace.encode()
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries: "OrderedDict[str, Transcript]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0  # identical chunks that joined a decode already in flight
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, audio: np.ndarray, prompt: Optional[str] = None, language: Optional[str] = None) -> str:
+        digest = hashlib.sha256(self.namespace)
+        digest.update(b"\0" + (prompt or "").encode() + b"\0" + (language or "").encode() + b"\0")
+        digest.update(np.ascontiguousarray(audio, dtype=np.float32).data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _read(self, key: str) -> Optional[Transcript]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text, language = json.load(f)
+            if not isinstance(text, str) or not (language is None or isinstance(language, str)):
+                raise ValueError("not a (text, language) pair")
+            return text, language
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as e:
+            # A damaged entry is a miss; removing it lets the next decode rewrite it
+            print(f"Discarding unreadable transcript cache entry {key}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write(self, key: str, transcript: Transcript):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed, so no reader (or crash) ever leaves half a file at `path`
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(transcript, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def _remember(self, key: str, transcript: Transcript):
+        self._entries[key] = transcript
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Transcript]:
+        transcript = self._entries.get(key)
+        if transcript is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return transcript
+        if self.directory:
+            transcript = await asyncio.to_thread(self._read, key)
+            if transcript is not None:
+                self._remember(key, transcript)
+                self.hits += 1
+                self.disk_hits += 1
+                return transcript
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, transcript: Transcript):
+        self._remember(key, transcript)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._write, key, transcript)
+            except OSError as e:
+                print(f"Could not write transcript cache entry {key}: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "shared_in_flight": self.shared,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "memory_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "directory": self.directory,
+        }
@@ -0,0 +1,128 @@
+import numpy as np
+from typing import List, Tuple
+
+# (start, end, forced): forced segments were cut at the max duration, mid-utterance
+Segment = Tuple[int, int, bool]
+
+class StreamingVAD:
+    """Energy/zero-crossing voice activity detector that cuts a PCM stream into speech segments.
+
+    Sample positions are absolute (counted from the start of the stream), so callers can
+    keep their own buffer and use `retain_from` to know how much of it is still needed.
+    When a segment is cut at the max duration, the next one starts `overlap_ms` before
+    the cut so a word split across the boundary is heard whole at least once.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: int = 30,
+        energy_threshold: float = 0.01,
+        zcr_threshold: float = 0.25,
+        min_silence_ms: int = 500,
+        min_speech_ms: int = 250,
+        max_segment_seconds: float = 5,
+        padding_ms: int = 200,
+        overlap_ms: int = 0,
+    ):
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.energy_threshold = energy_threshold
+        self.zcr_threshold = zcr_threshold
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_segment = int(max_segment_seconds * sample_rate)
+        self.padding = sample_rate * padding_ms // 1000
+        self.overlap = sample_rate * overlap_ms // 1000
+
+        self.noise_floor = 0.0
+        self.position = 0  # samples analysed so far
+        self._remainder = np.empty(0, dtype=np.int16)
+        self._floor = 0  # end of the last closed segment; padding never reaches behind it
+        self.segment_start = None
+        self._continued = False
+        self._last_speech_end = 0
+        self._speech_frames = 0
+        self._silence_run = 0
+
+    @property
+    def retain_from(self) -> int:
+        """First sample that may still belong to a future segment."""
+        if self.segment_start is not None:
+            return self.segment_start
+        if self._continued:
+            return self._floor
+        return max(self._floor, self.position - self.padding)
+
+    def classify(self, frames: np.ndarray) -> np.ndarray:
+        """Flags each row of a (n_frames, frame_size) float32 array as speech or not."""
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frames.shape[1]
+
+        threshold = max(self.energy_threshold, self.noise_floor * 3)
+        # Loud frames are speech regardless; quieter ones only if they are not hiss-like
+        speech = (rms > threshold * 2) | ((rms > threshold) & (zcr < self.zcr_threshold))
+
+        if not speech.all():
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * float(rms[~speech].mean())
+        return speech
+
+    def feed(self, samples: np.ndarray) -> List[Segment]:
+        """Analyses new int16 samples and returns any segments that closed."""
+        if self._remainder.size:
+            samples = np.concatenate((self._remainder, samples))
+        n_frames = len(samples) // self.frame_size
+        usable = n_frames * self.frame_size
+        self._remainder = samples[usable:].copy()
+        if not n_frames:
+            return []
+
+        frames = samples[:usable].reshape(n_frames, self.frame_size).astype(np.float32) / 32768.0
+        speech = self.classify(frames)
+
+        closed = []
+        for i, is_speech in enumerate(speech):
+            frame_start = self.position + i * self.frame_size
+            frame_end = frame_start + self.frame_size
+            if is_speech:
+                if self.segment_start is None:
+                    if self._continued:
+                        self.segment_start = self._floor
+                    else:
+                        self.segment_start = max(self._floor, frame_start - self.padding)
+                    self._speech_frames = 0
+                self._speech_frames += 1
+                self._silence_run = 0
+                self._last_speech_end = frame_end
+            elif self.segment_start is None:
+                self._continued = False
+            else:
+                self._silence_run += 1
+                if self._silence_run >= self.min_silence_frames:
+                    self._close(min(frame_end, self._last_speech_end + self.padding), False, closed)
+                    self._continued = False
+                    continue
+            if self.segment_start is not None and frame_end - self.segment_start >= self.max_segment:
+                self._close(frame_end, True, closed)
+                # Whatever follows is the rest of the same utterance
+                self._continued = True
+                self._floor = frame_end - self.overlap
+
+        self.position += usable
+        return closed
+
+    def flush(self) -> List[Segment]:
+        """Closes the open segment, if any, at the end of the stream."""
+        closed = []
+        if self.segment_start is not None:
+            self._close(min(self.position, self._last_speech_end + self.padding), False, closed)
+        return closed
+
+    def _close(self, end: int, forced: bool, closed: List[Segment]):
+        # Short blips (clicks, coughs) are dropped unless they finish a longer utterance
+        if self._speech_frames >= self.min_speech_frames or self._continued:
+            closed.append((self.segment_start, end, forced))
+        self._floor = end
+        self.segment_start = None
+        self._speech_frames = 0
+        self._silence_run = 0
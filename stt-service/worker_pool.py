@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import sys
+import threading
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Tuple
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Opens a block the parent created, without registering it with the resource tracker.
+
+    The parent owns every block and unlinks it; a registration from here would have the
+    tracker unlink it again, or warn about a leak, when this process exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def _worker_main(conn, model_name: str, engine_kind: str, torch_threads: int):
+    """Entry point of a worker process: loads its own model replica and serves batches."""
+    import torch
+    from engines import create_engine
+
+    # Pin the intra-op pool so N replicas don't oversubscribe the cores between them
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(1)
+    engine = create_engine(model_name, engine_kind)
+    conn.send(("ready", None, None))
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        job_id, shm_name, lengths, prompts, languages = job
+        shm = _attach(shm_name)
+        try:
+            flat = np.ndarray((sum(lengths),), dtype=np.float32, buffer=shm.buf)
+            offsets = np.cumsum([0] + lengths)
+            audios = [flat[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            conn.send((job_id, engine.transcribe(audios, prompts, languages), None))
+        except Exception as e:
+            conn.send((job_id, None, repr(e)))
+        finally:
+            # Views into the block must be gone before it can be closed
+            flat = audios = None
+            shm.close()
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.alive = True  # cleared once its pipe closes; dead workers get no batches
+        self.inflight = 0  # chunks sent and not yet answered
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.reader: Optional[threading.Thread] = None
+
+class WorkerPool:
+    """Whisper model replicas in separate processes, fed through shared memory.
+
+    Each worker pins its torch thread count, and every batch goes to the worker with
+    the fewest chunks in flight. PCM is written once into a shared-memory block and
+    read in place by the worker; only the block name and chunk lengths are pickled.
+    A worker that dies fails its pending batches and is replaced by a fresh process.
+    """
+
+    def __init__(self, model_name: str, workers: int, torch_threads: int = 1, engine: str = "float32"):
+        self.model_name = model_name
+        self.engine = engine
+        self.size = workers
+        self.torch_threads = torch_threads
+        self._workers: List[_Worker] = []
+        self._job_ids = itertools.count()
+        self._loop = None
+        self._stopping = False
+        self._respawns = set()
+
+    def _spawn(self, index: int) -> _Worker:
+        ctx = mp.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.model_name, self.engine, self.torch_threads),
+            name=f"whisper-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return _Worker(process, parent_conn)
+
+    async def _ready(self, worker: _Worker):
+        """Waits for a worker's model to load, then starts reading its results."""
+        await asyncio.to_thread(worker.conn.recv)
+        worker.reader = threading.Thread(target=self._read_results, args=(worker,), daemon=True)
+        worker.reader.start()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._workers = [self._spawn(i) for i in range(self.size)]
+        print(f"Waiting for {self.size} Whisper worker process(es) to load '{self.model_name}'...")
+        for worker in self._workers:
+            await self._ready(worker)
+        print("All Whisper workers are ready.")
+
+    async def _respawn(self, dead: _Worker):
+        index = self._workers.index(dead)
+        await asyncio.to_thread(dead.process.join, 5)
+        while not self._stopping:
+            print(f"Worker {dead.process.name} exited (code {dead.process.exitcode}); starting a new one...")
+            worker = self._spawn(index)
+            try:
+                await self._ready(worker)
+            except (EOFError, OSError) as e:
+                print(f"Replacement for {dead.process.name} failed to start: {e}")
+                await asyncio.sleep(5)
+                continue
+            if self._stopping:
+                worker.conn.send(None)
+            else:
+                self._workers[index] = worker
+                print(f"Worker {worker.process.name} is back.")
+            return
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._respawns:
+            task.cancel()
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self._workers:
+            await asyncio.to_thread(worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._workers.clear()
+
+    def _read_results(self, worker: _Worker):
+        """Runs in a thread per worker and hands results back to the event loop."""
+        while True:
+            try:
+                job_id, transcripts, error = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._resolve, worker, job_id, transcripts, error)
+        self._loop.call_soon_threadsafe(self._fail_all, worker)
+
+    def _resolve(self, worker: _Worker, job_id: int, transcripts, error):
+        future = worker.pending.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(RuntimeError(f"Worker {worker.process.name} failed: {error}"))
+        else:
+            future.set_result(transcripts)
+
+    def _fail_all(self, worker: _Worker):
+        worker.alive = False
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Worker {worker.process.name} exited"))
+        worker.pending.clear()
+        if not self._stopping and worker in self._workers:
+            task = asyncio.create_task(self._respawn(worker))
+            self._respawns.add(task)
+            task.add_done_callback(self._respawns.discard)
+
+    async def decode(self, audios: List[np.ndarray], prompts: List[Optional[str]],
+                     languages: List[Optional[str]]) -> List[Tuple[str, str]]:
+        """Sends one batch to the least-loaded worker and waits for its (text, language) pairs."""
+        live = [worker for worker in self._workers if worker.alive]
+        if not live:
+            raise RuntimeError("No Whisper worker process is running")
+        worker = min(live, key=lambda w: w.inflight)
+        lengths = [len(audio) for audio in audios]
+        shm = shared_memory.SharedMemory(create=True, size=max(1, sum(lengths)) * 4)
+        try:
+            flat = np.ndarray((sum(lengths),), dtype=np.float32, buffer=shm.buf)
+            offset = 0
+            for audio in audios:
+                flat[offset:offset + len(audio)] = audio
+                offset += len(audio)
+            del flat
+
+            job_id = next(self._job_ids)
+            future = self._loop.create_future()
+            worker.pending[job_id] = future
+            worker.inflight += len(audios)
+            try:
+                worker.conn.send((job_id, shm.name, lengths, prompts, languages))
+                return await future
+            finally:
+                worker.pending.pop(job_id, None)
+                worker.inflight -= len(audios)
+        finally:
+            shm.close()
+            shm.unlink()